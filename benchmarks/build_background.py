@@ -0,0 +1,93 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke background mixtures builder
+
+Fits the universal background mixtures used by UBMAdaptedModel from a corpus with one JSON record per line, as
+written by corpus.py, with the data of each record as a sample data URL or as the list of features. The file is
+then set as the ubm_path provider option:
+
+    python benchmarks/corpus.py --learners 500 --format jsonl | \\
+        PYTHONPATH=src python benchmarks/build_background.py --output ubm.bin
+"""
+import argparse
+import json
+import os
+import sys
+
+# the provider only needs the TeSLA CE API when it runs as a worker
+os.environ.setdefault('DEBUG', '1')
+
+# pylint: disable=wrong-import-position
+from tks.provider.models.background import MAX_OBSERVATIONS, MIN_CODE_OBSERVATIONS, BackgroundBuilder, \
+    save_background_bank
+from tks.provider.utils import SampleEnvelope
+
+
+def add_corpus(builder, corpus, kinds=None):
+    """
+        Add the records of a corpus to a background builder
+        :param builder: Background builder
+        :param corpus: Corpus file, one JSON record per line
+        :param kinds: Kinds of records to add, all of them by default
+        :return: Number of records added
+    """
+    records = 0
+    for line in corpus:
+        if len(line.strip()) == 0:
+            continue
+        record = json.loads(line)
+        if kinds is not None and record.get('kind') not in kinds:
+            continue
+        features = record['data']
+        if isinstance(features, str):
+            features = SampleEnvelope(features).decode()
+            if features is None:
+                continue
+        builder.add(features)
+        records += 1
+
+    return records
+
+
+def main(argv=None):
+    """
+        Build a background bank
+        :param argv: Command line arguments
+    """
+    parser = argparse.ArgumentParser(description='TeSLA CE Keystroke background mixtures builder')
+    parser.add_argument('--corpus', help='corpus file, standard input by default')
+    parser.add_argument('--output', required=True, help='background bank file')
+    parser.add_argument('--kinds', nargs='+', help='kinds of records to use, all of them by default')
+    parser.add_argument('--min-observations', type=int, default=MIN_CODE_OBSERVATIONS,
+                        help='minimum observations of a code to fit its own mixture')
+    parser.add_argument('--max-observations', type=int, default=MAX_OBSERVATIONS,
+                        help='maximum observations of each code and feature type used in the fit')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    builder = BackgroundBuilder(args.max_observations, args.seed)
+    if args.corpus is None:
+        records = add_corpus(builder, sys.stdin, args.kinds)
+    else:
+        with open(args.corpus) as corpus:
+            records = add_corpus(builder, corpus, args.kinds)
+
+    bank = builder.build(args.min_observations)
+    save_background_bank(bank, args.output)
+    print(f'{len(bank)} background mixtures from {records} records written to {args.output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
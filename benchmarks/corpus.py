@@ -0,0 +1,249 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke synthetic corpus module
+
+Generates keystroke samples and requests of synthetic learners. All the learners share the codes of a
+language and their frequency, and each learner has its own reproducible timing distribution for each code.
+Corpora are streamed to disk one record per line, so their size is not limited by memory:
+
+    python benchmarks/corpus.py --learners 1000 --samples 15 --requests 50 --features 2000 --output corpus.jsonl
+"""
+import argparse
+import base64
+import json
+import sys
+import numpy as np
+
+DWELL = 1
+FLIGHT = 2
+DIGRAPH = 3
+TRIGRAPH = 4
+FOURGRAPH = 5
+
+#: Letters of each code of each feature type, mean time in milliseconds and share of the features
+FEATURE_TYPES = {
+    DWELL: (1, 100., .18),
+    FLIGHT: (2, 150., .18),
+    DIGRAPH: (2, 250., .36),
+    TRIGRAPH: (3, 400., .18),
+    FOURGRAPH: (4, 550., .10),
+}
+
+#: Letters of the codes
+ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+#: Exponent of the Zipf distribution of the code frequencies
+ZIPF_EXPONENT = 1.1
+
+
+class Language:
+    """
+        Codes of each feature type and their frequency, shared by all the learners of a corpus
+    """
+    def __init__(self, vocabulary=200, seed=0):
+        """
+            Create the codes of a language
+            :param vocabulary: Maximum number of codes of each feature type
+            :type vocabulary: int
+            :param seed: Random seed
+            :type seed: int
+        """
+        rng = np.random.default_rng([seed, 0])
+
+        #: Codes of each feature type, from the most to the least frequent
+        self.codes = {}
+
+        #: Cumulative frequency of the codes of each feature type
+        self.cumulative_frequency = {}
+
+        #: Relative difficulty of each code, scaling its mean time for all the learners
+        self.difficulty = {}
+
+        for feature_type, (n_letters, _, _) in FEATURE_TYPES.items():
+            n_codes = min(vocabulary, len(ALPHABET) ** n_letters)
+            code_ids = rng.choice(len(ALPHABET) ** n_letters, n_codes, replace=False)
+            self.codes[feature_type] = [self._get_code(code_id, n_letters) for code_id in code_ids.tolist()]
+            frequency = 1. / np.arange(1, n_codes + 1) ** ZIPF_EXPONENT
+            self.cumulative_frequency[feature_type] = np.cumsum(frequency / frequency.sum())
+            self.difficulty[feature_type] = rng.lognormal(0, .2, n_codes)
+
+        shares = np.array([share for _, _, share in FEATURE_TYPES.values()])
+
+        #: Feature types and their share of the features
+        self.types = np.array(list(FEATURE_TYPES.keys()))
+        self.type_shares = shares / shares.sum()
+
+    @staticmethod
+    def _get_code(code_id, n_letters):
+        """
+            Get the letters of a code
+            :param code_id: Code number
+            :param n_letters: Letters of the code
+            :return: Code
+        """
+        letters = []
+        for _ in range(n_letters):
+            code_id, letter = divmod(code_id, len(ALPHABET))
+            letters.append(ALPHABET[letter])
+        return ''.join(letters)
+
+
+class LearnerProfile:
+    """
+        Timing distribution of each code of a learner
+    """
+    def __init__(self, language, learner, seed=0):
+        """
+            Create the profile of a learner. The same language, learner and seed always give the same profile.
+            :param language: Language of the corpus
+            :type language: Language
+            :param learner: Learner number
+            :type learner: int
+            :param seed: Random seed
+            :type seed: int
+        """
+        rng = np.random.default_rng([seed, 1, learner])
+
+        #: Language of the learner
+        self.language = language
+
+        #: Learner identifier
+        self.learner_id = 'learner-{:06d}'.format(learner)
+
+        speed = rng.lognormal(0, .25)
+        variability = rng.uniform(.08, .25)
+
+        #: Mean time of each code of each feature type
+        self.means = {}
+
+        #: Time deviation of each code of each feature type
+        self.deviations = {}
+
+        for feature_type, (_, type_time, _) in FEATURE_TYPES.items():
+            n_codes = len(language.codes[feature_type])
+            self.means[feature_type] = type_time * speed * language.difficulty[feature_type] * \
+                rng.lognormal(0, .15, n_codes)
+            self.deviations[feature_type] = self.means[feature_type] * variability
+
+        self._rng = rng
+
+    def get_features(self, n_features):
+        """
+            Type a session of the learner
+            :param n_features: Number of features of the session
+            :type n_features: int
+            :return: List of features, in the format sent by the sensor
+            :rtype: list
+        """
+        language = self.language
+        types = self._rng.choice(language.types, n_features, p=language.type_shares)
+        features = []
+        for feature_type in language.types.tolist():
+            n_type = int((types == feature_type).sum())
+            code_ids = np.searchsorted(language.cumulative_frequency[feature_type], self._rng.random(n_type))
+            code_ids = np.minimum(code_ids, len(language.codes[feature_type]) - 1)
+            times = self._rng.normal(self.means[feature_type][code_ids], self.deviations[feature_type][code_ids])
+            codes = language.codes[feature_type]
+            features += [{'type': feature_type, 'code': codes[code_id], 'time': time}
+                         for code_id, time in zip(code_ids.tolist(), np.maximum(times, 1.).tolist())]
+
+        order = self._rng.permutation(len(features))
+        return [{'features': [features[idx] for idx in order.tolist()]}]
+
+    def get_data_url(self, n_features):
+        """
+            Type a session of the learner, encoded as the data URL of a sample
+            :param n_features: Number of features of the session
+            :type n_features: int
+            :return: Data URL
+            :rtype: str
+        """
+        data = base64.b64encode(json.dumps(self.get_features(n_features)).encode('utf-8')).decode('ascii')
+        return 'data:text/plain;base64,' + data
+
+
+def iter_corpus(learners, samples, requests, features, vocabulary=200, seed=0, data_url=True):
+    """
+        Generate the records of a corpus, one learner after the other
+        :param learners: Number of learners
+        :type learners: int
+        :param samples: Enrolment samples of each learner
+        :type samples: int
+        :param requests: Verification requests of each learner
+        :type requests: int
+        :param features: Features of each sample and request
+        :type features: int
+        :param vocabulary: Maximum number of codes of each feature type
+        :type vocabulary: int
+        :param seed: Random seed
+        :type seed: int
+        :param data_url: Whether to encode the features as a data URL or keep them as a list
+        :type data_url: bool
+        :return: Records with the learner identifier, kind (enrolment or verification), number and data
+        :rtype: generator
+    """
+    language = Language(vocabulary, seed)
+    for learner in range(learners):
+        profile = LearnerProfile(language, learner, seed)
+        for kind, count in (('enrolment', samples), ('verification', requests)):
+            for number in range(count):
+                data = profile.get_data_url(features) if data_url else profile.get_features(features)
+                yield {'learner_id': profile.learner_id, 'kind': kind, 'number': number, 'data': data}
+
+
+def write_corpus(output, learners, samples, requests, features, vocabulary=200, seed=0, data_url=True):
+    """
+        Write a corpus to a file, one JSON record per line
+        :param output: Output file
+        :type output: file
+        :return: Number of records written
+        :rtype: int
+    """
+    records = 0
+    for record in iter_corpus(learners, samples, requests, features, vocabulary, seed, data_url):
+        output.write(json.dumps(record))
+        output.write('\n')
+        records += 1
+    return records
+
+
+def main(argv=None):
+    """
+        Generate a corpus
+        :param argv: Command line arguments
+    """
+    parser = argparse.ArgumentParser(description='TeSLA CE Keystroke synthetic corpus')
+    parser.add_argument('--learners', type=int, default=10)
+    parser.add_argument('--samples', type=int, default=15, help='enrolment samples of each learner')
+    parser.add_argument('--requests', type=int, default=10, help='verification requests of each learner')
+    parser.add_argument('--features', type=int, default=275, help='features of each sample and request')
+    parser.add_argument('--vocabulary', type=int, default=200, help='maximum codes of each feature type')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--format', choices=['data-url', 'jsonl'], default='data-url',
+                        help='data of each record as a sample data URL or as the list of features')
+    parser.add_argument('--output', help='output file, standard output by default')
+    args = parser.parse_args(argv)
+
+    options = (args.learners, args.samples, args.requests, args.features, args.vocabulary, args.seed,
+               args.format == 'data-url')
+    if args.output is None:
+        write_corpus(sys.stdout, *options)
+    else:
+        with open(args.output, 'w') as output:
+            write_corpus(output, *options)
+
+
+if __name__ == '__main__':
+    main()
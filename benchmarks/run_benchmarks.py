@@ -0,0 +1,284 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke benchmark module
+
+Measures enrol, verify and validate_sample latency, the model to_json / load round trip and the model payload
+size of each model, for several request sizes, vocabulary sizes and enrolment history lengths. Runs offline:
+
+    PYTHONPATH=src python benchmarks/run_benchmarks.py --output results.json
+    PYTHONPATH=src python benchmarks/run_benchmarks.py --output new.json --compare results.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+# the provider only needs the TeSLA CE API when it runs as a worker
+os.environ.setdefault('DEBUG', '1')
+
+# pylint: disable=wrong-import-position
+import numpy as np
+from tesla_ce_provider.models.base import Request, Sample
+from tks import TKSProvider
+from corpus import Language, LearnerProfile
+
+#: Models to benchmark
+MODELS = ['GaussianModel', 'GaussianMixturesModel']
+
+#: Features of each request
+REQUEST_SIZES = [250, 1000]
+
+#: Codes of each feature type known by a learner
+VOCABULARY_SIZES = [100, 1000]
+
+#: Enrolment samples in the model before the benchmarked enrolment
+HISTORY_LENGTHS = [5, 20]
+
+#: Percentiles reported for each operation
+PERCENTILES = [50, 90, 99]
+
+
+def _get_sample(data_url, sample_id):
+    """
+        Create an enrolment sample
+        :param data_url: Sample data URL
+        :param sample_id: Sample identifier
+        :return: Sample
+    """
+    return Sample({
+        'id': sample_id,
+        'learner_id': 'benchmark',
+        'data': {
+            'learner_id': 'benchmark',
+            'data': data_url,
+            'instruments': [2],
+            'metadata': {'context': {}, 'mimetype': 'text/plain'}
+        },
+        'validations': None
+    })
+
+
+def _get_request(data_url, request_id):
+    """
+        Create a verification request
+        :param data_url: Sample data URL
+        :param request_id: Request identifier
+        :return: Request
+    """
+    return Request({
+        'id': request_id,
+        'learner_id': 'benchmark',
+        'data': {
+            'learner_id': 'benchmark',
+            'course_id': 1,
+            'activity_id': 1,
+            'session_id': 1,
+            'data': data_url,
+            'instruments': [1],
+            'metadata': {'context': {}, 'mimetype': 'text/plain'}
+        },
+        'result': None,
+        'audit': {}
+    })
+
+
+def _get_stats(latencies):
+    """
+        Summarize the latencies of an operation
+        :param latencies: List of latencies in seconds
+        :return: Number of runs, mean, percentiles and maximum in milliseconds, and throughput in operations
+                 per second
+    """
+    latencies = np.array(latencies) * 1000
+    stats = {
+        'runs': int(latencies.shape[0]),
+        'mean_ms': float(latencies.mean()),
+        'max_ms': float(latencies.max()),
+        'ops_per_s': float(1000 / latencies.mean()),
+    }
+    for percentile in PERCENTILES:
+        stats[f'p{percentile}_ms'] = float(np.percentile(latencies, percentile))
+    return stats
+
+
+def _measure(operation, inputs):
+    """
+        Measure the latency of an operation for each input. Inputs are built before the measure.
+        :param operation: Function to measure
+        :param inputs: List of inputs of the operation
+        :return: Latency statistics
+    """
+    latencies = []
+    for value in inputs:
+        start = time.perf_counter()
+        operation(value)
+        latencies.append(time.perf_counter() - start)
+    return _get_stats(latencies)
+
+
+def run_scenario(model_name, request_size, vocabulary, history, repeat, enrol_repeat, seed):
+    """
+        Benchmark a model for a request size, vocabulary size and enrolment history length
+        :param model_name: Model name
+        :param request_size: Features of each sample and request
+        :param vocabulary: Codes of each feature type
+        :param history: Enrolment samples in the model
+        :param repeat: Runs of the verification and validation operations
+        :param enrol_repeat: Runs of the enrolment operation
+        :param seed: Random seed
+        :return: Scenario results
+    """
+    profile = LearnerProfile(Language(vocabulary, seed), 0, seed)
+
+    provider = TKSProvider()
+    provider.set_options({'model': model_name})
+    cold_provider = TKSProvider()
+    cold_provider.set_options({'model': model_name, 'model_cache_bytes': 0})
+
+    samples = [_get_sample(profile.get_data_url(request_size), idx) for idx in range(history)]
+    model = provider.enrol(samples, model=None).model
+    model_class = provider._get_model_class(None).__class__
+
+    operations = {}
+    # each enrolment starts from a copy of the model, as models are updated in place
+    operations['enrol'] = _measure(
+        lambda value: provider.enrol([value[0]], model=value[1]),
+        [(_get_sample(profile.get_data_url(request_size), history + idx), json.loads(json.dumps(model)))
+         for idx in range(enrol_repeat)])
+
+    # warm the model cache
+    provider.verify(_get_request(profile.get_data_url(request_size), 0), model)
+    operations['verify'] = _measure(
+        lambda request: provider.verify(request, model),
+        [_get_request(profile.get_data_url(request_size), idx) for idx in range(repeat)])
+    operations['verify_cold'] = _measure(
+        lambda request: cold_provider.verify(request, model),
+        [_get_request(profile.get_data_url(request_size), idx) for idx in range(repeat)])
+    operations['validate_sample'] = _measure(
+        lambda sample: provider.validate_sample(sample, 1),
+        [_get_sample(profile.get_data_url(request_size), idx) for idx in range(repeat)])
+
+    payload = json.dumps(model)
+    operations['model_load'] = _measure(lambda value: model_class(json.loads(value)), [payload] * repeat)
+    loaded_model = model_class(json.loads(payload))
+    operations['model_to_json'] = _measure(lambda value: json.dumps(value.to_json()), [loaded_model] * repeat)
+
+    return {
+        'model': model_name,
+        'request_size': request_size,
+        'vocabulary': vocabulary,
+        'history': history,
+        'payload_bytes': len(payload),
+        'data_bytes': len(json.dumps(model['data'])),
+        'operations': operations,
+    }
+
+
+def get_metadata():
+    """
+        Describe the environment of the benchmark
+        :return: Environment description
+    """
+    import sklearn  # pylint: disable=import-outside-toplevel
+
+    commit = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'sklearn': sklearn.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def compare(results, baseline):
+    """
+        Print the p50 latency ratio of each operation against a baseline
+        :param results: Benchmark results
+        :param baseline: Baseline benchmark results
+    """
+    def scenario_key(scenario):
+        return scenario['model'], scenario['request_size'], scenario['vocabulary'], scenario['history']
+
+    baseline_scenarios = {scenario_key(scenario): scenario for scenario in baseline['scenarios']}
+    for scenario in results['scenarios']:
+        base = baseline_scenarios.get(scenario_key(scenario))
+        if base is None:
+            continue
+        ratios = []
+        for operation, stats in scenario['operations'].items():
+            if operation in base['operations']:
+                ratios.append('{} {:.2f}x'.format(operation, stats['p50_ms'] / base['operations'][operation]['p50_ms']))
+        print('{} req={} vocab={} hist={}: {}'.format(*scenario_key(scenario), ', '.join(ratios)))
+
+
+def main(argv=None):
+    """
+        Run the benchmark
+        :param argv: Command line arguments
+    """
+    parser = argparse.ArgumentParser(description='TeSLA CE Keystroke benchmark')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--compare', help='JSON results of a previous build to compare with')
+    parser.add_argument('--models', nargs='+', default=MODELS, choices=MODELS)
+    parser.add_argument('--request-sizes', nargs='+', type=int, default=REQUEST_SIZES)
+    parser.add_argument('--vocabulary-sizes', nargs='+', type=int, default=VOCABULARY_SIZES)
+    parser.add_argument('--history-lengths', nargs='+', type=int, default=HISTORY_LENGTHS)
+    parser.add_argument('--repeat', type=int, default=30, help='runs of verify, validate and (de)serialization')
+    parser.add_argument('--enrol-repeat', type=int, default=5, help='runs of enrol')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    results = {'metadata': get_metadata(), 'scenarios': []}
+    for model_name, request_size, vocabulary, history in itertools.product(
+            args.models, args.request_sizes, args.vocabulary_sizes, args.history_lengths):
+        scenario = run_scenario(model_name, request_size, vocabulary, history, args.repeat, args.enrol_repeat,
+                                args.seed)
+        results['scenarios'].append(scenario)
+        operations = scenario['operations']
+        print('{} req={} vocab={} hist={}: enrol p50 {:.1f} ms, verify p50 {:.2f} ms, cold {:.2f} ms, '
+              'payload {} B'.format(model_name, request_size, vocabulary, history,
+                                    operations['enrol']['p50_ms'], operations['verify']['p50_ms'],
+                                    operations['verify_cold']['p50_ms'], scenario['payload_bytes']),
+              file=sys.stderr)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            compare(results, json.load(baseline_file))
+
+
+if __name__ == '__main__':
+    main()
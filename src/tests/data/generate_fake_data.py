@@ -12,9 +12,12 @@
 #
 #      You should have received a copy of the GNU Affero General Public License
 #      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# Prints one uniform random sample. For corpora of learners with their own timing distributions, use
+# benchmarks/corpus.py
 import base64
 import json
 import random
+import sys
 
 DWELL = 1
 FLIGHT = 2
@@ -22,6 +25,10 @@ DIGRAPH = 3
 TRIGRAPH = 4
 FOURGRAPH = 5
 
+# optional random seed, to generate the same sample again
+if len(sys.argv) > 1:
+    random.seed(int(sys.argv[1]))
+
 generated_data = []
 features = []
 
@@ -53,7 +60,7 @@ for i in range(0, 100):
         'time': random.random()*75   }
     features.append(aux)
 
-# generate 100 TRIGRAPH
+# generate 50 TRIGRAPH
 for i in range(0, 50):
     aux = {
         'type': TRIGRAPH,
@@ -62,10 +69,10 @@ for i in range(0, 50):
     }
     features.append(aux)
 
-# generate 100 FOURGRAPH4
+# generate 25 FOURGRAPH
 for i in range(0, 25):
     aux = {
-        'type': TRIGRAPH,
+        'type': FOURGRAPH,
         'code': available_letters[random.randint(0, len(available_letters) -1)]+available_letters[random.randint(0, len(available_letters) -1)]+available_letters[random.randint(0, len(available_letters) -1)]+available_letters[random.randint(0, len(available_letters) -1)],
         'time': random.random()*125
     }
@@ -0,0 +1,104 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke Test Model Cache Module '''
+from .tks_utils import get_sample, get_request, check_verification_result
+
+
+def test_model_cache_eviction(tks_provider):
+    '''
+    Test the least recently used models are evicted when the cache is full
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.cache import ModelCache
+
+    cache = ModelCache(max_bytes=100)
+    cache.put('a', 'model_a', 40)
+    cache.put('b', 'model_b', 40)
+    assert cache.get('a') == 'model_a'
+
+    cache.put('c', 'model_c', 40)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'model_a'
+    assert cache.get('c') == 'model_c'
+
+    cache.put('d', 'model_d', 200)
+    assert cache.get('d') is None
+
+    cache.set_max_bytes(50)
+    assert len(cache) == 1
+
+    stats = cache.get_stats()
+    assert stats['hits'] == 3
+    assert stats['misses'] == 2
+    assert stats['evictions'] == 2
+    assert stats['bytes'] == 40
+
+
+def test_verification_model_cache(tks_provider, mocker):
+    '''
+    Test verification requests with the same model do not decode it again
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.models import guassian_mixtures_model
+
+    tks_provider.set_options({'model': 'GaussianMixturesModel'})
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    model = tks_provider.enrol(samples=samples, model=None).model
+
+    decode = mocker.spy(guassian_mixtures_model, 'decode_mixture_bank')
+    results = []
+    for _ in range(0, 3):
+        result = tks_provider.verify(get_request(filename='valid_user1'), model)
+        check_verification_result(result)
+        results.append(result.result)
+
+    assert decode.call_count == 1
+    assert results[0] == results[1] == results[2]
+    assert tks_provider._model_cache.get_stats()['hits'] == 2
+
+    tks_provider.set_options({'model_cache_bytes': 0})
+    tks_provider.verify(get_request(filename='valid_user1'), model)
+    assert decode.call_count == 2
+
+
+def test_verification_shared_model_store(tks_provider, tmp_path):
+    '''
+    Test verification with models mapped from the shared model store
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.tks import TKSProvider
+
+    tks_provider.set_options({'model': 'GaussianMixturesModel'})
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    model = tks_provider.enrol(samples=samples, model=None).model
+    expected = tks_provider.verify(get_request(filename='valid_user1'), model)
+
+    options = {'model': 'GaussianMixturesModel', 'model_cache_bytes': 0, 'model_store_path': str(tmp_path)}
+    results = []
+    for _ in range(0, 2):
+        provider = TKSProvider()
+        provider.set_options(options)
+        result = provider.verify(get_request(filename='valid_user1'), model)
+        check_verification_result(result)
+        results.append(result.result)
+
+    assert len(list(tmp_path.glob('*.bin'))) == 1
+    assert results[0] == results[1] == expected.result
+
+    shared_model = provider._load_model(model)
+    assert not shared_model._data.means.flags.writeable
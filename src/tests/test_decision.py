@@ -0,0 +1,158 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke Test Decision Module '''
+import numpy as np
+import pytest
+from .tks_utils import get_sample, get_request, check_verification_result
+
+
+def _reference_walk(config, feature_types, accepted, reject_sign):
+    '''
+    Decision walk as implemented by the models before the decision engine
+    :param config:
+    :param feature_types:
+    :param accepted:
+    :param reject_sign:
+    :return:
+    '''
+    decision_threshold = config['start_decision_threshold']
+    for feature_type, is_accepted in zip(feature_types, accepted):
+        if is_accepted:
+            result_dict = {
+                1: config['result_valid_delta_di'],
+                2: config['result_valid_delta_di'],
+                3: config['result_valid_delta_di'],
+                4: config['result_valid_delta_tri'],
+                5: config['result_valid_delta_four'],
+            }
+        else:
+            result_dict = {
+                1: reject_sign * config['result_invalid_delta_di'],
+                2: reject_sign * config['result_invalid_delta_di'],
+                3: reject_sign * config['result_invalid_delta_di'],
+                4: reject_sign * config['result_invalid_delta_tri'],
+                5: reject_sign * config['result_invalid_delta_four'],
+            }
+        decision_threshold += result_dict[feature_type]
+
+        if decision_threshold < 0:
+            decision_threshold = 0.
+        elif decision_threshold > 1:
+            decision_threshold = 1.
+
+    return decision_threshold
+
+
+def test_decision_engine(tks_provider):
+    '''
+    Test the decision engine gives the same threshold as the original walk
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.decision import DecisionEngine
+
+    random_state = np.random.RandomState(0)
+    for reject_sign in (-1, 1):
+        engine = DecisionEngine(tks_provider.config, reject_sign=reject_sign)
+        for acceptance in (0.1, 0.5, 0.9):
+            feature_types = random_state.randint(1, 6, 1000)
+            accepted = random_state.rand(1000) < acceptance
+
+            decision_threshold, decisions = engine.run(feature_types, accepted)
+
+            assert decision_threshold == _reference_walk(tks_provider.config, feature_types.tolist(),
+                                                         accepted.tolist(), reject_sign)
+            assert sum(count['accepted'] for count in decisions.values()) == accepted.sum()
+            assert sum(count['rejected'] for count in decisions.values()) == (~accepted).sum()
+            assert decisions['dwell']['accepted'] == (accepted & (feature_types == 1)).sum()
+
+
+def test_verification_decisions_audit(tks_provider):
+    '''
+    Test the verification audit contains the decision counts
+    :param tks_provider:
+    :return:
+    '''
+    tks_provider.set_options({'model': 'GaussianModel'})
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    model = tks_provider.enrol(samples=samples, model=None).model
+
+    result = tks_provider.verify(get_request(filename='valid_user1'), model)
+    check_verification_result(result)
+
+    decisions = result.audit['decisions']
+    evaluated = sum(count['accepted'] + count['rejected'] for count in decisions.values())
+    assert evaluated == result.audit['num_features'] - result.audit['num_samples_discarded']
+
+
+def test_decision_engine_early_decision(tks_provider):
+    '''
+    Test the early decision gives the same threshold as walking all the features, scoring fewer of them
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.decision import DecisionEngine
+
+    random_state = np.random.RandomState(0)
+    engine = DecisionEngine(dict(tks_provider.config, early_decision=True))
+    scored = []
+
+    def score(start, end):
+        scored.append(end - start)
+        return accepted[start:end]
+
+    for acceptance in (0.1, 0.45, 0.5, 0.55, 0.9):
+        for n_features in (10, 256, 1000, 5000):
+            feature_types = random_state.randint(1, 6, n_features)
+            accepted = random_state.rand(n_features) < acceptance
+            scored.clear()
+
+            decision_threshold, decisions, evaluated = engine.run_sequential(feature_types, score)
+
+            assert decision_threshold == _reference_walk(tks_provider.config, feature_types.tolist(),
+                                                         accepted.tolist(), -1)
+            assert evaluated == sum(scored)
+            assert sum(count['accepted'] + count['rejected'] for count in decisions.values()) == evaluated
+            if acceptance in (0.1, 0.9) and n_features == 5000:
+                assert evaluated < n_features
+
+
+@pytest.mark.parametrize('model_name', ['GaussianModel', 'GaussianMixturesModel'])
+def test_verification_early_decision(tks_provider, model_name):
+    '''
+    Test the early decision gives the same verification result and reports the scored features
+    :param tks_provider:
+    :param model_name:
+    :return:
+    '''
+    tks_provider.set_options({'model': model_name, 'early_decision': False})
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    model = tks_provider.enrol(samples=samples, model=None).model
+
+    for filename in ['valid_user1', 'valid_user2']:
+        tks_provider.set_options({'early_decision': False})
+        expected = tks_provider.verify(get_request(filename=filename), model)
+        assert 'evaluated_features' not in expected.audit
+
+        tks_provider.set_options({'early_decision': True})
+        result = tks_provider.verify(get_request(filename=filename), model)
+        check_verification_result(result)
+
+        assert result.result == expected.result
+        assert result.code == expected.code
+        evaluated = result.audit['evaluated_features']
+        assert 0 < evaluated <= result.audit['num_features'] - result.audit['num_samples_discarded']
+        assert sum(count['accepted'] + count['rejected'] for count in result.audit['decisions'].values()) == \
+            evaluated
@@ -0,0 +1,303 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke Test Enrolment Module '''
+from .tks_utils import get_sample, get_request, check_enrolment_result, check_verification_result
+
+
+def test_mixtures_refit_dirty_codes(tks_provider):
+    '''
+    Test only the codes with new observations are refitted
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider import utils
+    from tks.provider.models import GaussianMixturesModel
+
+    sample_user1 = get_sample(filename='valid_user1', sample_id=1)
+    sample_user2 = get_sample(filename='valid_user2', sample_id=2)
+
+    tks_model = GaussianMixturesModel()
+    for _ in range(0, 3):
+        features = tks_model.enrol(utils.get_sample_ks(sample_user1))
+        tks_model.add_sample(sample_user1, features)
+    fitted = {code: (tks_model._data.get_count(code), tks_model._data.means[row].copy())
+              for row, code in enumerate(tks_model._data.codes)}
+
+    features = tks_model.enrol(utils.get_sample_ks(sample_user2))
+    tks_model.add_sample(sample_user2, features)
+
+    assert len(fitted) > 0
+    for code, (count, means) in fitted.items():
+        row = tks_model._data.codes.index(code)
+        if code in features:
+            assert tks_model._data.get_count(code) == count + len(features[code])
+        else:
+            assert tks_model._data.get_count(code) == count
+            assert (tks_model._data.means[row] == means).all()
+
+
+def test_mixtures_batch_enrolment(tks_provider):
+    '''
+    Test enrolment of several samples in a single call
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.models.history import decode_history
+
+    tks_provider.set_options({'model': 'GaussianMixturesModel'})
+
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    result = tks_provider.enrol(samples=samples, model=None)
+    check_enrolment_result(result)
+
+    assert result.valid
+    assert result.percentage == 1
+    assert result.used_samples == list(range(0, 15))
+    assert len(result.model['samples']) == 15
+    samples_features = decode_history(result.model['history'])
+    assert len(samples_features) == 15
+    for features in samples_features:
+        assert len(features) > 0
+        assert features == samples_features[0]
+
+    request = get_request(filename='valid_user1')
+    result = tks_provider.verify(request, result.model)
+    check_verification_result(result)
+
+    assert result.code == result.AlertCode.OK
+    assert result.result > 0.9
+
+
+def test_mixtures_parallel_fit(tks_provider):
+    '''
+    Test the mixtures fitted by the worker processes match the serial fit
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.models import GaussianMixturesModel
+
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 10)]
+
+    tks_provider.set_options({'model': 'GaussianMixturesModel'})
+    serial_model = GaussianMixturesModel(tks_provider.enrol(samples=samples, model=None).model)
+
+    tks_provider.set_options({'model': 'GaussianMixturesModel', 'fit_workers': 2, 'fit_parallel_min_codes': 1})
+    result = tks_provider.enrol(samples=samples, model=None)
+    check_enrolment_result(result)
+    parallel_model = GaussianMixturesModel(result.model)
+
+    assert parallel_model._data.codes == serial_model._data.codes
+    assert (parallel_model._data.counts == serial_model._data.counts).all()
+
+    result = tks_provider.verify(get_request(filename='valid_user1'), result.model)
+    check_verification_result(result)
+
+    assert result.code == result.AlertCode.OK
+    assert result.result > 0.9
+
+
+def _enrol_in_worker(options):
+    '''
+    Enrol a model in a worker process
+    :param options: Provider options
+    :return: Whether the worker process is daemonic and the enrolled model
+    '''
+    import billiard
+    from tks import TKSProvider
+
+    provider = TKSProvider()
+    provider.set_options(options)
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 10)]
+    return billiard.current_process().daemon, provider.enrol(samples=samples, model=None).model
+
+
+def test_mixtures_parallel_fit_in_daemonic_worker(tks_provider):
+    '''
+    Test the mixtures are fitted in parallel from the daemonic worker processes of a Celery prefork worker
+    :param tks_provider:
+    :return:
+    '''
+    import billiard
+    from tks.provider.models import GaussianMixturesModel
+
+    options = {'model': 'GaussianMixturesModel', 'fit_workers': 2, 'fit_parallel_min_codes': 1}
+    with billiard.Pool(processes=1) as pool:
+        daemon, model = pool.apply(_enrol_in_worker, (options,))
+
+    assert daemon
+    assert len(GaussianMixturesModel(model)._data) > 0
+
+    tks_provider.set_options(options)
+    result = tks_provider.verify(get_request(filename='valid_user1'), model)
+    check_verification_result(result)
+    assert result.code == result.AlertCode.OK
+
+
+def test_mixtures_fit_time_budget_refit(tks_provider, tmp_path):
+    '''
+    Test the codes deferred by the fit time budget are fitted by a notification task, and the model can not
+    analyse until they are fitted
+    :param tks_provider:
+    :param tmp_path:
+    :return:
+    '''
+    from tks import TKSProvider
+
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    tks_provider.set_options({'model': 'GaussianMixturesModel', 'fit_time_budget': 0})
+    tks_provider.notifications.clear()
+    result = tks_provider.enrol(samples=samples, model=None)
+    assert len(result.model['deferred_codes']) > 0
+    assert not result.can_analyse
+    assert len(tks_provider.notifications) == 0
+
+    # the features of the deferred codes are discarded
+    verification = tks_provider.verify(get_request(filename='valid_user1'), result.model)
+    check_verification_result(verification)
+    assert verification.code == verification.AlertCode.ALERT
+
+    options = {'model': 'GaussianMixturesModel', 'fit_time_budget': 0, 'model_store_path': str(tmp_path)}
+    tks_provider.set_options(options)
+    result = tks_provider.enrol(samples=samples, model=None)
+    assert not result.can_analyse
+    assert len(tks_provider.notifications) == 1
+    notification = tks_provider.notifications.pop()
+
+    worker = TKSProvider()
+    worker.set_options(options)
+    worker.on_notification(notification.key, notification.info)
+    refit = worker.delayed_results.pop().result
+    assert refit.can_analyse
+    assert 'deferred_codes' not in refit.model
+
+    verification = tks_provider.verify(get_request(filename='valid_user1'), refit.model)
+    check_verification_result(verification)
+    assert verification.code == verification.AlertCode.OK
+    assert verification.result > 0.9
+
+
+def test_mixtures_batch_em_fit(tks_provider):
+    '''
+    Test the mixtures fitted by the batched EM are as likely as the sklearn fits
+    :param tks_provider:
+    :return:
+    '''
+    import numpy as np
+    from tks.provider.models import GaussianMixturesModel
+    from tks.provider.models.guassian_mixtures_model import _get_train_array
+    from tks.provider.models.history import decode_history
+
+    samples = [get_sample(filename=filename, sample_id=idx) for idx in range(0, 5)
+               for filename in ['valid_user1', 'valid_user2']]
+
+    log_likelihoods = {}
+    for backend in ['sklearn', 'batch_em']:
+        tks_provider.set_options({'model': 'GaussianMixturesModel', 'fit_backend': backend})
+        result = tks_provider.enrol(samples=samples, model=None)
+        check_enrolment_result(result)
+        tks_model = GaussianMixturesModel(result.model)
+
+        codes = {}
+        for features in decode_history(result.model['history']):
+            for code, x_train in features.items():
+                codes.setdefault(code, []).extend(x_train)
+        log_likelihoods[backend] = {code: tks_model._data.score_samples(code, _get_train_array(x_train)).mean()
+                                    for code, x_train in codes.items() if code in tks_model._data}
+
+    assert log_likelihoods['batch_em'].keys() == log_likelihoods['sklearn'].keys()
+    diff = [log_likelihoods['batch_em'][code] - log_likelihoods['sklearn'][code]
+            for code in log_likelihoods['sklearn']]
+    assert np.mean(diff) > -0.05
+
+    result = tks_provider.verify(get_request(filename='valid_user1'), result.model)
+    check_verification_result(result)
+
+    assert result.code == result.AlertCode.OK
+    assert result.result > 0.9
+
+
+def test_mixtures_max_code_observations(tks_provider):
+    '''
+    Test the stored observations of each code are limited
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.models.history import decode_history
+
+    tks_provider.set_options({'model': 'GaussianMixturesModel', 'max_code_observations': 20})
+
+    model = tks_provider.enrol(samples=[get_sample(filename='valid_user1', sample_id=0)], model=None).model
+    code_observations = {code: len(x_train) for code, x_train in decode_history(model['history'])[0].items()}
+
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(1, 15)]
+    result = tks_provider.enrol(samples=samples, model=model)
+    check_enrolment_result(result)
+
+    assert result.percentage == 1
+    assert result.used_samples == list(range(0, 15))
+
+    stored = {}
+    for features in decode_history(result.model['history']):
+        for code, x_train in features.items():
+            stored[code] = stored.get(code, 0) + len(x_train)
+    assert stored.keys() == code_observations.keys()
+    for code, count in code_observations.items():
+        assert result.model['observations_seen'][code] == 15 * count
+        assert stored[code] == min(20, 15 * count)
+
+    result = tks_provider.verify(get_request(filename='valid_user1'), result.model)
+    check_verification_result(result)
+
+    assert result.code == result.AlertCode.OK
+    assert result.result > 0.9
+
+
+def test_mixtures_fit_time_budget(tks_provider):
+    '''
+    Test the codes with more observations are fitted first and the others are deferred to the next enrolment
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.models import GaussianMixturesModel
+    from tks.provider.models.guassian_mixtures_model import BUDGET_BATCH_CODES
+    from tks.provider.models.history import decode_history
+
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 10)]
+    tks_provider.set_options({'model': 'GaussianMixturesModel'})
+    full_model = GaussianMixturesModel(tks_provider.enrol(samples=samples, model=None).model)
+
+    for backend, fitted_codes in [('sklearn', 1), ('batch_em', BUDGET_BATCH_CODES)]:
+        tks_provider.set_options({'model': 'GaussianMixturesModel', 'fit_backend': backend, 'fit_time_budget': 0})
+        result = tks_provider.enrol(samples=samples, model=None)
+        check_enrolment_result(result)
+        tks_model = GaussianMixturesModel(result.model)
+
+        observations = {}
+        for features in decode_history(result.model['history']):
+            for code, x_train in features.items():
+                observations[code] = observations.get(code, 0) + len(x_train)
+        assert len(tks_model._data) == fitted_codes
+        assert len(result.model['deferred_codes']) == len(full_model._data) - fitted_codes
+        assert min(observations[code] for code in tks_model._data.codes) >= \
+            max(observations[code] for code in result.model['deferred_codes'])
+
+        # the next enrolment fits the deferred codes
+        tks_provider.set_options({'fit_time_budget': None})
+        result = tks_provider.enrol(samples=[], model=result.model)
+        check_enrolment_result(result)
+        tks_model = GaussianMixturesModel(result.model)
+
+        assert 'deferred_codes' not in result.model
+        assert sorted(tks_model._data.codes) == sorted(full_model._data.codes)
@@ -0,0 +1,64 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke Test Features Module '''
+import base64
+import json
+from .tks_utils import get_sample
+
+
+def test_keystroke_features_grouping(tks_provider):
+    '''
+    Test the columnar features keep the grouping and order of the sample features
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider import utils
+
+    features = utils.get_sample_ks(get_sample(filename='valid_user1'))
+    ks_array = json.loads(base64.b64decode(get_sample(filename='valid_user1').data.split(',')[1]))
+
+    codes = {}
+    number_features = 0
+    for feature_array in ks_array:
+        for feature in feature_array['features']:
+            codes.setdefault(f"{feature['type']}_{feature['code']}", []).append(feature['time'])
+            number_features += 1
+
+    assert len(features) == number_features
+    assert features.get_code_times() == codes
+    assert list(features.get_code_times().keys()) == list(codes.keys())
+
+    order, offsets = features.group_by_code()
+    for code_id, key in enumerate(features.keys):
+        assert features.times[order[offsets[code_id]:offsets[code_id + 1]]].tolist() == codes[key]
+        assert (features.types[order[offsets[code_id]:offsets[code_id + 1]]] == int(key.split('_')[0])).all()
+
+
+def test_keystroke_features_invalid_types(tks_provider):
+    '''
+    Test samples with feature types that are not small integers are not valid
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider import utils
+    from .tks_utils import get_request
+
+    for feature_type in [300, -200, 1.5, '1', True]:
+        ks_array = [{'features': [{'type': 1, 'code': 65, 'time': 100}, {'type': feature_type, 'code': 65,
+                                                                          'time': 100}]}]
+        ks_data = base64.b64encode(json.dumps(ks_array).encode('utf-8')).decode('ascii')
+        request = get_request(ks_data=ks_data, data_mimetype='text/plain')
+        assert utils.get_sample_ks(request) is None
+        assert not utils.check_sample_ks(request, tks_provider.accepted_mimetypes)['valid']
@@ -0,0 +1,79 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke Test Metrics Module '''
+from .tks_utils import get_sample, get_request, check_verification_result
+
+
+def test_metrics_sink(tks_provider):
+    '''
+    Test the phases and counts of the provider operations are sent to the metrics sink
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.metrics import InMemoryMetricsSink
+
+    tks_provider.set_options({'model': 'GaussianMixturesModel', 'metrics_enabled': False})
+    assert tks_provider.get_metrics_sink() is None
+
+    sink = InMemoryMetricsSink()
+    tks_provider.set_metrics_sink(sink)
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    model = tks_provider.enrol(samples=samples, model=None).model
+    verification = tks_provider.verify(get_request(filename='valid_user1'), model)
+    check_verification_result(verification)
+    tks_provider.verify(get_request(request_mimetype='image/jpeg'), model)
+
+    labels = (('model', 'GaussianMixturesModel'), ('operation', 'verify'))
+    assert sink.observations[('tks_operation_seconds', labels)][0] == 2
+    for phase in ['model_load', 'payload_decode', 'json_loads', 'feature_parse', 'code_lookup', 'score',
+                  'decision', 'result']:
+        assert ('tks_phase_seconds', labels + (('phase', phase),)) in sink.observations
+    assert sink.counters[('tks_requests_total', labels)] == 1
+    assert sink.counters[('tks_invalid_requests_total', labels)] == 1
+    assert sink.counters[('tks_features_total', labels)] == verification.audit['num_features']
+    assert sink.counters[('tks_discarded_features_total', labels)] == verification.audit['num_samples_discarded']
+    assert 'metrics' not in verification.audit
+
+    enrol_labels = (('model', 'GaussianMixturesModel'), ('operation', 'enrol'))
+    assert sink.counters[('tks_samples_total', enrol_labels)] == 15
+    for phase in ['enrol', 'fit', 'to_json']:
+        assert ('tks_phase_seconds', enrol_labels + (('phase', phase),)) in sink.observations
+
+    exported = sink.to_prometheus()
+    assert '# TYPE tks_phase_seconds summary' in exported
+    assert 'tks_requests_total{model="GaussianMixturesModel",operation="verify"} 1\n' in exported
+
+    tks_provider.set_metrics_sink(None)
+    tks_provider.verify(get_request(filename='valid_user1'), model)
+    assert sink.counters[('tks_requests_total', labels)] == 1
+
+
+def test_metrics_audit(tks_provider):
+    '''
+    Test the timings of a verification are attached to its audit when enabled
+    :param tks_provider:
+    :return:
+    '''
+    tks_provider.set_options({'model': 'GaussianModel', 'metrics_audit': True})
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    model = tks_provider.enrol(samples=samples, model=None).model
+
+    verification = tks_provider.verify(get_request(filename='valid_user1'), model)
+    check_verification_result(verification)
+    metrics = verification.audit['metrics']
+    assert metrics['counts']['features'] == verification.audit['num_features']
+    assert metrics['counts']['codes'] > 0
+    assert set(metrics['phases_ms']) >= {'model_load', 'code_lookup', 'score', 'decision'}
+    assert metrics['total_ms'] >= sum(metrics['phases_ms'].values()) - 1e-6
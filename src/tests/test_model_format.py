@@ -0,0 +1,221 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke Test Model Format Module '''
+import base64
+from io import BytesIO
+import numpy as np
+from .tks_utils import get_sample, get_request, check_verification_result
+
+
+def _get_legacy_model():
+    '''
+    Get a model with the mixtures stored as a joblib dump of sklearn objects
+    :return:
+    '''
+    from joblib import dump
+    from sklearn import mixture
+
+    data = {}
+    for code, mean in (('1_A', 0.01), ('3_AB', 0.05)):
+        clf = mixture.GaussianMixture(n_components=3, covariance_type='full')
+        clf.fit(np.random.RandomState(0).normal(mean, 0.005, 20).reshape(-1, 1))
+        data[code] = clf
+
+    with BytesIO() as tmp_bytes:
+        dump(data, tmp_bytes)
+        encoded = base64.b64encode(tmp_bytes.getvalue()).decode('utf-8')
+
+    return data, {'percentage': 1, 'samples': [], 'data': encoded}
+
+
+def test_legacy_model_conversion(tks_provider):
+    '''
+    Test models stored with joblib are converted to the binary format
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.models import GaussianMixturesModel
+    from tks.provider.models.mixture_bank import MODEL_MAGIC
+
+    mixtures, legacy_model = _get_legacy_model()
+    tks_model = GaussianMixturesModel(legacy_model)
+
+    x_test = np.linspace(0, 0.1, 50).reshape(-1, 1)
+    for code, clf in mixtures.items():
+        assert code in tks_model._data
+        assert np.allclose(tks_model._data.score_samples(code, x_test), clf.score_samples(x_test), rtol=1e-4)
+
+    model = tks_model.to_json()
+    assert base64.b64decode(model['data']).startswith(MODEL_MAGIC)
+    assert len(model['data']) < len(legacy_model['data'])
+
+    reloaded = GaussianMixturesModel(model)
+    assert reloaded._data.codes == tks_model._data.codes
+    assert np.allclose(reloaded._data.means, tks_model._data.means)
+
+
+def test_binary_model_round_trip(tks_provider):
+    '''
+    Test enrolled models are stored in the binary format and can be used to verify
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.models.mixture_bank import MODEL_MAGIC
+
+    tks_provider.set_options({'model': 'GaussianMixturesModel'})
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    model = tks_provider.enrol(samples=samples, model=None).model
+
+    assert base64.b64decode(model['data']).startswith(MODEL_MAGIC)
+
+    result = tks_provider.verify(get_request(filename='valid_user1'), model)
+    check_verification_result(result)
+    assert result.result > 0.9
+
+
+def test_mixture_bank_vectorized_scoring(tks_provider):
+    '''
+    Test the vectorized scoring of all the codes matches the scoring of each code
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.models.guassian_mixtures_model import N_COMPONENTS
+    from tks.provider.models import GaussianMixturesModel
+
+    tks_model = GaussianMixturesModel(_get_legacy_model()[1])
+    bank = tks_model._data
+    assert bank.n_components == N_COMPONENTS
+
+    x_test = np.linspace(0, 0.1, 20)
+    rows = np.repeat(bank.get_rows(bank.codes), len(x_test))
+    scores = bank.score_rows(rows, np.tile(x_test, len(bank.codes)))
+    for idx, code in enumerate(bank.codes):
+        assert np.allclose(scores[idx * len(x_test):(idx + 1) * len(x_test)], bank.score_samples(code, x_test))
+
+
+def test_enrolment_history(tks_provider, mocker):
+    '''
+    Test the enrolment history is encoded and only decoded by enrolment
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.models import guassian_mixtures_model
+    from tks.provider.models.history import encode_history, decode_history
+
+    samples = [
+        {'id': 1, 'features': {'1_65': [120.7, -33.2, 5000.9], '2_66': [1.0]}},
+        {'id': 2, 'features': {}},
+        {'id': 3, 'features': {'1_65': [10.0]}},
+    ]
+    assert decode_history(encode_history(samples)) == [
+        {'1_65': [-33, 120, 5000], '2_66': [1]},
+        {},
+        {'1_65': [10]},
+    ]
+
+    # codes are not separated by a character, so any code is kept
+    samples = [{'id': 1, 'features': {'1_\n': [10.0], '1_': [20.0], '2_\n\n': [30.0]}}]
+    assert decode_history(encode_history(samples)) == [{'1_\n': [10], '1_': [20], '2_\n\n': [30]}]
+
+    tks_provider.set_options({'model': 'GaussianMixturesModel'})
+    enrol_samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 10)]
+    model = tks_provider.enrol(samples=enrol_samples, model=None).model
+    assert all(sample['features'] is None for sample in model['samples'])
+
+    decode = mocker.spy(guassian_mixtures_model, 'decode_history')
+    result = tks_provider.verify(get_request(filename='valid_user1'), model)
+    check_verification_result(result)
+    assert decode.call_count == 0
+
+    result = tks_provider.enrol(samples=[get_sample(filename='valid_user1', sample_id=10)], model=model)
+    assert decode.call_count == 1
+    assert result.used_samples == list(range(0, 11))
+    assert decode_history(result.model['history'])[10] == decode_history(model['history'])[0]
+
+
+def test_gaussian_model_legacy_format(tks_provider):
+    '''
+    Test GaussianModel models with the statistics of each code in dictionaries are loaded
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.models import GaussianModel
+
+    legacy_model = {
+        'percentage': 1,
+        'samples': [],
+        'data': {
+            '1': {'id': None, 'model': {'A': {'n': 4, 'x': 20.0, 'xsq': 104.0}, 'B': {'n': 1, 'x': 3.0, 'xsq': 9.0}}},
+            '3': {'id': None, 'model': {'AB': {'n': 2, 'x': 10.0, 'xsq': 50.0}}},
+        }
+    }
+    tks_model = GaussianModel(legacy_model)
+    counts, means, std = tks_model._data.get_stats([(1, 'A'), (1, 'B'), (3, 'AB'), (1, 'C')])
+
+    assert counts.tolist() == [4, 1, 2, 0]
+    assert means.tolist() == [5., 3., 5., 0.]
+    assert std.tolist() == [1., 0., 0., 0.]
+
+    reloaded = GaussianModel(tks_model.to_json())
+    assert reloaded._data.get_stats([(1, 'A'), (3, 'AB')])[2].tolist() == [1., 0.]
+
+
+def test_gaussian_model_stable_deviation(tks_provider):
+    '''
+    Test the deviation of the codes is exact for times far from zero, enrolled in several samples
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.features import KeystrokeFeatures
+    from tks.provider.models import GaussianModel
+
+    tks_model = GaussianModel()
+    all_times = []
+    for offset in range(0, 5):
+        times = [1e9 + offset, 1e9 + offset + 1, 1e9 + offset + 2]
+        all_times += times
+        tks_model.enrol(KeystrokeFeatures([1, 1, 1], [0, 0, 0], times, [(1, 'A')]))
+
+    counts, means, std = tks_model._data.get_stats([(1, 'A')])
+    assert counts[0] == 15
+    assert abs(means[0] - np.mean(all_times)) < 1e-6
+    assert abs(std[0] - np.std(np.array(all_times) - 1e9)) < 1e-6
+
+
+def test_gaussian_model_discarded_codes(tks_provider):
+    '''
+    Test the features of codes without deviation are discarded and times that are not numbers are not enrolled
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.features import KeystrokeFeatures
+    from tks.provider.models import GaussianModel
+
+    tks_model = GaussianModel()
+    tks_model.enrol(KeystrokeFeatures([1, 1, 1, 1, 1, 1], [0, 0, 1, 1, 1, 2],
+                                      [100., 100., 100., 120., float('nan'), 50.],
+                                      [(1, 'A'), (1, 'B'), (1, 'C')]))
+    counts, means, std = tks_model._data.get_stats([(1, 'A'), (1, 'B'), (1, 'C')])
+    assert counts.tolist() == [2, 2, 1]
+    assert means.tolist() == [100., 110., 50.]
+    assert std.tolist() == [0., 10., 0.]
+
+    # only the feature of code B is scored
+    verification = tks_model.verify(KeystrokeFeatures([1, 1, 1, 1], [0, 1, 2, 3], [100., 105., 50., 10.],
+                                                      [(1, 'A'), (1, 'B'), (1, 'C'), (1, 'D')]),
+                                    tks_provider.config)
+    assert verification[1] == 3
+    assert verification[2] == 4
+    assert sum(counts['accepted'] + counts['rejected'] for counts in verification[3].values()) == 1
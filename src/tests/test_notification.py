@@ -28,3 +28,111 @@ def test_notification_not_implemented(tks_provider):
     except NotImplementedError:
         # Is the expected behaviour
         pass
+
+
+def test_notification_background_refit(tks_provider, tmp_path):
+    '''
+    Test the enrolment only records the observations and the model is refitted by a notification task
+    :param tks_provider:
+    :param tmp_path:
+    :return:
+    '''
+    from tks import TKSProvider
+    from tks.provider.cache import get_model_digest
+    from .tks_utils import get_sample, get_request, check_verification_result
+
+    options = {'model': 'GaussianMixturesModel', 'background_refit': True, 'model_store_path': str(tmp_path)}
+    tks_provider.set_options(options)
+    tks_provider.notifications.clear()
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    enrolment = tks_provider.enrol(samples=samples, model=None)
+    model = enrolment.model
+    assert len(model['deferred_codes']) > 0
+    assert not enrolment.can_analyse
+    assert len(tks_provider.notifications) == 1
+    notification = tks_provider.notifications.pop()
+    assert notification.key.startswith('tks_refit:')
+    assert notification.info == {'learner_id': samples[0].learner_id, 'model': get_model_digest(model),
+                                 'sample_id': 14}
+
+    # the notification is processed by another worker, which sends the refitted model as the learner model
+    worker = TKSProvider()
+    worker.set_options(options)
+    worker.on_notification(notification.key, notification.info)
+    assert len(worker.delayed_results) == 1
+    refit = worker.delayed_results.pop().result
+    assert refit.can_analyse
+    assert 'deferred_codes' not in refit.model
+    assert refit.used_samples == list(range(0, 15))
+
+    # the refitted model is verified without the shared model store
+    verifier = TKSProvider()
+    verifier.set_options({'model': 'GaussianMixturesModel'})
+    verification = verifier.verify(get_request(filename='valid_user1'), refit.model)
+    check_verification_result(verification)
+    assert verification.code == verification.AlertCode.OK
+
+    # the notification is only processed once
+    worker.on_notification(notification.key, notification.info)
+    assert len(worker.delayed_results) == 0
+
+    # the next enrolment only defers the codes of its samples, and a newer enrolment replaces its refit
+    next_model = tks_provider.enrol(samples=[get_sample(filename='valid_user1', sample_id=15)],
+                                    model=refit.model).model
+    assert len(next_model['deferred_codes']) > 0
+    assert len(next_model['samples']) == 16
+    tks_provider.enrol(samples=[get_sample(filename='valid_user1', sample_id=16)], model=next_model)
+    notification = tks_provider.notifications[0]
+    worker.on_notification(notification.key, notification.info)
+    assert len(worker.delayed_results) == 0
+    notification = tks_provider.notifications[1]
+    worker.on_notification(notification.key, notification.info)
+    assert worker.delayed_results.pop().result.used_samples == list(range(0, 17))
+
+
+def test_notification_background_refit_learners(tks_provider, tmp_path):
+    '''
+    Test the refitted model of a learner is not used for other learners with the same model data
+    :param tks_provider:
+    :param tmp_path:
+    :return:
+    '''
+    from tks import TKSProvider
+    from .tks_utils import get_sample
+
+    options = {'model': 'GaussianMixturesModel', 'background_refit': True, 'model_store_path': str(tmp_path)}
+    tks_provider.set_options(options)
+    tks_provider.notifications.clear()
+    models = {}
+    for filename, learner_id in [('valid_user1', 'learner-1'), ('valid_user2', 'learner-2')]:
+        samples = [get_sample(filename=filename, sample_id=idx, learner_id=learner_id) for idx in range(0, 15)]
+        models[learner_id] = tks_provider.enrol(samples=samples, model=None).model
+
+    # the models are not fitted yet, so they have the same data
+    assert models['learner-1']['data'] == models['learner-2']['data']
+    notification = tks_provider.notifications[0]
+    assert notification.info['learner_id'] == 'learner-1'
+    worker = TKSProvider()
+    worker.set_options(options)
+    worker.on_notification(notification.key, notification.info)
+
+    verifier = TKSProvider()
+    verifier.set_options(options)
+    assert len(verifier._load_model(models['learner-1'])._data) > 0
+    assert len(verifier._load_model(models['learner-2'])._data) == 0
+
+
+def test_notification_background_refit_without_store(tks_provider):
+    '''
+    Test the model is fitted on enrolment when there is no shared model store to take the refitted model from
+    :param tks_provider:
+    :return:
+    '''
+    from .tks_utils import get_sample
+
+    tks_provider.set_options({'model': 'GaussianMixturesModel', 'background_refit': True, 'model_store_path': None})
+    tks_provider.notifications.clear()
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    model = tks_provider.enrol(samples=samples, model=None).model
+    assert 'deferred_codes' not in model
+    assert len(tks_provider.notifications) == 0
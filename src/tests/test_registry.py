@@ -0,0 +1,74 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke Test Model Registry Module '''
+import os
+import subprocess
+import sys
+import pytest
+from .tks_utils import get_sample, check_enrolment_result
+
+
+def test_registry_lazy_import(tks_provider):
+    '''
+    Test the provider does not import the mixtures dependencies when they are not used
+    :param tks_provider:
+    :return:
+    '''
+    script = '\n'.join([
+        'import sys',
+        'import tks',
+        'from tks.provider.models import get_model_class',
+        'get_model_class("GaussianModel")',
+        'assert "sklearn" not in sys.modules',
+        'get_model_class("GaussianMixturesModel")',
+        'assert "sklearn" in sys.modules',
+    ])
+    src_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, DEBUG='1', PYTHONPATH=src_path)
+    subprocess.run([sys.executable, '-c', script], env=env, check=True)
+
+
+def test_registry_models(tks_provider, mocker):
+    '''
+    Test models registered by name and by entry points
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider.models import registry, GaussianModel
+
+    class CustomModel(GaussianModel):
+        ''' Model registered by name '''
+
+    entry_point = mocker.Mock()
+    entry_point.name = 'EntryPointModel'
+    entry_point.value = 'tks.provider.models.guassian_model:GaussianModel'
+    entry_points = mocker.Mock()
+    entry_points.select.return_value = [entry_point]
+    mocker.patch.object(registry.metadata, 'entry_points', return_value=entry_points)
+    mocker.patch.object(registry, '_registry', dict(registry.MODELS))
+    mocker.patch.object(registry, '_entry_points_loaded', False)
+
+    registry.register_model('CustomModel', CustomModel)
+    tks_provider.set_options({'model': 'CustomModel'})
+    result = tks_provider.enrol(samples=[get_sample(filename='valid_user1')], model=None)
+    check_enrolment_result(result)
+    assert isinstance(tks_provider._get_model_class(result.model), CustomModel)
+
+    assert registry.get_model_class('EntryPointModel') is GaussianModel
+    entry_points.select.assert_called_once_with(group=registry.ENTRY_POINT_GROUP)
+
+    tks_provider.set_options({'model': 'UnknownModel'})
+    with pytest.raises(ValueError):
+        tks_provider.enrol(samples=[get_sample(filename='valid_user1')], model=None)
@@ -0,0 +1,135 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke Test Session Verification Module '''
+import base64
+import json
+from .tks_utils import get_data, get_sample, get_request, check_verification_result
+
+
+def _get_window_requests(filename, ends, session_id=1):
+    '''
+    Get requests with the features of a file from the start up to each end, as sent by a client re-sending the
+    whole session
+    :param filename:
+    :param ends:
+    :param session_id:
+    :return:
+    '''
+    ks_array = json.loads(base64.b64decode(get_data(filename).split(',')[1]))
+    features = [feature for ks_line in ks_array for feature in ks_line['features']]
+    requests = []
+    for idx, end in enumerate(ends):
+        ks_data = base64.b64encode(json.dumps([{'features': features[:end]}]).encode('utf-8')).decode('ascii')
+        requests.append(get_request(ks_data=ks_data, data_mimetype='text/plain', session_id=session_id,
+                                    request_id=idx))
+    return requests, len(features)
+
+
+def test_session_verification(tks_provider):
+    '''
+    Test the requests of a session only score their new features, and give the result of the whole session
+    :param tks_provider:
+    :return:
+    '''
+    tks_provider.set_options({'model': 'GaussianModel', 'session_verification': False})
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    model = tks_provider.enrol(samples=samples, model=None).model
+    expected = tks_provider.verify(get_request(filename='valid_user1'), model)
+    assert 'session' not in expected.audit
+
+    tks_provider.set_options({'session_verification': True})
+    requests, n_features = _get_window_requests('valid_user1', [40, 120, 120, None])
+    new_features = []
+    for request in requests:
+        result = tks_provider.verify(request, model)
+        check_verification_result(result)
+        new_features.append(result.audit['session']['new_features'])
+
+    assert new_features == [40, 80, 0, n_features - 120]
+    assert result.audit['session']['offset'] == n_features
+    assert result.result == expected.result
+    assert result.audit['num_features'] == expected.audit['num_features']
+    assert result.audit['num_samples_discarded'] == expected.audit['num_samples_discarded']
+    assert result.audit['decisions'] == expected.audit['decisions']
+
+    # other sessions start from the initial threshold
+    result = tks_provider.verify(_get_window_requests('valid_user1', [40], session_id=2)[0][0], model)
+    assert result.audit['session'] == {'offset': 40, 'new_features': 40}
+
+
+def test_session_store_sqlite(tks_provider, tmp_path):
+    '''
+    Test the session state in a SQLite database is shared by several providers and expires
+    :param tks_provider:
+    :param tmp_path:
+    :return:
+    '''
+    from tks import TKSProvider
+    from tks.provider.session import SQLiteSessionStore
+
+    options = {'model': 'GaussianMixturesModel', 'session_verification': True,
+               'session_store_path': str(tmp_path / 'sessions.sqlite')}
+    tks_provider.set_options(options)
+    samples = [get_sample(filename='valid_user1', sample_id=idx) for idx in range(0, 15)]
+    model = tks_provider.enrol(samples=samples, model=None).model
+
+    requests, n_features = _get_window_requests('valid_user1', [100, None])
+    tks_provider.verify(requests[0], model)
+
+    other_provider = TKSProvider()
+    other_provider.set_options(options)
+    result = other_provider.verify(requests[1], model)
+    check_verification_result(result)
+    assert result.audit['session'] == {'offset': n_features, 'new_features': n_features - 100}
+
+    store = SQLiteSessionStore(options['session_store_path'], ttl=-1)
+    assert store.get('GaussianMixturesModel:9cfd197a-3b42-4361-841a-a45ef435b0e6:1') is None
+    store.ttl = 60
+    assert store.get('GaussianMixturesModel:9cfd197a-3b42-4361-841a-a45ef435b0e6:1')['offset'] == n_features
+    store.delete('GaussianMixturesModel:9cfd197a-3b42-4361-841a-a45ef435b0e6:1')
+    assert store.get('GaussianMixturesModel:9cfd197a-3b42-4361-841a-a45ef435b0e6:1') is None
+
+
+def test_session_store_sqlite_concurrent_update(tks_provider, tmp_path):
+    '''
+    Test an update of a session saved while another update of the session was computed is computed again
+    :param tks_provider:
+    :param tmp_path:
+    :return:
+    '''
+    from tks.provider.session import SQLiteSessionStore
+
+    store = SQLiteSessionStore(str(tmp_path / 'sessions.sqlite'), ttl=60)
+    other_store = SQLiteSessionStore(str(tmp_path / 'sessions.sqlite'), ttl=60)
+    calls = []
+
+    def count_request(state):
+        return {'requests': (state or {'requests': 0})['requests'] + 1}
+
+    def add_request(state):
+        calls.append(state)
+        if len(calls) == 1:
+            # another process saves the session in the meantime
+            other_store.update('session', count_request)
+        return count_request(state)
+
+    assert store.update('session', add_request) == {'requests': 2}
+    assert calls == [None, {'requests': 1}]
+    assert other_store.get('session') == {'requests': 2}
+
+    calls.clear()
+    assert store.update('session', add_request) == {'requests': 4}
+    assert calls == [{'requests': 2}, {'requests': 3}]
+    assert store.update('session', lambda state: None) == {'requests': 4}
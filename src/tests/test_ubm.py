@@ -0,0 +1,106 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke Test Universal Background Model Module '''
+from .tks_utils import get_data, get_sample, get_request, check_enrolment_result, check_verification_result
+
+
+def test_ubm_adapted_model(tks_provider, tmp_path):
+    '''
+    Test the mixtures adapted from a background bank built from a corpus
+    :param tks_provider:
+    :param tmp_path:
+    :return:
+    '''
+    from tks.provider.models.background import BackgroundBuilder, load_background_bank, save_background_bank
+    from tks.provider.models.ubm_model import UBMAdaptedModel
+    from tks.provider.utils import SampleEnvelope
+
+    builder = BackgroundBuilder(max_observations=500)
+    for filename in ['valid_user1', 'valid_user2']:
+        builder.add(SampleEnvelope(get_data(filename)).decode())
+    bank = builder.build(min_observations=10)
+    assert '1_*' in bank
+    path = str(tmp_path / 'ubm.bin')
+    save_background_bank(bank, path)
+
+    # the bank is loaded once per process
+    assert load_background_bank(path) is load_background_bank(path)
+
+    tks_provider.set_options({'model': 'UBMAdaptedModel', 'ubm_path': path, 'min_enrol_samples': 3,
+                              'target_enrol_samples': 3})
+    enrolment = tks_provider.enrol(samples=[get_sample(filename='valid_user1', sample_id=idx)
+                                            for idx in range(0, 3)], model=None)
+    check_enrolment_result(enrolment)
+    assert enrolment.can_analyse
+
+    verification = tks_provider.verify(get_request(filename='valid_user1'), enrolment.model)
+    check_verification_result(verification)
+    assert verification.result > 0.5
+
+    # codes with a single observation are adapted from the mixture of their feature type
+    tks_model = UBMAdaptedModel()
+    tks_model.set_background(path)
+    tks_model.enrol([{'features': [{'type': 1, 'code': 'unknown', 'time': 100}]}])
+    assert '1_unknown' in tks_model._data
+    assert tks_model.get_deferred_codes() == []
+
+
+def test_ubm_adapted_model_background_check(tks_provider, tmp_path):
+    '''
+    Test the mixtures adapted from a background bank are not verified without the same bank
+    :param tks_provider:
+    :param tmp_path:
+    :return:
+    '''
+    import pytest
+    from tks.provider.models.background import BackgroundBuilder, get_background_digest, load_background_bank, \
+        save_background_bank
+    from tks.provider.models.ubm_model import UBMAdaptedModel
+    from tks.provider.utils import SampleEnvelope
+
+    def save_bank(filenames):
+        builder = BackgroundBuilder(max_observations=500)
+        for filename in filenames:
+            builder.add(SampleEnvelope(get_data(filename)).decode())
+        save_background_bank(builder.build(min_observations=10), path)
+
+    path = str(tmp_path / 'ubm.bin')
+    save_bank(['valid_user1', 'valid_user2'])
+
+    tks_provider.set_options({'model': 'UBMAdaptedModel', 'ubm_path': path, 'min_enrol_samples': 3,
+                              'target_enrol_samples': 3})
+    enrolment = tks_provider.enrol(samples=[get_sample(filename='valid_user1', sample_id=idx)
+                                            for idx in range(0, 3)], model=None)
+    check_enrolment_result(enrolment)
+    assert enrolment.model['ubm'] == get_background_digest(path)
+
+    # the digest is kept in the shared representation of the model
+    tks_model = UBMAdaptedModel(enrolment.model)
+    shared_model = UBMAdaptedModel.from_shared_data(tks_model.get_shared_data())
+    assert shared_model._ubm_digest == get_background_digest(path)
+
+    # without the bank the model is not verified with the likelihood of the mixtures only
+    tks_provider.set_options({'ubm_path': None})
+    with pytest.raises(ValueError):
+        tks_provider.verify(get_request(filename='valid_user2'), enrolment.model)
+
+    # a new bank in the same path is loaded again and the model is not verified with it
+    bank = load_background_bank(path)
+    save_bank(['valid_user2'])
+    assert load_background_bank(path) is not bank
+    assert enrolment.model['ubm'] != get_background_digest(path)
+    tks_provider.set_options({'ubm_path': path})
+    with pytest.raises(ValueError):
+        tks_provider.verify(get_request(filename='valid_user2'), enrolment.model)
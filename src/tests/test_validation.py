@@ -144,3 +144,29 @@ def test_invalid_sample_data(tks_provider):
     assert result.message_code_id == 'PROVIDER_INVALID_SAMPLE_DATA'
     assert result.error_message == 'Invalid image format in sample data.'
     assert result.status == 2
+
+
+def test_sample_envelope(tks_provider):
+    '''
+    Test the sample data URL is parsed once and gives the same mimetype as the split based parser
+    :param tks_provider:
+    :return:
+    '''
+    from tks.provider import utils
+
+    for data in ('data:text/plain;base64,e30=', 'data:;base64,e30=', 'e30=', 'data:a:b;c,e30=,x', 'text'):
+        envelope = utils.SampleEnvelope(data)
+        try:
+            mimetype = data.split(',')[0].split(';')[0].split(':')[1]
+            if len(mimetype.strip()) == 0:
+                mimetype = None
+        except IndexError:
+            mimetype = None
+        assert envelope.mimetype == mimetype
+        assert data[envelope.payload_start:envelope.payload_end] == (data.split(',') + [data])[1]
+
+    sample = get_sample()
+    features = utils.get_sample_ks(sample)
+    assert features is not None
+    assert utils.get_sample_ks(sample) is features
+    assert utils.check_sample_ks(sample, tks_provider.accepted_mimetypes)['ks_data'] is features
@@ -57,8 +57,10 @@ def test_verification(tks_provider):
     result = tks_provider.verify(request, models['user1'])
     check_verification_result(result)
 
+    # the enrolled samples are the same sample, so the codes observed once in it have no deviation and their
+    # features are discarded as missing data
     assert result.status == 1
-    assert result.code == result.AlertCode.OK
+    assert result.code == result.AlertCode.ALERT
     assert result.result > 0.9
 
 @pytest.mark.dependency(depends=["test_progressive_enrolment"], scope='module')
@@ -0,0 +1,51 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke Test Verification Batch Module '''
+import pytest
+from .tks_utils import get_sample, get_request, check_verification_result
+
+
+@pytest.mark.parametrize('model_name', ['GaussianModel', 'GaussianMixturesModel'])
+def test_verification_batch(tks_provider, model_name):
+    '''
+    Test a batch of requests gives the same results as verifying them one by one
+    :param tks_provider:
+    :param model_name:
+    :return:
+    '''
+    tks_provider.set_options({'model': model_name, 'model_cache_bytes': 0})
+    models = []
+    for filename in ['valid_user1', 'valid_user2']:
+        samples = [get_sample(filename=filename, sample_id=idx) for idx in range(0, 10)]
+        models.append(tks_provider.enrol(samples=samples, model=None).model)
+
+    requests = [
+        (get_request(filename='valid_user1'), models[0]),
+        (get_request(filename='valid_user2'), models[1]),
+        (get_request(filename='valid_user2'), models[0]),
+        (get_request(request_mimetype='image/jpeg'), models[1]),
+        (get_request(filename='valid_user1'), models[1]),
+    ]
+    results = tks_provider.verify_batch(requests)
+
+    assert len(results) == len(requests)
+    for (request, model), batch_result in zip(requests, results):
+        expected = tks_provider.verify(request, model)
+        if expected.error_message is None:
+            check_verification_result(batch_result)
+        assert batch_result.error_message == expected.error_message
+        assert batch_result.result == expected.result
+        assert batch_result.code == expected.code
+        assert batch_result.audit == expected.audit
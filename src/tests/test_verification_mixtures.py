@@ -80,3 +80,40 @@ def test_verification_mixtures_enrol_user1_verification_user2(tks_provider):
     assert result.status == 1
     assert result.code == result.AlertCode.ALERT
     assert result.result == 0
+
+
+def test_verification_mixtures_online_enrolment(tks_provider):
+    '''
+    Test verification mixtures with online enrolment
+    :param tks_provider:
+    :return:
+    '''
+    tks_provider.set_options({'model': 'GaussianMixturesModel', 'online_enrolment': True,
+                              'failed_missing_data': True})
+
+    data = get_sample(filename='valid_user1')
+    model = None
+    for i in range(0, 15):
+        result = tks_provider.enrol(samples=[data], model=model)
+        model = result.model
+        check_enrolment_result(result)
+
+        assert result.valid
+        assert len(result.model['samples']) == (i+1)
+        assert len(result.used_samples) == (i+1)
+
+    assert result.percentage == 1
+
+    request = get_request(filename='valid_user1')
+    result = tks_provider.verify(request, model)
+    check_verification_result(result)
+
+    assert result.code == result.AlertCode.OK
+    assert result.result > 0.9
+
+    request = get_request(filename='valid_user2')
+    result = tks_provider.verify(request, model)
+    check_verification_result(result)
+
+    assert result.code == result.AlertCode.ALERT
+    assert result.result == 0
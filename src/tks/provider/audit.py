@@ -0,0 +1,54 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke audit module """
+from tesla_ce_provider.provider.audit import KeystrokeAudit
+
+
+class TKSAudit(KeystrokeAudit):
+    """
+        Keystroke audit with the details of the TKS decision
+    """
+    def __init__(self, num_samples_discarded, num_features, decisions=None, alerts=None, warnings=None,
+                 metrics=None, evaluated_features=None, session=None):
+        """
+        Create a TKS audit
+        :param num_samples_discarded:
+        :param num_features:
+        :param decisions: Accepted and rejected features for each feature type
+        :param alerts:
+        :param warnings:
+        :param metrics: Time of each verification phase and counts, only added when enabled
+        :param evaluated_features: Features scored before the decision, only added with early decision
+        :param session: Features processed in the session and new features of the request, only added with
+                        session verification
+        """
+        super().__init__(num_samples_discarded, num_features, alerts=alerts, warnings=warnings)
+
+        self.decisions = decisions
+        self.metrics = metrics
+        self.evaluated_features = evaluated_features
+        self.session = session
+
+    def json(self):
+        base = super().json()
+        base['decisions'] = self.decisions
+        if self.evaluated_features is not None:
+            base['evaluated_features'] = self.evaluated_features
+        if self.session is not None:
+            base['session'] = self.session
+        if self.metrics is not None:
+            base['metrics'] = self.metrics
+
+        return base
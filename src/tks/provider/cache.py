@@ -0,0 +1,144 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke model cache module """
+from collections import OrderedDict
+import hashlib
+import json
+
+
+def get_model_fingerprint(model):
+    """
+        Get a fingerprint of the content of a model
+        :param model: Model JSON representation
+        :type model: dict
+        :return: Fingerprint of the model data and the size in bytes of its payload
+        :rtype: tuple
+    """
+    data = model['data']
+    if isinstance(data, str):
+        payload = data.encode('utf-8')
+    else:
+        payload = json.dumps(data, sort_keys=True).encode('utf-8')
+
+    return hashlib.blake2b(payload, digest_size=16).hexdigest(), len(payload)
+
+
+def get_model_digest(model):
+    """
+        Get a fingerprint of a whole model, including its enrolment history
+        :param model: Model JSON representation
+        :type model: dict
+        :return: Fingerprint of the model
+        :rtype: str
+    """
+    payload = json.dumps(model, sort_keys=True).encode('utf-8')
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+class ModelCache:
+    """
+        Least recently used cache of loaded models, limited by the size of the model payloads
+    """
+    def __init__(self, max_bytes=0):
+        """
+            Create a model cache
+            :param max_bytes: Maximum size in bytes of the cached model payloads. Zero disables the cache.
+            :type max_bytes: int
+        """
+        #: Maximum size in bytes of the cached model payloads
+        self.max_bytes = max_bytes
+
+        #: Size in bytes of the cached model payloads
+        self.current_bytes = 0
+
+        #: Cache statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set_max_bytes(self, max_bytes):
+        """
+            Change the size of the cache, evicting models if needed
+            :param max_bytes: Maximum size in bytes of the cached model payloads
+            :type max_bytes: int
+        """
+        self.max_bytes = max_bytes
+        self._evict(0)
+
+    def get(self, key):
+        """
+            Get a model from the cache
+            :param key: Model key
+            :type key: tuple
+            :return: Cached model or None if it is not in the cache
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, model, size):
+        """
+            Add a model to the cache
+            :param key: Model key
+            :type key: tuple
+            :param model: Loaded model
+            :param size: Size in bytes of the model payload
+            :type size: int
+        """
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key)[1]
+
+        self._evict(size)
+        self._entries[key] = (model, size)
+        self.current_bytes += size
+
+    def _evict(self, size):
+        """
+            Remove the least recently used models until there is space for a new one
+            :param size: Size in bytes of the new model
+            :type size: int
+        """
+        while len(self._entries) > 0 and self.current_bytes + size > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+            self.evictions += 1
+
+    def get_stats(self):
+        """
+            Get the cache statistics
+            :return: Cache statistics
+            :rtype: dict
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'models': len(self._entries),
+            'bytes': self.current_bytes,
+            'max_bytes': self.max_bytes
+        }
@@ -0,0 +1,190 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke decision module """
+import numpy as np
+from .constants import DWELL, FLIGHT, DIGRAPH, TRIGRAPH, FOURGRAPH
+
+#: Feature types and the name used in the decision counts
+FEATURE_TYPES = {
+    DWELL: 'dwell',
+    FLIGHT: 'flight',
+    DIGRAPH: 'digraph',
+    TRIGRAPH: 'trigraph',
+    FOURGRAPH: 'fourgraph',
+}
+
+#: Features scored between two checks of the early decision
+EARLY_DECISION_CHUNK = 256
+
+
+class DecisionEngine:
+    """
+        Clamped random walk on the decision threshold, driven by the accept/reject outcome of each feature
+    """
+    def __init__(self, config, reject_sign=-1):
+        """
+            Create the decision engine for a request
+            :param config: Provider configuration
+            :type config: dict
+            :param reject_sign: Sign applied to the reject deltas
+            :type reject_sign: int
+        """
+        #: Initial decision threshold
+        self.start_threshold = config['start_decision_threshold']
+
+        #: Delta to apply for each feature type (rows) when it is rejected (0) or accepted (1)
+        self.deltas = np.zeros((FOURGRAPH + 1, 2))
+        self.deltas[[DWELL, FLIGHT, DIGRAPH], 1] = config['result_valid_delta_di']
+        self.deltas[TRIGRAPH, 1] = config['result_valid_delta_tri']
+        self.deltas[FOURGRAPH, 1] = config['result_valid_delta_four']
+        self.deltas[[DWELL, FLIGHT, DIGRAPH], 0] = reject_sign * config['result_invalid_delta_di']
+        self.deltas[TRIGRAPH, 0] = reject_sign * config['result_invalid_delta_tri']
+        self.deltas[FOURGRAPH, 0] = reject_sign * config['result_invalid_delta_four']
+
+        #: Whether to stop scoring the features once the final decision threshold is settled
+        self.early_decision = config.get('early_decision', False)
+
+    def _check_types(self, feature_types):
+        """
+            Check the feature types are known
+            :param feature_types: Type of each feature
+            :return: Type of each feature as an array
+            :rtype: np.ndarray
+        """
+        feature_types = np.asarray(feature_types, dtype=np.int8)
+        if np.any((feature_types < DWELL) | (feature_types > FOURGRAPH)):
+            raise KeyError('Unknown feature type')
+        return feature_types
+
+    @staticmethod
+    def _walk(decision_threshold, deltas):
+        """
+            Walk the decision threshold over a list of deltas, clamped to [0, 1]
+            :param decision_threshold: Initial decision threshold
+            :type decision_threshold: float
+            :param deltas: Delta of each feature
+            :type deltas: list
+            :return: Final decision threshold
+            :rtype: float
+        """
+        for delta in deltas:
+            decision_threshold += delta
+
+            if decision_threshold < 0:
+                decision_threshold = 0.
+            elif decision_threshold > 1:
+                decision_threshold = 1.
+
+        return decision_threshold
+
+    def run(self, feature_types, accepted):
+        """
+            Walk the decision threshold over the outcomes of the features, in order
+            :param feature_types: Type of each feature
+            :type feature_types: np.ndarray
+            :param accepted: Whether each feature is accepted as from the learner
+            :type accepted: np.ndarray
+            :return: Final decision threshold and the accept/reject counts for each feature type
+            :rtype: tuple
+        """
+        feature_types = self._check_types(feature_types)
+        accepted = np.asarray(accepted, dtype=bool)
+
+        decision_threshold = self._walk(self.start_threshold,
+                                        self.deltas[feature_types, accepted.astype(np.intp)].tolist())
+
+        return decision_threshold, self.get_counts(feature_types, accepted)
+
+    @staticmethod
+    def _compose(deltas, suffix):
+        """
+            Compose the walk over a list of deltas with the walk over the features after them. The walk over a
+            list of features is the map x -> min(max(x + shift, low), high) of the initial threshold to the final
+            one, and so is the composition of two walks.
+            :param deltas: Delta of each feature
+            :type deltas: list
+            :param suffix: Shift, low and high of the walk over the features after the deltas
+            :type suffix: tuple
+            :return: Shift, low and high of the walk over the deltas and the features after them
+            :rtype: tuple
+        """
+        shift, low, high = 0., -np.inf, np.inf
+        for delta in deltas:
+            shift += delta
+            low = min(max(low + delta, 0.), 1.)
+            high = min(max(high + delta, 0.), 1.)
+
+        suffix_shift, suffix_low, suffix_high = suffix
+        return (shift + suffix_shift,
+                min(max(low + suffix_shift, suffix_low), suffix_high),
+                min(max(high + suffix_shift, suffix_low), suffix_high))
+
+    def run_sequential(self, feature_types, score):
+        """
+            Walk the decision threshold scoring the features in chunks. With early decision, the chunks are
+            scored from the last one, and the scoring stops once the walk over the scored features gives the same
+            final threshold from any initial threshold. The walk forgets everything before it is clamped at 0 or
+            1, so the final threshold is the same as scoring all the features.
+            :param feature_types: Type of each feature
+            :type feature_types: np.ndarray
+            :param score: Function returning whether the features in [start, end) are accepted
+            :type score: callable
+            :return: Final decision threshold, the accept/reject counts for each feature type of the scored
+                     features and the number of scored features
+            :rtype: tuple
+        """
+        feature_types = self._check_types(feature_types)
+        n_features = feature_types.shape[0]
+        if not self.early_decision:
+            accepted = np.asarray(score(0, n_features), dtype=bool)
+            decision_threshold, decisions = self.run(feature_types, accepted)
+            return decision_threshold, decisions, n_features
+
+        accepted = np.zeros(n_features, dtype=bool)
+        deltas = np.zeros(n_features)
+        suffix = (0., -np.inf, np.inf)
+        start = n_features
+        while start > 0 and suffix[1] < suffix[2]:
+            end, start = start, max(start - EARLY_DECISION_CHUNK, 0)
+            accepted[start:end] = score(start, end)
+            deltas[start:end] = self.deltas[feature_types[start:end], accepted[start:end].astype(np.intp)]
+            suffix = self._compose(deltas[start:end].tolist(), suffix)
+
+        # walk the scored features in order, as the walk over all of them does. When it does not depend on the
+        # initial threshold, it starts from 0.
+        decision_threshold = self._walk(self.start_threshold if start == 0 else 0., deltas[start:].tolist())
+
+        return decision_threshold, self.get_counts(feature_types[start:], accepted[start:]), n_features - start
+
+    @staticmethod
+    def get_counts(feature_types, accepted):
+        """
+            Count the accepted and rejected features of each type
+            :param feature_types: Type of each feature
+            :type feature_types: np.ndarray
+            :param accepted: Whether each feature is accepted as from the learner
+            :type accepted: np.ndarray
+            :return: Dictionary with the accepted and rejected features for each feature type
+            :rtype: dict
+        """
+        counts = np.bincount(feature_types.astype(np.intp) * 2 + accepted, minlength=(FOURGRAPH + 1) * 2)
+        decisions = {}
+        for feature_type, name in FEATURE_TYPES.items():
+            decisions[name] = {
+                'accepted': int(counts[feature_type * 2 + 1]),
+                'rejected': int(counts[feature_type * 2])
+            }
+
+        return decisions
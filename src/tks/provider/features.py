@@ -0,0 +1,162 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke features module """
+import numpy as np
+
+#: Range of the feature types stored in the columns
+TYPE_RANGE = np.iinfo(np.int8)
+
+
+class KeystrokeFeatures:
+    """
+        Columnar representation of the keystroke features of a sample
+    """
+    def __init__(self, types, code_ids, times, code_table):
+        """
+            Create the features from its columns
+            :param types: Type of each feature
+            :type types: np.ndarray
+            :param code_ids: Position in the code table of the code of each feature
+            :type code_ids: np.ndarray
+            :param times: Time of each feature
+            :type times: np.ndarray
+            :param code_table: List of (type, code) pairs, in order of first appearance
+            :type code_table: list
+        """
+        #: Type of each feature
+        self.types = np.asarray(types, dtype=np.int8)
+
+        #: Code id of each feature
+        self.code_ids = np.asarray(code_ids, dtype=np.int32)
+
+        #: Time of each feature
+        self.times = np.asarray(times, dtype=float)
+
+        #: Type and code of each code id
+        self.code_table = code_table
+
+        self._keys = None
+        self._groups = None
+
+    def __len__(self):
+        return self.types.shape[0]
+
+    @classmethod
+    def from_json(cls, ks_array):
+        """
+            Create the features from the decoded sample data. Feature types must be small integers.
+            :param ks_array: List of feature lists, as sent by the sensor
+            :type ks_array: list
+            :return: Keystroke features
+            :rtype: KeystrokeFeatures
+        """
+        types = []
+        code_ids = []
+        times = []
+        code_index = {}
+        for ks_line in ks_array:
+            for feature in ks_line['features']:
+                feature_type = feature['type']
+                if isinstance(feature_type, bool) or not isinstance(feature_type, int) or \
+                        not TYPE_RANGE.min <= feature_type <= TYPE_RANGE.max:
+                    raise ValueError('Invalid feature type')
+                code = (feature_type, feature['code'])
+                types.append(code[0])
+                code_ids.append(code_index.setdefault(code, len(code_index)))
+                times.append(feature['time'])
+
+        return cls(types, code_ids, times, list(code_index.keys()))
+
+    def slice(self, start, end=None):
+        """
+            Get a range of the features, with a code table of only the codes in the range
+            :param start: First feature of the range
+            :type start: int
+            :param end: End of the range, the last feature by default
+            :type end: int
+            :return: Keystroke features in the range
+            :rtype: KeystrokeFeatures
+        """
+        code_ids = self.code_ids[start:end]
+        used_codes, first_ids = np.unique(code_ids, return_index=True)
+
+        # code ids in order of first appearance in the range
+        used_codes = used_codes[np.argsort(first_ids, kind='stable')]
+        code_map = np.zeros(len(self.code_table), dtype=np.int32)
+        code_map[used_codes] = np.arange(used_codes.shape[0], dtype=np.int32)
+
+        return KeystrokeFeatures(self.types[start:end], code_map[code_ids], self.times[start:end],
+                                 [self.code_table[code_id] for code_id in used_codes.tolist()])
+
+    @property
+    def keys(self):
+        """
+            Model key of each code id, in the form "type_code"
+            :return: List of keys
+            :rtype: list
+        """
+        if self._keys is None:
+            self._keys = [f"{feature_type}_{code}" for feature_type, code in self.code_table]
+        return self._keys
+
+    @property
+    def code_types(self):
+        """
+            Type of each code id
+            :return: Array of types
+            :rtype: np.ndarray
+        """
+        return np.array([feature_type for feature_type, _ in self.code_table], dtype=np.int8)
+
+    def group_by_code(self):
+        """
+            Index to access the features grouped by code id. The features of code id c are
+            order[offsets[c]:offsets[c + 1]], in order of appearance.
+            :return: Feature positions sorted by code id and the offset of each code id
+            :rtype: tuple
+        """
+        if self._groups is None:
+            order = np.argsort(self.code_ids, kind='stable')
+            counts = np.bincount(self.code_ids, minlength=len(self.code_table))
+            offsets = np.zeros(len(self.code_table) + 1, dtype=np.intp)
+            np.cumsum(counts, out=offsets[1:])
+            self._groups = (order, offsets)
+        return self._groups
+
+    def get_code_times(self):
+        """
+            Get the times of each code
+            :return: Dictionary with the list of times of each key, in order of first appearance
+            :rtype: dict
+        """
+        order, offsets = self.group_by_code()
+        sorted_times = self.times[order].tolist()
+        code_times = {}
+        for code_id, key in enumerate(self.keys):
+            code_times[key] = sorted_times[offsets[code_id]:offsets[code_id + 1]]
+        return code_times
+
+
+def get_features(features):
+    """
+        Get the columnar representation of a list of features
+        :param features: Keystroke features or list of feature lists
+        :type features: KeystrokeFeatures | list
+        :return: Keystroke features
+        :rtype: KeystrokeFeatures
+    """
+    if isinstance(features, KeystrokeFeatures):
+        return features
+    return KeystrokeFeatures.from_json(features)
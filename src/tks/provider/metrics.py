@@ -0,0 +1,233 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke metrics module """
+import threading
+import time
+
+
+class MetricsSink:
+    """
+        Receiver of the metrics of the provider. Subclasses store or forward them to a monitoring system.
+    """
+    def observe(self, name, value, labels):
+        """
+            Record an observation, such as a duration in seconds
+            :param name: Metric name
+            :type name: str
+            :param value: Observed value
+            :type value: float
+            :param labels: Metric labels
+            :type labels: dict
+        """
+        raise NotImplementedError('Method not implemented on metrics sink')
+
+    def increment(self, name, value, labels):
+        """
+            Increment a counter
+            :param name: Metric name
+            :type name: str
+            :param value: Increment
+            :type value: int
+            :param labels: Metric labels
+            :type labels: dict
+        """
+        raise NotImplementedError('Method not implemented on metrics sink')
+
+
+class InMemoryMetricsSink(MetricsSink):
+    """
+        Metrics sink keeping the count, sum and maximum of the observations and the value of the counters, which
+        can be exported in the Prometheus text format
+    """
+    def __init__(self):
+        #: Count, sum and maximum of the observations of each metric and labels
+        self.observations = {}
+
+        #: Value of each counter and labels
+        self.counters = {}
+
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            count, total, maximum = self.observations.get(key, (0, 0., value))
+            self.observations[key] = (count + 1, total + value, max(maximum, value))
+
+    def increment(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        """
+            Remove all the metrics
+        """
+        with self._lock:
+            self.observations.clear()
+            self.counters.clear()
+
+    @staticmethod
+    def _format_labels(labels):
+        """
+            Format metric labels for the Prometheus text format
+            :param labels: Sorted (name, value) pairs
+            :return: Formatted labels
+        """
+        if len(labels) == 0:
+            return ''
+        values = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                  for name, value in labels]
+        return '{' + ','.join(values) + '}'
+
+    def to_prometheus(self):
+        """
+            Export the metrics in the Prometheus text format. Observations are exported as summaries with their
+            count and sum, and a gauge with their maximum.
+            :return: Metrics in the Prometheus text format
+            :rtype: str
+        """
+        with self._lock:
+            observations = sorted(self.observations.items())
+            counters = sorted(self.counters.items())
+
+        lines = []
+        last_name = None
+        for (name, labels), (count, total, _) in observations:
+            if name != last_name:
+                lines.append(f'# TYPE {name} summary')
+                last_name = name
+            labels = self._format_labels(labels)
+            lines.append(f'{name}_count{labels} {count}')
+            lines.append(f'{name}_sum{labels} {total!r}')
+        last_name = None
+        for (name, labels), (_, _, maximum) in observations:
+            if name != last_name:
+                lines.append(f'# TYPE {name}_max gauge')
+                last_name = name
+            lines.append(f'{name}_max{self._format_labels(labels)} {maximum!r}')
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.append(f'# TYPE {name} counter')
+                last_name = name
+            lines.append(f'{name}{self._format_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class PhaseTimer:
+    """
+        Time of each phase and counts of an operation of the provider. Each call to phase closes the phase
+        started by the previous call.
+    """
+    def __init__(self, operation, model):
+        """
+            Start timing an operation
+            :param operation: Operation name, such as enrol or verify
+            :type operation: str
+            :param model: Model name
+            :type model: str
+        """
+        #: Operation name
+        self.operation = operation
+
+        #: Model name
+        self.model = model
+
+        #: Time in seconds of each phase
+        self.phases = {}
+
+        #: Counts of the operation, such as the number of features
+        self.counts = {}
+
+        self._start = time.perf_counter()
+        self._last = self._start
+
+    def phase(self, name):
+        """
+            Close a phase, adding the time since the previous phase
+            :param name: Phase name
+            :type name: str
+        """
+        now = time.perf_counter()
+        self.phases[name] = self.phases.get(name, 0.) + now - self._last
+        self._last = now
+
+    def skip(self):
+        """
+            Exclude the time since the previous phase from the next phase
+        """
+        self._last = time.perf_counter()
+
+    def count(self, name, value):
+        """
+            Add to a count of the operation
+            :param name: Count name
+            :type name: str
+            :param value: Value to add
+            :type value: int
+        """
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def json(self):
+        """
+            Get a JSON representation of the timings, to attach to the audit
+            :return: Time in milliseconds of each phase and counts
+            :rtype: dict
+        """
+        return {
+            'phases_ms': {name: seconds * 1000 for name, seconds in self.phases.items()},
+            'total_ms': (self._last - self._start) * 1000,
+            'counts': dict(self.counts),
+        }
+
+    def send(self, sink):
+        """
+            Send the timings and counts to a metrics sink
+            :param sink: Metrics sink
+            :type sink: MetricsSink
+        """
+        labels = {'operation': self.operation, 'model': self.model}
+        sink.observe('tks_operation_seconds', self._last - self._start, labels)
+        for name, seconds in self.phases.items():
+            sink.observe('tks_phase_seconds', seconds, dict(labels, phase=name))
+        for name, value in self.counts.items():
+            sink.increment(f'tks_{name}_total', value, labels)
+
+
+class NullPhaseTimer:
+    """
+        Phase timer used when the metrics are disabled. It records nothing.
+    """
+    def phase(self, name):
+        """ Ignore a phase """
+
+    def skip(self):
+        """ Ignore the time since the previous phase """
+
+    def count(self, name, value):
+        """ Ignore a count """
+
+    def json(self):
+        """ No timings are recorded """
+        return None
+
+    def send(self, sink):
+        """ No timings are sent """
+
+
+#: Phase timer of the operations without metrics
+NULL_TIMER = NullPhaseTimer()
@@ -13,10 +13,19 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with this program.  If not, see <https://www.gnu.org/licenses/>.
 ''' TeSLA Keystroke Models module '''
-from .guassian_mixtures_model import GaussianMixturesModel
-from .guassian_model import GaussianModel
+from .registry import MODELS, get_model_class, register_model
 
 __all__ = [
     'GaussianMixturesModel',
-    'GaussianModel'
+    'GaussianModel',
+    'UBMAdaptedModel',
+    'get_model_class',
+    'register_model'
 ]
+
+
+def __getattr__(name):
+    # models are imported on first use, so workers only load the dependencies of the model they use
+    if name in MODELS:
+        return get_model_class(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,244 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke background mixtures module'''
+import hashlib
+import mmap
+import os
+import random
+import tempfile
+import numpy as np
+from ..features import get_features
+from .guassian_mixtures_model import N_COMPONENTS, _get_train_array
+from .mixture_bank import REG_COVAR, MixtureBank
+from .mixture_em import fit_mixtures
+
+#: Relevance factor of the MAP adaptation, the number of observations of a component that weight as much as
+#: its background parameters
+RELEVANCE_FACTOR = 16.
+
+#: Minimum number of observations of a code in the corpus to fit its own background mixture
+MIN_CODE_OBSERVATIONS = 50
+
+#: Maximum number of observations of each code and feature type kept to fit the background mixtures
+MAX_OBSERVATIONS = 5000
+
+#: Background banks loaded in this process, by file path, with the identity of their file and their digest
+_banks = {}
+
+
+def get_type_key(feature_type):
+    """
+    Get the key of the background mixture of a feature type, used by the codes without their own mixture
+    :param feature_type: Feature type
+    :return: Key of the feature type mixture
+    :rtype: str
+    """
+    return f'{feature_type}_*'
+
+
+def get_background_rows(background, codes):
+    """
+    Get the row of the background mixture of each code, which is the mixture of the code or, for the codes
+    without their own mixture, the mixture of their feature type
+    :param background: Background bank
+    :type background: MixtureBank
+    :param codes: List of codes, in the form "type_code"
+    :type codes: list
+    :return: Row of each code, -1 for the codes without a background mixture
+    :rtype: np.ndarray
+    """
+    rows = np.full(len(codes), -1, dtype=np.intp)
+    for idx, code in enumerate(codes):
+        if code not in background:
+            code = get_type_key(code.split('_', 1)[0])
+        if code in background:
+            rows[idx] = background.get_rows([code])[0]
+
+    return rows
+
+
+def map_adapt(background, rows, observations, relevance_factor=RELEVANCE_FACTOR):
+    """
+    Adapt the weights, means and variances of the background mixtures to the observations of each code, in a
+    single pass for all the codes. Each component moves towards the statistics of the observations it is
+    responsible for, by a factor that grows with the number of these observations.
+    :param background: Background bank
+    :type background: MixtureBank
+    :param rows: Row of the background mixture of each code
+    :type rows: np.ndarray
+    :param observations: List with the observations of each code, in the representation of the mixtures
+    :type observations: list
+    :param relevance_factor: Relevance factor of the adaptation
+    :type relevance_factor: float
+    :return: Weights, means and variances, with one row per code, and the number of observations of each code
+    :rtype: tuple
+    """
+    counts = np.array([len(x) for x in observations], dtype=np.intp)
+    offsets = np.zeros(len(observations) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    x = np.concatenate([np.asarray(x, dtype=float).reshape(-1) for x in observations])
+
+    resp = background.get_responsibilities(np.repeat(rows, counts), x)
+    n_k = np.add.reduceat(resp, offsets[:-1], axis=0)
+    sum_x = np.add.reduceat(resp * x[:, None], offsets[:-1], axis=0)
+    sum_x2 = np.add.reduceat(resp * x[:, None] ** 2, offsets[:-1], axis=0)
+
+    alpha = n_k / (n_k + relevance_factor)
+    n_k_safe = np.maximum(n_k, 10 * np.finfo(float).eps)
+    background_means = background.means[rows]
+    means = alpha * sum_x / n_k_safe + (1 - alpha) * background_means
+    variances = alpha * sum_x2 / n_k_safe + (1 - alpha) * (background.variances[rows] + background_means ** 2) - \
+        means ** 2
+    weights = alpha * n_k / counts[:, None] + (1 - alpha) * background.weights[rows]
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    return weights, means, np.maximum(variances, 0) + REG_COVAR, counts
+
+
+class BackgroundBuilder:
+    """
+        Collects the observations of a corpus and fits the background mixtures of its codes and feature types.
+        The observations of each code and feature type are a uniform random selection of all the observations
+        of the corpus, so its size is not limited by memory.
+    """
+    def __init__(self, max_observations=MAX_OBSERVATIONS, seed=0):
+        """
+            Create a background builder
+            :param max_observations: Maximum number of observations kept of each code and feature type
+            :type max_observations: int
+            :param seed: Random seed of the selection of the observations
+            :type seed: int
+        """
+        #: Maximum number of observations kept of each code and feature type
+        self.max_observations = max_observations
+
+        #: Observations kept of each code and feature type
+        self.observations = {}
+
+        #: Number of observations of each code and feature type in the corpus
+        self.seen = {}
+
+        self._random = random.Random(seed)
+
+    def add(self, features):
+        """
+            Add the observations of a sample of the corpus
+            :param features: Keystroke features or list of feature lists
+            :type features: tks.provider.features.KeystrokeFeatures | list
+        """
+        for code, times in get_features(features).get_code_times().items():
+            self._add_observations(code, times)
+            self._add_observations(get_type_key(code.split('_', 1)[0]), times)
+
+    def _add_observations(self, key, times):
+        """
+            Add observations of a code or feature type, keeping a uniform random selection of them
+            :param key: Code or feature type key
+            :param times: Observations
+        """
+        reservoir = self.observations.setdefault(key, [])
+        seen = self.seen.get(key, 0)
+        for time in times:
+            seen += 1
+            if len(reservoir) < self.max_observations:
+                reservoir.append(time)
+                continue
+            position = self._random.randrange(seen)
+            if position < self.max_observations:
+                reservoir[position] = time
+        self.seen[key] = seen
+
+    def build(self, min_observations=MIN_CODE_OBSERVATIONS):
+        """
+            Fit the background mixtures of the codes with enough observations and of all the feature types
+            :param min_observations: Minimum number of observations of a code to fit its own mixture
+            :type min_observations: int
+            :return: Background bank
+            :rtype: MixtureBank
+        """
+        keys = [key for key, times in self.observations.items()
+                if len(times) >= max(min_observations, N_COMPONENTS) or
+                (key.endswith('_*') and len(times) >= N_COMPONENTS)]
+        weights, means, variances = fit_mixtures([_get_train_array(self.observations[key]) for key in keys],
+                                                 N_COMPONENTS)
+
+        bank = MixtureBank(n_components=N_COMPONENTS)
+        bank.set_mixtures(keys, weights, means, variances, [min(self.seen[key], 2 ** 32 - 1) for key in keys])
+        return bank
+
+
+def save_background_bank(bank, path):
+    """
+        Save a background bank to a file, in the layout used without copying it when it is loaded
+        :param bank: Background bank
+        :type bank: MixtureBank
+        :param path: File path
+        :type path: str
+    """
+    # Write to a temporary file and rename it, so workers never load a partial file
+    tmp_fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(tmp_fd, 'wb') as bank_file:
+            bank_file.write(bank.to_bytes(native=True))
+        os.chmod(tmp_filename, 0o644)
+        os.replace(tmp_filename, path)
+    except BaseException:
+        os.unlink(tmp_filename)
+        raise
+
+
+def _load_background(path):
+    """
+        Load a background bank from a file, with the digest of its content. Banks are loaded once per process
+        and mapped read only, so the worker processes of a node share their memory. A file replaced by a rebuilt
+        bank is loaded again.
+        :param path: File path
+        :type path: str
+        :return: Background bank and digest
+        :rtype: tuple
+    """
+    stat = os.stat(path)
+    file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    entry = _banks.get(path)
+    if entry is None or entry[0] != file_id:
+        with open(path, 'rb') as bank_file:
+            buffer = mmap.mmap(bank_file.fileno(), 0, access=mmap.ACCESS_READ)
+        entry = (file_id, MixtureBank.from_bytes(buffer), hashlib.blake2b(buffer, digest_size=16).hexdigest())
+        _banks[path] = entry
+
+    return entry[1], entry[2]
+
+
+def load_background_bank(path):
+    """
+        Load a background bank from a file. Banks are loaded once per process and mapped read only, so the
+        worker processes of a node share their memory.
+        :param path: File path
+        :type path: str
+        :return: Background bank
+        :rtype: MixtureBank
+    """
+    return _load_background(path)[0]
+
+
+def get_background_digest(path):
+    """
+        Get the digest of the background bank of a file, which identifies the bank the models are adapted from
+        :param path: File path
+        :type path: str
+        :return: Digest of the bank
+        :rtype: str
+    """
+    return _load_background(path)[1]
@@ -0,0 +1,207 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke GaussianTable module """
+import numpy as np
+
+#: Version of the JSON representation
+TABLE_VERSION = 2
+
+
+class GaussianTable:
+    """
+        Number of observations, mean and sum of squared deviations of the times of each code, in arrays sorted
+        by code for each feature type
+    """
+    def __init__(self):
+        #: Sorted codes of each feature type
+        self.codes = {}
+
+        #: Number of observations of each code
+        self.counts = {}
+
+        #: Mean time of each code
+        self.means = {}
+
+        #: Sum of squared deviations from the mean of each code
+        self.m2 = {}
+
+        self._std = {}
+
+    def __len__(self):
+        return sum(codes.shape[0] for codes in self.codes.values())
+
+    def get_std(self, feature_type):
+        """
+            Standard deviation of the times of the codes of a feature type
+            :param feature_type: Feature type
+            :type feature_type: int
+            :return: Standard deviation of each code
+            :rtype: np.ndarray
+        """
+        if feature_type not in self._std:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self._std[feature_type] = np.sqrt(np.where(self.counts[feature_type] > 0,
+                                                           self.m2[feature_type] / self.counts[feature_type], 0))
+        return self._std[feature_type]
+
+    def _get_rows(self, feature_type, codes):
+        """
+            Position of some codes in the arrays of a feature type
+            :param feature_type: Feature type
+            :param codes: Array of codes
+            :return: Position of each code, or -1 for unknown codes
+        """
+        rows = np.full(codes.shape[0], -1, dtype=np.intp)
+        if feature_type not in self.codes or self.codes[feature_type].shape[0] == 0:
+            return rows
+
+        table_codes = self.codes[feature_type]
+        positions = np.minimum(np.searchsorted(table_codes, codes), table_codes.shape[0] - 1)
+        found = table_codes[positions] == codes
+        rows[found] = positions[found]
+        return rows
+
+    def get_stats(self, code_table):
+        """
+            Get the statistics of a list of codes
+            :param code_table: List of (type, code) pairs
+            :type code_table: list
+            :return: Number of observations, mean and standard deviation of each code, zero for unknown codes
+            :rtype: tuple
+        """
+        counts = np.zeros(len(code_table), dtype=np.int64)
+        means = np.zeros(len(code_table))
+        std = np.zeros(len(code_table))
+
+        types = np.array([feature_type for feature_type, _ in code_table], dtype=np.int64)
+        codes = np.array([str(code) for _, code in code_table], dtype=str)
+        for feature_type in np.unique(types).tolist():
+            code_ids = np.flatnonzero(types == feature_type)
+            rows = self._get_rows(feature_type, codes[code_ids])
+            known = rows >= 0
+            code_ids, rows = code_ids[known], rows[known]
+            counts[code_ids] = self.counts[feature_type][rows]
+            means[code_ids] = self.means[feature_type][rows]
+            std[code_ids] = self.get_std(feature_type)[rows]
+
+        return counts, means, std
+
+    def update(self, code_table, counts, means, m2):
+        """
+            Merge the statistics of new observations of a list of codes
+            :param code_table: List of (type, code) pairs
+            :type code_table: list
+            :param counts: Number of new observations of each code
+            :type counts: np.ndarray
+            :param means: Mean of the new observations of each code
+            :type means: np.ndarray
+            :param m2: Sum of squared deviations from their mean of the new observations of each code
+            :type m2: np.ndarray
+        """
+        types = np.array([feature_type for feature_type, _ in code_table], dtype=np.int64)
+        codes = np.array([str(code) for _, code in code_table], dtype=str)
+        for feature_type in np.unique(types).tolist():
+            code_ids = np.flatnonzero(types == feature_type)
+            self._add_codes(feature_type, codes[code_ids])
+            rows = self._get_rows(feature_type, codes[code_ids])
+
+            # Chan et al. pairwise update, stable when the observations are far from zero
+            count_a = self.counts[feature_type][rows]
+            count_b = counts[code_ids]
+            count = count_a + count_b
+            delta = means[code_ids] - self.means[feature_type][rows]
+            self.means[feature_type][rows] += delta * count_b / count
+            self.m2[feature_type][rows] += m2[code_ids] + delta ** 2 * count_a * count_b / count
+            self.counts[feature_type][rows] = count
+            self._std.pop(feature_type, None)
+
+    def _add_codes(self, feature_type, codes):
+        """
+            Add the unknown codes of a feature type, keeping the arrays sorted
+            :param feature_type: Feature type
+            :param codes: Array of codes
+        """
+        new_codes = np.unique(codes[self._get_rows(feature_type, codes) < 0])
+        if new_codes.shape[0] == 0:
+            return
+
+        if feature_type not in self.codes:
+            self.codes[feature_type] = np.zeros(0, dtype=str)
+            self.counts[feature_type] = np.zeros(0, dtype=np.int64)
+            self.means[feature_type] = np.zeros(0)
+            self.m2[feature_type] = np.zeros(0)
+
+        all_codes = np.concatenate([self.codes[feature_type], new_codes])
+        order = np.argsort(all_codes, kind='stable')
+        self.codes[feature_type] = all_codes[order]
+        self.counts[feature_type] = np.concatenate([self.counts[feature_type],
+                                                    np.zeros(new_codes.shape[0], dtype=np.int64)])[order]
+        self.means[feature_type] = np.concatenate([self.means[feature_type], np.zeros(new_codes.shape[0])])[order]
+        self.m2[feature_type] = np.concatenate([self.m2[feature_type], np.zeros(new_codes.shape[0])])[order]
+        self._std.pop(feature_type, None)
+
+    def to_json(self):
+        """
+            Get a JSON representation of the table
+            :return: JSON representation
+            :rtype: dict
+        """
+        return {
+            'version': TABLE_VERSION,
+            'types': {
+                str(feature_type): {
+                    'codes': self.codes[feature_type].tolist(),
+                    'n': self.counts[feature_type].tolist(),
+                    'mean': self.means[feature_type].tolist(),
+                    'm2': self.m2[feature_type].tolist()
+                } for feature_type in sorted(self.codes)
+            }
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """
+            Load a table from its JSON representation. Models with the statistics stored as {'n', 'x', 'xsq'}
+            for each code are converted.
+            :param data: JSON representation
+            :type data: dict
+            :return: Table
+            :rtype: GaussianTable
+        """
+        table = cls()
+        if data.get('version') == TABLE_VERSION:
+            for feature_type, type_data in data['types'].items():
+                table.codes[int(feature_type)] = np.array(type_data['codes'], dtype=str)
+                table.counts[int(feature_type)] = np.array(type_data['n'], dtype=np.int64)
+                table.means[int(feature_type)] = np.array(type_data['mean'], dtype=float)
+                table.m2[int(feature_type)] = np.array(type_data['m2'], dtype=float)
+            return table
+
+        for feature_type, type_data in data.items():
+            code_stats = type_data['model']
+            codes = np.array([str(code) for code in code_stats], dtype=str)
+            counts = np.array([stats['n'] for stats in code_stats.values()], dtype=np.int64)
+            sum_x = np.array([stats['x'] for stats in code_stats.values()], dtype=float)
+            sum_xsq = np.array([stats['xsq'] for stats in code_stats.values()], dtype=float)
+            order = np.argsort(codes, kind='stable')
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                means = np.where(counts > 0, sum_x / counts, 0)
+            table.codes[int(feature_type)] = codes[order]
+            table.counts[int(feature_type)] = counts[order]
+            table.means[int(feature_type)] = means[order]
+            table.m2[int(feature_type)] = np.maximum(sum_xsq - sum_x * means, 0)[order]
+
+        return table
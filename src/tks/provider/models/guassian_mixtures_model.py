@@ -13,13 +13,102 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with this program.  If not, see <https://www.gnu.org/licenses/>.
 ''' TeSLA CE Keystroke GaussianMixturesModel module'''
-import base64
-from io import BytesIO
+from collections import deque
+import functools
+import os
+import random
+import time
+import billiard
 from sklearn import mixture
-from joblib import dump, load
 import numpy as np
 from tesla_ce_provider.models import SimpleModel
-from ..constants import DWELL, FLIGHT, DIGRAPH, TRIGRAPH, FOURGRAPH
+from ..decision import DecisionEngine
+from ..features import get_features
+from ..metrics import NULL_TIMER
+from .mixture_bank import MixtureBank, encode_mixture_bank, decode_mixture_bank
+from .mixture_em import fit_mixtures
+from .history import encode_history, decode_history
+
+N_COMPONENTS = 3
+
+#: Available backends to fit the mixtures
+FIT_BACKENDS = ['sklearn', 'batch_em']
+
+#: Codes fitted at once by the batch_em backend between two checks of the fit time budget
+BUDGET_BATCH_CODES = 64
+
+#: Pools of fitting worker processes, by process id and number of workers
+_fit_pools = {}
+
+
+def _get_train_array(times):
+    """
+    Convert a list of times to the representation used by the mixtures
+    :param times: List of times
+    :return: Array with a single column
+    """
+    x_train = np.array(times, dtype=float)
+    x_train[np.isnan(x_train)] = 0
+    x_train = np.array(x_train, dtype=int)
+
+    x_train = np.array(x_train)/500
+    return x_train.reshape(-1, 1)
+
+
+def _fit_mixture(x_train):
+    """
+    Fit the mixture of a code from its observations
+    :param x_train: List of observations
+    :return: Weights, means and variances of the components, or None if the mixture can not be fitted
+    """
+    if len(x_train) < N_COMPONENTS:
+        return None
+    try:
+        clf = mixture.GaussianMixture(n_components=N_COMPONENTS,
+                                      covariance_type='full')
+        clf.fit(_get_train_array(x_train))
+    except TypeError:
+        return None
+
+    return clf.weights_, clf.means_[:, 0], clf.covariances_[:, 0, 0]
+
+
+def _init_fit_worker():
+    """
+    Initialize a fitting worker process. Workers use a single BLAS thread, as the parallelism comes from the pool.
+    """
+    from threadpoolctl import threadpool_limits
+    threadpool_limits(limits=1)
+
+
+def _get_fit_pool(workers):
+    """
+    Get the pool of fitting worker processes of this process, created on the first parallel fit and reused by the
+    next ones. Pools are billiard pools, which can be created in the daemonic worker processes of a Celery prefork
+    worker, unlike the multiprocessing ones.
+    :param workers: Number of worker processes
+    :return: Pool of fitting worker processes
+    :rtype: billiard.pool.Pool
+    """
+    # pools inherited from a parent process are not used, and a pool with another number of workers is replaced
+    key = (os.getpid(), workers)
+    pool = _fit_pools.get(key)
+    if pool is None:
+        for other_key in [other_key for other_key in _fit_pools if other_key[0] == key[0]]:
+            _fit_pools.pop(other_key).terminate()
+        pool = billiard.Pool(processes=workers, initializer=_init_fit_worker)
+        _fit_pools[key] = pool
+
+    return pool
+
+
+def _fit_mixtures_chunk(chunk):
+    """
+    Fit the mixtures of a chunk of codes in a fitting worker process
+    :param chunk: List with the observations of each code
+    :return: List with the fitted mixture of each code
+    """
+    return [_fit_mixture(x_train) for x_train in chunk]
 
 
 class GaussianMixturesModel(SimpleModel):
@@ -28,14 +117,113 @@ class GaussianMixturesModel(SimpleModel):
     """
     def __init__(self, model_object=None):
         super().__init__(model_object=model_object)
+
+        #: Update fitted mixtures incrementally instead of refitting them from all stored samples
+        self._online = False
+
+        #: Codes with new observations since the last fit, with their new observations
+        self._dirty_codes = {}
+
+        #: Number of worker processes used to fit the mixtures
+        self._fit_workers = 1
+
+        #: Minimum number of codes to fit the mixtures in parallel
+        self._fit_parallel_min_codes = 64
+
+        #: Backend used to fit the mixtures
+        self._fit_backend = 'sklearn'
+
+        #: Maximum number of stored observations of each code, None to store all of them
+        self._max_code_observations = None
+
+        #: Number of observations of each code added to the model, stored or not
+        self._observations_seen = {}
+
+        #: Random generator for the selection of the stored observations
+        self._random = random.Random()
+
+        #: Encoded observations of the enrolment samples, until they are decoded
+        self._history = None
+
+        #: Maximum time in seconds to fit the mixtures in a fit call, None to fit all the codes
+        self._fit_time_budget = None
+
+        #: Codes not fitted because the fit time budget was exhausted, fitted in the next fit calls
+        self._deferred_codes = set()
+
         if model_object is not None:
-            with BytesIO() as tmp_bytes:
-                if self._data is not None:
-                    tmp_b64 = self._data.encode('utf-8')
-                    data_model = base64.b64decode(tmp_b64)
-                    tmp_bytes.write(data_model)
-                    self._data = load(tmp_bytes)
+            self._observations_seen = dict(model_object.get('observations_seen', {}))
+            self._history = model_object.get('history')
+            self._deferred_codes = set(model_object.get('deferred_codes', []))
+        if model_object is not None and self._data is not None:
+            self._data = decode_mixture_bank(self._data, n_components=N_COMPONENTS)
 
+    def set_options(self, options):
+        """
+            Set the model options from the provider options
+            :param options: Provider options
+            :type options: dict
+        """
+        self.set_online_enrolment(options['online_enrolment'])
+        self.set_parallel_fit(options['fit_workers'], options['fit_parallel_min_codes'])
+        self.set_fit_backend(options['fit_backend'])
+        self.set_max_code_observations(options['max_code_observations'])
+        self.set_fit_time_budget(options['fit_time_budget'])
+
+    def set_online_enrolment(self, online):
+        """
+            Enable or disable the online enrolment mode
+            :param online: If True, new observations are folded into the fitted mixtures
+            :type online: bool
+        """
+        self._online = online
+
+    def set_parallel_fit(self, workers, min_codes):
+        """
+            Set the parallel fitting of the mixtures
+            :param workers: Number of worker processes. With one worker the mixtures are fitted serially.
+            :type workers: int
+            :param min_codes: Minimum number of codes to fit in a fit call to use the worker processes
+            :type min_codes: int
+        """
+        self._fit_workers = workers
+        self._fit_parallel_min_codes = min_codes
+
+    def set_fit_backend(self, backend):
+        """
+            Set the backend used to fit the mixtures
+            :param backend: 'sklearn' fits each code with sklearn.mixture.GaussianMixture, 'batch_em' fits all
+                            the codes at once with a vectorized EM
+            :type backend: str
+        """
+        if backend not in FIT_BACKENDS:
+            raise ValueError('Fit backend is not available')
+        self._fit_backend = backend
+
+    def set_max_code_observations(self, max_observations):
+        """
+            Set the maximum number of stored observations of each code
+            :param max_observations: Maximum number of observations, or None to store all of them
+            :type max_observations: int
+        """
+        self._max_code_observations = max_observations
+
+    def set_fit_time_budget(self, seconds):
+        """
+            Set the maximum time to fit the mixtures in a fit call. The codes with more observations are fitted
+            first, and the codes not fitted in time are deferred to the next fit calls.
+            :param seconds: Maximum time in seconds, or None to fit all the codes
+            :type seconds: float
+        """
+        self._fit_time_budget = seconds
+
+    def get_deferred_codes(self):
+        """
+            Get the codes whose fit was deferred by the fit time budget
+            :return: List of codes
+            :rtype: list
+        """
+        return sorted(self._deferred_codes)
 
     def to_json(self):
         """
@@ -43,144 +231,477 @@ class GaussianMixturesModel(SimpleModel):
             :return: JSON representation
             :rtype: dict
         """
-        # convert to base64 file model
+        # convert to base64 binary model
+        data = None
         if self._data is not None:
-            with BytesIO() as tmp_bytes:
-                dump(self._data, tmp_bytes)
-                bytes_obj = tmp_bytes.getvalue()
-                base64_obj = base64.b64encode(bytes_obj)
-                self._data = base64_obj.decode('utf-8')
+            data = encode_mixture_bank(self._data)
 
-        return {
+        # observations of the samples are stored in the encoded history
+        history = self._history
+        if history is None:
+            history = encode_history(self._samples)
+
+        model = {
             'percentage': self._percentage,
-            'samples': self._samples,
-            'data': self._data
+            'samples': [{'id': sample['id'], 'features': None} for sample in self._samples],
+            'data': data,
+            'history': history
         }
+        if len(self._observations_seen) > 0:
+            model['observations_seen'] = self._observations_seen
+        if len(self._deferred_codes) > 0:
+            model['deferred_codes'] = self.get_deferred_codes()
+
+        return model
+
+    def get_shared_data(self):
+        """
+            Get the binary representation used to share the model between processes
+            :return: Binary representation of the mixtures
+            :rtype: bytes
+        """
+        if self._data is None:
+            return None
+        return self._data.to_bytes(native=True)
+
+    @classmethod
+    def from_shared_data(cls, buffer):
+        """
+            Create a model for verification from its shared binary representation, without copying it
+            :param buffer: Binary representation of the mixtures
+            :type buffer: mmap.mmap
+            :return: Model
+            :rtype: GaussianMixturesModel
+        """
+        tks_model = cls()
+        tks_model._data = MixtureBank.from_bytes(buffer)
+        return tks_model
 
     def can_analyse(self):
-        if self._percentage >= 1:
+        # features of the deferred codes are discarded, so the model is not used until they are fitted
+        if self._percentage >= 1 and len(self._deferred_codes) == 0:
             return True
         return False
 
-    def enrol(self, features):
+    def enrol(self, features, fit=True):
         """
         Enrol features in this model
         :param features:
+        :param fit: If False, the mixtures are not fitted until fit is called
         :return:
         """
         if self._data is None:
-            self._data = {}
+            self._data = MixtureBank(n_components=N_COMPONENTS)
+
+        # add new features to model
+        new_codes = get_features(features).get_code_times()
+
+        for code, x_new in new_codes.items():
+            if code not in self._dirty_codes:
+                self._dirty_codes[code] = []
+            self._dirty_codes[code] += x_new
+
+        if fit:
+            self.fit(new_codes)
+
+        return new_codes
+
+    def add_sample(self, sample, features=None):
+        """
+        Add given sample to model and update the enrolment percentage. With a maximum number of stored
+        observations per code, the stored observations of each code are a uniform random selection of all the
+        observations added to the model (reservoir sampling), taken out of the samples that stored them.
+        :param sample: Sample object
+        :param features: Observations of each code in the sample
+        """
+        self._load_history()
+        if self._max_code_observations is not None and features is not None:
+            features = self._sample_observations(features)
+
+        super().add_sample(sample, features)
+
+    def _sample_observations(self, features):
+        """
+        Select the stored observations of the codes of a new sample
+        :param features: Observations of each code in the new sample
+        :return: Observations of each code kept in the new sample
+        """
+        new_idx = len(self._samples)
+        kept = {}
+        for code, x_new in features.items():
+            reservoir = [(idx, x) for idx, sample in enumerate(self._samples)
+                         for x in sample['features'].get(code, [])]
+            seen = self._observations_seen.get(code, len(reservoir))
+            changed = False
+
+            if len(reservoir) > self._max_code_observations:
+                reservoir = self._random.sample(reservoir, self._max_code_observations)
+                changed = True
+
+            for x in x_new:
+                seen += 1
+                if len(reservoir) < self._max_code_observations:
+                    reservoir.append((new_idx, x))
+                    continue
+                position = self._random.randrange(seen)
+                if position < self._max_code_observations:
+                    reservoir[position] = (new_idx, x)
+                    changed = True
+            self._observations_seen[code] = seen
+
+            observations = {}
+            for idx, x in reservoir:
+                observations.setdefault(idx, []).append(x)
+            if len(observations.get(new_idx, [])) > 0:
+                kept[code] = observations[new_idx]
+
+            # observations replaced in the stored samples
+            if changed:
+                for idx, sample in enumerate(self._samples):
+                    if idx in observations:
+                        sample['features'][code] = observations[idx]
+                    elif code in sample['features']:
+                        del sample['features'][code]
+
+        return kept
+
+    def fit(self, new_codes=None):
+        """
+        Fit the mixtures of the codes with new observations since the last fit and of the deferred codes. The
+        observations of the samples already added to the model are taken from the model samples.
+        :param new_codes: New observations of a sample not added to the model yet
+        :type new_codes: dict
+        """
+        if self._data is None:
+            self._data = MixtureBank(n_components=N_COMPONENTS)
+        if new_codes is None:
+            new_codes = {}
+        self._load_history()
+
+        if self._online:
+            self._fit_online(new_codes)
+        else:
+            self._fit_full(new_codes)
+
+        self._dirty_codes.clear()
+
+    def defer_fit(self):
+        """
+        Defer the fit of the codes with new observations since the last fit, so the model only records the
+        observations. The deferred codes are fitted in the next fit or refit call.
+        """
+        self._deferred_codes.update(self._dirty_codes.keys())
+        self._dirty_codes.clear()
+
+    def refit(self):
+        """
+        Refit the mixtures of all the codes from their stored observations, without a fit time budget. Mixtures
+        updated in online mode are replaced by the ones fitted from the stored observations.
+        """
+        if self._data is None:
+            self._data = MixtureBank(n_components=N_COMPONENTS)
+        self._load_history()
 
         codes = {}
-        n_components = 3
+        for sample in self._samples:
+            for code, x_train in sample['features'].items():
+                codes.setdefault(code, []).extend(x_train)
 
-        # get features from other enrolment samples
+        fit_time_budget = self._fit_time_budget
+        self._fit_time_budget = None
+        try:
+            self._fit_codes(codes)
+        finally:
+            self._fit_time_budget = fit_time_budget
+        self._dirty_codes.clear()
+
+    def compact(self):
+        """
+        Limit the stored observations of each code to the maximum number of stored observations, for the models
+        enrolled before the limit was set. The kept observations are a uniform random selection of the stored
+        ones, in their original order.
+        """
+        self._load_history()
+        if self._max_code_observations is None:
+            return
+
+        stored = {}
+        for idx, sample in enumerate(self._samples):
+            for code, x_train in sample['features'].items():
+                stored.setdefault(code, []).extend((idx, x) for x in x_train)
+
+        for code, reservoir in stored.items():
+            if len(reservoir) <= self._max_code_observations:
+                continue
+            self._observations_seen[code] = max(self._observations_seen.get(code, 0), len(reservoir))
+
+            observations = {}
+            for position in sorted(self._random.sample(range(len(reservoir)), self._max_code_observations)):
+                idx, x = reservoir[position]
+                observations.setdefault(idx, []).append(x)
+            for idx, sample in enumerate(self._samples):
+                if idx in observations:
+                    sample['features'][code] = observations[idx]
+                elif code in sample['features']:
+                    del sample['features'][code]
+
+    def _load_history(self):
+        """
+        Decode the observations of the enrolment samples. Verification does not use them, so they are only
+        decoded when the model is enrolled.
+        """
+        if self._history is None:
+            return
+
+        samples_features = decode_history(self._history)
+        self._samples = [{'id': sample['id'], 'features': features}
+                         for sample, features in zip(self._samples, samples_features)]
+        self._history = None
+
+    def _get_code_history(self, code):
+        """
+        Get the observations of a code stored in the enrolment samples
+        :param code: Feature code
+        :return: List of observations
+        """
+        history = []
         for sample in self._samples:
-            for feature in sample['features']:
-                if feature not in codes:
-                    codes[f"{feature}"] = []
+            if code in sample['features']:
+                history += sample['features'][code]
 
-                codes[f"{feature}"] += sample['features'][feature]
+        return history
 
-        # add new features to model
-        new_codes = {}
-        for feature_array in features:
-            for feature in feature_array['features']:
-                if f"{feature['type']}_{feature['code']}" not in codes:
-                    codes[f"{feature['type']}_{feature['code']}"] = []
-                if f"{feature['type']}_{feature['code']}" not in new_codes:
-                    new_codes[f"{feature['type']}_{feature['code']}"] = []
+    def _fit_full(self, new_codes):
+        """
+        Refit the mixtures of the dirty codes using all their stored observations. The mixtures of the codes
+        without new observations are kept as they are.
+        :param new_codes: New observations not added to the model samples
+        """
+        codes = {code: [] for code in self._dirty_codes}
+        codes.update({code: [] for code in self._deferred_codes})
+
+        # get features from other enrolment samples
+        for sample in self._samples:
+            for feature in sample['features']:
+                if feature in codes:
+                    codes[feature] += sample['features'][feature]
 
-                codes[f"{feature['type']}_{feature['code']}"].append(feature['time'])
-                new_codes[f"{feature['type']}_{feature['code']}"].append(feature['time'])
+        for code, x_new in new_codes.items():
+            codes[code] += x_new
 
-        user_model = self._data
+        self._fit_codes(codes)
 
-        for code, x_train in codes.items():
-            if len(x_train) < n_components:
+    def _fit_online(self, new_codes):
+        """
+        Fold the new observations into the fitted mixtures. Codes without a fitted mixture are fitted from
+        their stored observations, so the cost depends on the new observations and not on the enrolment history.
+        :param new_codes: New observations not added to the model samples
+        """
+        codes = {code: self._get_code_history(code) + new_codes.get(code, []) for code in self._deferred_codes}
+        for code, x_new in self._dirty_codes.items():
+            if code not in self._data or code in codes:
+                codes[code] = self._get_code_history(code) + new_codes.get(code, [])
                 continue
+
+            if self._data.get_count(code) == 0:
+                # Models fitted before the online mode do not keep the number of observations
+                self._data.set_count(code, len(self._get_code_history(code)) + len(new_codes.get(code, []))
+                                     - len(x_new))
             try:
-                x_train = np.array(x_train, dtype=float)
-                x_train[np.isnan(x_train)] = 0
-                x_train = np.array(x_train, dtype=int)
+                self._data.update_mixture(code, _get_train_array(x_new))
+            except TypeError:
+                pass
 
-                x_train = np.array(x_train)/500
-                x_train = x_train.reshape(-1, 1)
+        self._fit_codes(codes)
 
-                clf = mixture.GaussianMixture(n_components=n_components,
-                                              covariance_type='full')
-                clf.fit(x_train)
+    def _fit_codes(self, codes):
+        """
+        Fit the mixtures of a set of codes from their observations. When there are enough codes and parallel
+        fitting is enabled, the codes are split in chunks fitted by a pool of worker processes. With a fit time
+        budget, the codes with more observations are fitted first and the codes not fitted in time are deferred.
+        :param codes: Dictionary with the list of observations of each code
+        :type codes: dict
+        """
+        # codes without enough observations are not fitted nor deferred
+        self._deferred_codes.difference_update(codes.keys())
+        codes = {code: x_train for code, x_train in codes.items() if len(x_train) >= N_COMPONENTS}
+        code_names = list(codes.keys())
 
-                user_model[code] = clf
-            except TypeError:
-                pass
+        deadline = None
+        if self._fit_time_budget is not None:
+            deadline = time.perf_counter() + self._fit_time_budget
+            code_names.sort(key=lambda code: len(codes[code]), reverse=True)
 
-        self._data = user_model
+        if self._fit_backend == 'batch_em':
+            fitted = self._fit_batch_em(code_names, codes, deadline)
+        elif self._fit_workers > 1 and len(code_names) >= self._fit_parallel_min_codes:
+            fitted = self._fit_parallel(code_names, codes, deadline)
+        else:
+            fitted = []
+            for code in code_names:
+                if deadline is not None and len(fitted) > 0 and time.perf_counter() > deadline:
+                    break
+                fitted.append(_fit_mixture(codes[code]))
 
-        return new_codes
+        # codes are fitted in order, the ones after the last fitted code are deferred
+        self._deferred_codes.update(code_names[len(fitted):])
+
+        fitted_codes = [(code, mixture_params) for code, mixture_params in zip(code_names, fitted)
+                        if mixture_params is not None]
+        if len(fitted_codes) == 0:
+            return
+
+        self._data.set_mixtures([code for code, _ in fitted_codes],
+                                [mixture_params[0] for _, mixture_params in fitted_codes],
+                                [mixture_params[1] for _, mixture_params in fitted_codes],
+                                [mixture_params[2] for _, mixture_params in fitted_codes],
+                                [len(codes[code]) for code, _ in fitted_codes])
+
+    @staticmethod
+    def _fit_batch_em(code_names, codes, deadline):
+        """
+        Fit the mixtures of a list of codes with the vectorized EM, in batches when there is a deadline
+        :param code_names: List of codes, in fitting order
+        :param codes: Dictionary with the list of observations of each code
+        :param deadline: Time after which no more batches are fitted, or None
+        :return: List with the fitted mixture of the first codes
+        """
+        batch_size = len(code_names) if deadline is None else BUDGET_BATCH_CODES
+        fitted = []
+        for start in range(0, len(code_names), max(batch_size, 1)):
+            if deadline is not None and len(fitted) > 0 and time.perf_counter() > deadline:
+                break
+            batch = code_names[start:start + batch_size]
+            weights, means, variances = fit_mixtures([_get_train_array(codes[code]) for code in batch],
+                                                     N_COMPONENTS)
+            fitted += list(zip(weights, means, variances))
+        return fitted
+
+    def _fit_parallel(self, code_names, codes, deadline):
+        """
+        Fit the mixtures of a list of codes in a pool of worker processes
+        :param code_names: List of codes, in fitting order
+        :param codes: Dictionary with the list of observations of each code
+        :param deadline: Time after which no more chunks are sent to the workers, or None
+        :return: List with the fitted mixture of the first codes
+        """
+        # a few chunks per worker balance the load without sending one task per code
+        n_chunks = min(len(code_names), self._fit_workers * 4)
+        bounds = np.linspace(0, len(code_names), n_chunks + 1).astype(int)
+        chunks = [[codes[code] for code in code_names[bounds[idx]:bounds[idx + 1]]] for idx in range(n_chunks)]
 
-    def verify(self, features, config):
+        # at most two chunks per worker are sent ahead, so the chunks started after the deadline are few. The
+        # chunks sent are fitted and kept.
+        pool = _get_fit_pool(self._fit_workers)
+        pending = deque()
+        fitted = []
+        for chunk in chunks:
+            if len(pending) >= 2 * self._fit_workers:
+                fitted += pending.popleft().get()
+                if deadline is not None and time.perf_counter() > deadline:
+                    break
+            pending.append(pool.apply_async(_fit_mixtures_chunk, (chunk,)))
+        while len(pending) > 0:
+            fitted += pending.popleft().get()
+
+        return fitted
+
+    def verify(self, features, config, timer=NULL_TIMER):
         """
         Verify if features are from this model
         :param features:
         :param config:
+        :param timer: Timer of the verification phases
         :return:
         """
-        samples_discarded = 0
-        number_features = 0
-        codes = {}
-        decision_threshold = config['start_decision_threshold']
+        return self.verify_batch([features], config, timer)[0]
+
+    def verify_batch(self, features_list, config, timer=NULL_TIMER):
+        """
+        Verify if the features of several requests are from this model, scoring all of them at once
+        :param features_list: Features of each request
+        :param config:
+        :param timer: Timer of the verification phases
+        :return: Verification of each request, as returned by verify
+        """
+        features_list = [get_features(features) for features in features_list]
 
-        for feature_array in features:
-            for feature in feature_array['features']:
-                if f"{feature['type']}_{feature['code']}" not in codes:
-                    codes[f"{feature['type']}_{feature['code']}"] = []
-                codes[f"{feature['type']}_{feature['code']}"].append(feature['time'])
-                number_features += 1
+        # rows and observations of the known codes of each request, grouped by code
+        all_rows = []
+        all_y_test = []
+        all_types = []
+        all_discarded = []
+        for features in features_list:
+            known = np.array([key in self._data for key in features.keys], dtype=bool)
+            all_discarded.append(int((~known).sum()))
+            code_rows = np.full(len(features.keys), -1, dtype=np.intp)
+            code_rows[known] = self._data.get_rows([key for key in features.keys if key in self._data])
 
-        for code in codes:
+            order, _ = features.group_by_code()
+            order = order[known[features.code_ids[order]]]
+            all_rows.append(code_rows[features.code_ids[order]])
+            all_y_test.append(_get_train_array(features.times[order]))
+            all_types.append(features.types[order])
+            timer.count('codes', len(features.keys))
+        timer.phase('code_lookup')
 
-            if code not in self._data:
-                samples_discarded += 1
-                continue
+        engine = DecisionEngine(config)
+        if engine.early_decision:
+            return self._verify_sequential(engine, features_list, all_rows, all_y_test, all_types, all_discarded,
+                                           timer)
+
+        # score the features of all the requests in one pass
+        offsets = np.zeros(len(features_list) + 1, dtype=np.intp)
+        np.cumsum([rows.shape[0] for rows in all_rows], out=offsets[1:])
+        accepted = self._accept_rows(np.concatenate(all_rows), np.concatenate(all_y_test))
+        timer.phase('score')
+
+        verifications = []
+        for idx, features in enumerate(features_list):
+            decision_threshold, decisions = engine.run(all_types[idx], accepted[offsets[idx]:offsets[idx + 1]])
+            verifications.append([decision_threshold, all_discarded[idx], len(features), decisions,
+                                  all_types[idx].shape[0]])
+        timer.phase('decision')
 
-            clf = self._data[code]
-            y_test = codes[code]
-
-            y_test = np.array(y_test, dtype=float)
-            y_test[np.isnan(y_test)] = 0
-            y_test = np.array(y_test, dtype=int)
-
-            y_test = np.array(y_test)/500
-            y_test = y_test.reshape(-1, 1)
-
-            for result in clf.score_samples(y_test):
-                delta = 0
-
-                if result > np.log(0.7):
-                    # sample is of this user
-                    result_dict = {
-                        DWELL: config['result_valid_delta_di'],
-                        FLIGHT: config['result_valid_delta_di'],
-                        DIGRAPH: config['result_valid_delta_di'],
-                        TRIGRAPH: config['result_valid_delta_tri'],
-                        FOURGRAPH: config['result_valid_delta_four'],
-                    }
-                else:
-                    result_dict = {
-                        DWELL: -config['result_invalid_delta_di'],
-                        FLIGHT: -config['result_invalid_delta_di'],
-                        DIGRAPH: -config['result_invalid_delta_di'],
-                        TRIGRAPH: -config['result_invalid_delta_tri'],
-                        FOURGRAPH: -config['result_invalid_delta_four'],
-                    }
-
-                delta = result_dict[int(code.split('_')[0], 10)]
-                decision_threshold += delta
-
-                if decision_threshold < 0:
-                    decision_threshold = 0.
-                elif decision_threshold > 1:
-                    decision_threshold = 1.
-
-        return [decision_threshold, samples_discarded, number_features]
+        return verifications
+
+    def _verify_sequential(self, engine, features_list, all_rows, all_y_test, all_types, all_discarded, timer):
+        """
+        Verify each request scoring its features in chunks, until the decision engine settles its outcome
+        :param engine: Decision engine
+        :param features_list: Features of each request
+        :param all_rows: Mixture row of the known features of each request
+        :param all_y_test: Observations of the known features of each request
+        :param all_types: Type of the known features of each request
+        :param all_discarded: Number of discarded features of each request
+        :param timer: Timer of the verification phases
+        :return: Verification of each request, as returned by verify
+        """
+        verifications = []
+        for idx, features in enumerate(features_list):
+            decision_threshold, decisions, evaluated = engine.run_sequential(
+                all_types[idx], functools.partial(self._score_slice, all_rows[idx], all_y_test[idx]))
+            verifications.append([decision_threshold, all_discarded[idx], len(features), decisions, evaluated])
+        timer.phase('score')
+
+        return verifications
+
+    def _score_slice(self, rows, y_test, start, end):
+        """
+        Score a slice of the features of a request
+        :param rows: Mixture row of each feature
+        :param y_test: Observation of each feature
+        :param start: First feature of the slice
+        :param end: End of the slice
+        :return: Whether each feature of the slice is accepted
+        """
+        return self._accept_rows(rows[start:end], y_test[start:end])
+
+    def _accept_rows(self, rows, y_test):
+        """
+        Decide which features are accepted by the mixtures of their codes
+        :param rows: Mixture row of each feature
+        :param y_test: Observation of each feature
+        :return: Whether each feature is accepted
+        """
+        return self._data.score_rows(rows, y_test) > np.log(0.7)
@@ -13,9 +13,12 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """ TeSLA CE Keystroke GaussianModel module """
-from math import sqrt
+import numpy as np
 from tesla_ce_provider.models import SimpleModel
-from ..constants import DWELL, FLIGHT, DIGRAPH, TRIGRAPH, FOURGRAPH
+from ..decision import DecisionEngine
+from ..features import get_features
+from ..metrics import NULL_TIMER
+from .gaussian_table import GaussianTable
 
 
 class GaussianModel(SimpleModel):
@@ -25,6 +28,31 @@ class GaussianModel(SimpleModel):
     def __init__(self, model_object=None):
         super().__init__(model_object=model_object)
 
+        if model_object is not None and self._data is not None:
+            self._data = GaussianTable.from_json(self._data)
+
+    def to_json(self):
+        '''
+        Get a JSON representation of the object
+        :return: JSON representation
+        '''
+        data = None
+        if self._data is not None:
+            data = self._data.to_json()
+
+        return {
+            'percentage': self._percentage,
+            'samples': self._samples,
+            'data': data
+        }
+
+    def get_shared_data(self):
+        '''
+        Get the binary representation used to share the model between processes
+        :return: None, this model is not shared
+        '''
+        return None
+
     def can_analyse(self):
         '''
         Can analyse function
@@ -34,105 +62,104 @@ class GaussianModel(SimpleModel):
             return True
         return False
 
-    def enrol(self, features):
+    def enrol(self, features, fit=True):
         '''
         Enrol features in this model
         :param features:
+        :param fit: Not used, the statistics are updated on enrol
         :return:
         '''
         if self._data is None:
-            self._data = {}
+            self._data = GaussianTable()
 
-        for feature_array in features:
-            for feature in feature_array['features']:
-                aux = {"n": 0, "xsq": 0, "x": 0}
-                if str(feature['type']) not in self._data:
-                    self._data[str(feature['type'])] = {
-                        'id': None,
-                        'model': {}
-                    }
+        features = get_features(features)
+        if len(features) == 0:
+            return {}
 
-                if feature['code'] in self._data[str(feature['type'])]['model']:
-                    aux = self._data[str(feature['type'])]['model'][feature['code']]
+        # times that are not finite numbers, such as null times, are not observations
+        observed = np.isfinite(features.times)
+        code_ids = features.code_ids[observed]
+        times = features.times[observed]
 
-                aux['n'] += 1
-                aux['x'] += feature['time']
-                aux['xsq'] += feature['time']**2
+        # statistics of the new observations of each code, the deviations are taken from the code mean
+        counts = np.bincount(code_ids, minlength=len(features.code_table))
+        means = np.bincount(code_ids, weights=times, minlength=len(features.code_table)) / np.maximum(counts, 1)
+        m2 = np.bincount(code_ids, weights=(times - means[code_ids]) ** 2, minlength=len(features.code_table))
 
-                self._data[str(feature['type'])]['model'][feature['code']] = aux
+        known = np.flatnonzero(counts > 0)
+        self._data.update([features.code_table[code_id] for code_id in known.tolist()], counts[known], means[known],
+                          m2[known])
 
         return {}
 
-    def verify(self, features, config):
+    def fit(self):
+        '''
+        Fit the model. The statistics are already updated on enrol
+        :return:
+        '''
+
+    def verify(self, features, config, timer=NULL_TIMER):
         '''
         Verify if features are from this model
         :param features:
         :param config:
+        :param timer: Timer of the verification phases
         :return:
         '''
+        return self.verify_batch([features], config, timer)[0]
 
-        samples_discarded = 0
-        number_features = 0
-        decision_threshold = config['start_decision_threshold']
-
-        for feature_array in features:
-            for feature in feature_array['features']:
-                number_features += 1
-                if str(feature['type']) not in self._data:
-                    samples_discarded += 1
-                    continue
-
-                if feature['code'] not in self._data[str(feature['type'])]['model']:
-                    samples_discarded += 1
-                    continue
-
-                key_model = self._data[str(feature['type'])]['model'][feature['code']]
-
-                muu = key_model['x']/key_model['n']
-                roo = 0
-                try:
-                    roo = sqrt(key_model['xsq']/key_model['n']
-                              - ((key_model['x']/key_model['n'])**2))
-                except ValueError:
-                    # sqrt negative -> ro = 0
-                    pass
-
-                # muu = mean
-                # roo = standard deviation
-                if roo == 0:
-                    samples_discarded += 1
-                    continue
-
-                dist = abs(feature['time'] - muu)/roo
-
-                delta = 0
-                if dist <= 1:
-                    # sample is of this user
-                    result_dict = {
-                        DWELL: config['result_valid_delta_di'],
-                        FLIGHT: config['result_valid_delta_di'],
-                        DIGRAPH: config['result_valid_delta_di'],
-                        TRIGRAPH: config['result_valid_delta_tri'],
-                        FOURGRAPH: config['result_valid_delta_four'],
-                    }
-                else:
-                    result_dict = {
-                        DWELL: config['result_invalid_delta_di'],
-                        FLIGHT: config['result_invalid_delta_di'],
-                        DIGRAPH: config['result_invalid_delta_di'],
-                        TRIGRAPH: config['result_invalid_delta_tri'],
-                        FOURGRAPH: config['result_invalid_delta_four'],
-                    }
-                delta = result_dict[feature['type']]
-
-                decision_threshold += delta
-
-                if decision_threshold > 1:
-                    decision_threshold = 1
-                elif decision_threshold < 0:
-                    decision_threshold = 0
-
-        #if samples_discarded > number_features*0.5:
-        #    return None
-
-        return [decision_threshold, samples_discarded, number_features]
+    def verify_batch(self, features_list, config, timer=NULL_TIMER):
+        '''
+        Verify if the features of several requests are from this model, scoring all of them at once
+        :param features_list: Features of each request
+        :param config:
+        :param timer: Timer of the verification phases
+        :return: Verification of each request, as returned by verify
+        '''
+        features_list = [get_features(features) for features in features_list]
+        if self._data is None:
+            self._data = GaussianTable()
+
+        # mean and standard deviation of the code of each feature
+        all_muu = []
+        all_roo = []
+        for features in features_list:
+            _, code_muu, code_roo = self._data.get_stats(features.code_table)
+            all_muu.append(code_muu[features.code_ids])
+            all_roo.append(code_roo[features.code_ids])
+            timer.count('codes', len(features.code_table))
+        timer.phase('code_lookup')
+
+        # muu = mean
+        # roo = standard deviation
+        muu = np.concatenate(all_muu)
+        roo = np.concatenate(all_roo)
+        times = np.concatenate([features.times for features in features_list])
+
+        # features of codes without deviation, such as the unknown codes and the codes with a single
+        # observation, are discarded
+        valid = roo > 0
+
+        # sample is of this user if dist <= 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dist = np.abs(times - muu) / roo
+        accepted = dist <= 1
+        timer.phase('score')
+
+        # GaussianModel has always added the deltas of the rejected features to the threshold
+        engine = DecisionEngine(config, reject_sign=1)
+        verifications = []
+        offset = 0
+        for features in features_list:
+            number_features = len(features)
+            request_valid = valid[offset:offset + number_features]
+            samples_discarded = int((~request_valid).sum())
+            request_accepted = accepted[offset:offset + number_features][request_valid]
+            decision_threshold, decisions, evaluated = engine.run_sequential(
+                features.types[request_valid], lambda start, end, values=request_accepted: values[start:end])
+            offset += number_features
+
+            verifications.append([decision_threshold, samples_discarded, number_features, decisions, evaluated])
+        timer.phase('decision')
+
+        return verifications
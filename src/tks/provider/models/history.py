@@ -0,0 +1,198 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke enrolment history module'''
+import base64
+import struct
+import numpy as np
+
+#: Binary format identifier
+HISTORY_MAGIC = b'TKSH'
+
+#: Current version of the binary format
+HISTORY_VERSION = 1
+
+#: Binary format header: magic, version and number of codes
+HISTORY_HEADER = struct.Struct('<4sBI')
+
+
+def _encode_varints(values):
+    """
+    Encode unsigned integers as variable length integers of 7 bits per byte
+    :param values: Unsigned integers
+    :type values: np.ndarray
+    :return: Encoded integers
+    :rtype: bytes
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(values.shape[0], dtype=np.intp)
+    for shift in range(7, 64, 7):
+        n_bytes += values >= (np.uint64(1) << np.uint64(shift))
+
+    starts = np.zeros(values.shape[0], dtype=np.intp)
+    np.cumsum(n_bytes[:-1], out=starts[1:])
+    encoded = np.zeros(int(n_bytes.sum()), dtype=np.uint8)
+    for idx in range(int(n_bytes.max(initial=0))):
+        mask = n_bytes > idx
+        chunk = (values[mask] >> np.uint64(7 * idx)) & np.uint64(0x7f)
+        chunk |= np.where(n_bytes[mask] > idx + 1, np.uint64(0x80), np.uint64(0))
+        encoded[starts[mask] + idx] = chunk
+
+    return encoded.tobytes()
+
+
+def _decode_varints(data):
+    """
+    Decode variable length integers of 7 bits per byte
+    :param data: Encoded integers
+    :type data: bytes
+    :return: Unsigned integers
+    :rtype: np.ndarray
+    """
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero((encoded & 0x80) == 0)
+    starts = np.zeros(ends.shape[0], dtype=np.intp)
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts + 1
+
+    values = np.zeros(ends.shape[0], dtype=np.uint64)
+    for idx in range(int(lengths.max(initial=0))):
+        mask = lengths > idx
+        values[mask] |= (encoded[starts[mask] + idx] & 0x7f).astype(np.uint64) << np.uint64(7 * idx)
+
+    return values
+
+
+def _quantize(times):
+    """
+    Quantize a list of times to integer milliseconds, the same way the mixtures read them
+    :param times: List of times
+    :return: Array of integer times
+    """
+    times = np.array(times, dtype=float)
+    times[np.isnan(times)] = 0
+    return times.astype(np.int64)
+
+
+def _cumsum_by_group(deltas, counts):
+    """
+    Cumulative sum of consecutive groups of deltas, restarting at the start of each group
+    :param deltas: Deltas of all the groups
+    :param counts: Number of deltas of each group
+    :return: Cumulative sums
+    """
+    sums = np.cumsum(deltas)
+    ends = np.cumsum(counts)
+    bases = np.zeros(counts.shape[0], dtype=sums.dtype)
+    bases[1:] = sums[ends[:-1] - 1]
+    return sums - np.repeat(bases, counts)
+
+
+def encode_history(samples):
+    """
+    Encode the observations of each code stored in the enrolment samples. Times are quantized to integer
+    milliseconds and the observations of a code in a sample are sorted and delta encoded as variable length
+    integers. Codes are written once in a code table, as their lengths followed by their UTF-8 bytes.
+    :param samples: List of samples with the observations of each code as features
+    :type samples: list
+    :return: Base64 encoded history
+    :rtype: str
+    """
+    code_index = {}
+    code_ids = []
+    sample_ids = []
+    times = []
+    for sample_idx, sample in enumerate(samples):
+        for code, x_train in (sample['features'] or {}).items():
+            code_ids += [code_index.setdefault(code, len(code_index))] * len(x_train)
+            sample_ids += [sample_idx] * len(x_train)
+            times += x_train
+
+    # observations sorted by code, then sample, then time. Each (code, sample) pair is an entry.
+    code_ids = np.array(code_ids, dtype=np.int64)
+    sample_ids = np.array(sample_ids, dtype=np.int64)
+    times = _quantize(times)
+    order = np.lexsort((times, sample_ids, code_ids))
+    code_ids, sample_ids, times = code_ids[order], sample_ids[order], times[order]
+
+    entry_starts = np.flatnonzero(np.diff(code_ids, prepend=-1) | np.diff(sample_ids, prepend=-1))
+    entry_codes = code_ids[entry_starts]
+    entry_samples = sample_ids[entry_starts]
+    entry_counts = np.diff(np.append(entry_starts, times.shape[0]))
+    code_entries = np.bincount(entry_codes, minlength=len(code_index))
+
+    # sample index and times are delta encoded within each code and each entry
+    sample_deltas = np.diff(entry_samples, prepend=0)
+    code_starts = np.cumsum(code_entries) - code_entries
+    sample_deltas[code_starts[code_entries > 0]] = entry_samples[code_starts[code_entries > 0]]
+    time_deltas = np.diff(times, prepend=0)
+    time_deltas[entry_starts] = times[entry_starts]
+    zigzag = (time_deltas << 1) ^ (time_deltas >> 63)
+
+    # number of samples, entries of each code, sample index delta of each entry, observations of each entry
+    # and time deltas of the observations
+    integers = np.concatenate([[len(samples)], code_entries, sample_deltas, entry_counts, zigzag]).astype(np.uint64)
+
+    encoded_codes = [code.encode('utf-8') for code in code_index]
+    code_lengths = np.array([len(code) for code in encoded_codes], dtype='<u2')
+    data = HISTORY_HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, len(encoded_codes)) + code_lengths.tobytes() + \
+        b''.join(encoded_codes) + _encode_varints(integers)
+
+    return base64.b64encode(data).decode('ascii')
+
+
+def decode_history(history):
+    """
+    Decode the observations of each code stored in the enrolment samples
+    :param history: Base64 encoded history
+    :type history: str
+    :return: List with the observations of each code of each sample
+    :rtype: list
+    """
+    data = base64.b64decode(history)
+    magic, version, n_codes = HISTORY_HEADER.unpack_from(data)
+    if magic != HISTORY_MAGIC or version != HISTORY_VERSION:
+        raise ValueError('Invalid enrolment history format')
+
+    offset = HISTORY_HEADER.size
+    code_lengths = np.frombuffer(data, dtype='<u2', count=n_codes, offset=offset)
+    offset += code_lengths.nbytes
+    codes = []
+    for length in code_lengths.tolist():
+        codes.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+    integers = _decode_varints(data[offset:]).astype(np.int64)
+
+    n_samples = int(integers[0])
+    position = 1
+    code_entries = integers[position:position + len(codes)]
+    position += len(codes)
+    n_entries = int(code_entries.sum())
+    entry_samples = _cumsum_by_group(integers[position:position + n_entries], code_entries)
+    position += n_entries
+    entry_counts = integers[position:position + n_entries]
+    position += n_entries
+
+    zigzag = integers[position:]
+    times = _cumsum_by_group((zigzag >> 1) ^ -(zigzag & 1), entry_counts).tolist()
+
+    samples_features = [{} for _ in range(n_samples)]
+    entry_ends = np.cumsum(entry_counts).tolist()
+    entry_codes = np.repeat(np.arange(len(codes)), code_entries).tolist()
+    start = 0
+    for code_id, sample_idx, end in zip(entry_codes, entry_samples.tolist(), entry_ends):
+        samples_features[sample_idx][codes[code_id]] = times[start:end]
+        start = end
+
+    return samples_features
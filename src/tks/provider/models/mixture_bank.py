@@ -0,0 +1,364 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke MixtureBank module'''
+import base64
+import struct
+from io import BytesIO
+import numpy as np
+
+#: Binary format identifier
+MODEL_MAGIC = b'TKSM'
+
+#: Current version of the binary format
+MODEL_VERSION = 1
+
+#: Binary format header: magic, version, number of components, flags and number of codes
+MODEL_HEADER = struct.Struct('<4sBBHI')
+
+#: Flag for parameters stored as aligned float64 arrays
+FLAG_NATIVE = 1
+
+#: Regularization added to the variances, the same used by sklearn.mixture.GaussianMixture
+REG_COVAR = 1e-6
+
+
+class MixtureBank:
+    """
+        Parameters of the one dimensional gaussian mixtures of all the codes of a model
+    """
+    def __init__(self, n_components=3):
+        #: Number of components of each mixture
+        self.n_components = n_components
+
+        #: Code table
+        self.codes = []
+
+        #: Row of each code
+        self._index = {}
+
+        #: Number of observations used to fit each mixture
+        self.counts = np.zeros(0, dtype=np.uint32)
+
+        #: Weights, means and variances of the components of each mixture
+        self.weights = np.zeros((0, n_components))
+        self.means = np.zeros((0, n_components))
+        self.variances = np.zeros((0, n_components))
+
+        #: Log normalization terms and precisions used for scoring, computed on demand
+        self._log_norm = None
+        self._precisions = None
+
+    def __contains__(self, code):
+        return code in self._index
+
+    def __len__(self):
+        return len(self.codes)
+
+    def get_rows(self, codes):
+        """
+            Get the rows of a list of codes
+            :param codes: List of codes in the bank
+            :type codes: list
+            :return: Row of each code
+            :rtype: np.ndarray
+        """
+        return np.array([self._index[code] for code in codes], dtype=np.intp)
+
+    def get_count(self, code):
+        """
+            Get the number of observations used to fit the mixture of a code
+            :param code: Feature code
+            :type code: str
+            :return: Number of observations
+            :rtype: int
+        """
+        return int(self.counts[self._index[code]])
+
+    def set_count(self, code, count):
+        """
+            Set the number of observations used to fit the mixture of a code
+            :param code: Feature code
+            :type code: str
+            :param count: Number of observations
+            :type count: int
+        """
+        self.counts[self._index[code]] = count
+
+    def set_mixtures(self, codes, weights, means, variances, counts):
+        """
+            Add or replace the mixtures of a list of codes
+            :param codes: List of codes
+            :type codes: list
+            :param weights: Weights of the components, one row per code
+            :param means: Means of the components, one row per code
+            :param variances: Variances of the components, one row per code
+            :param counts: Number of observations used to fit each mixture
+        """
+        weights = np.asarray(weights, dtype=float).reshape(-1, self.n_components)
+        means = np.asarray(means, dtype=float).reshape(-1, self.n_components)
+        variances = np.asarray(variances, dtype=float).reshape(-1, self.n_components)
+        counts = np.asarray(counts, dtype=np.uint32).reshape(-1)
+
+        rows = []
+        new_codes = []
+        for code in codes:
+            if code in self._index:
+                rows.append(self._index[code])
+            else:
+                rows.append(len(self.codes) + len(new_codes))
+                new_codes.append(code)
+
+        if len(new_codes) > 0:
+            self._grow(len(new_codes))
+            for code in new_codes:
+                self._index[code] = len(self.codes)
+                self.codes.append(code)
+
+        self.weights[rows] = weights
+        self.means[rows] = means
+        self.variances[rows] = variances
+        self.counts[rows] = counts
+        self._log_norm = None
+
+    def _grow(self, num_rows):
+        """
+            Add empty rows at the end of the parameter arrays
+            :param num_rows: Number of rows to add
+            :type num_rows: int
+        """
+        self.counts = np.concatenate([self.counts, np.zeros(num_rows, dtype=np.uint32)])
+        self.weights = np.vstack([self.weights, np.zeros((num_rows, self.n_components))])
+        self.means = np.vstack([self.means, np.zeros((num_rows, self.n_components))])
+        self.variances = np.vstack([self.variances, np.ones((num_rows, self.n_components))])
+
+    def _log_prob(self, rows, x):
+        """
+            Weighted log probabilities of each observation under each component of its mixture
+            :param rows: Row of the mixture for each observation
+            :param x: Observations
+            :return: Array with one row per observation and one column per component
+        """
+        if self._log_norm is None:
+            with np.errstate(divide='ignore'):
+                self._log_norm = np.log(self.weights) - .5 * (np.log(2 * np.pi) + np.log(self.variances))
+            self._precisions = 1. / self.variances
+
+        diff = x.reshape(-1, 1) - self.means[rows]
+        return self._log_norm[rows] - .5 * diff ** 2 * self._precisions[rows]
+
+    def get_responsibilities(self, rows, x):
+        """
+            Compute the responsibilities of the components of the mixture of its row for each observation
+            :param rows: Row of the mixture for each observation
+            :type rows: np.ndarray
+            :param x: Observations
+            :type x: np.ndarray
+            :return: Array with one row per observation and one column per component
+            :rtype: np.ndarray
+        """
+        x = np.asarray(x, dtype=float).reshape(-1)
+        log_prob = self._log_prob(rows, x)
+        resp = np.exp(log_prob - log_prob.max(axis=1, keepdims=True))
+        resp /= resp.sum(axis=1, keepdims=True)
+        return resp
+
+    def score_rows(self, rows, x):
+        """
+            Compute the log-likelihood of each observation under the mixture of its row, for all the
+            observations at once
+            :param rows: Row of the mixture for each observation
+            :type rows: np.ndarray
+            :param x: Observations
+            :type x: np.ndarray
+            :return: Log-likelihood of each observation
+            :rtype: np.ndarray
+        """
+        x = np.asarray(x, dtype=float).reshape(-1)
+        log_prob = self._log_prob(rows, x)
+        max_log_prob = log_prob.max(axis=1, keepdims=True)
+        return (max_log_prob + np.log(np.exp(log_prob - max_log_prob).sum(axis=1, keepdims=True)))[:, 0]
+
+    def score_samples(self, code, x):
+        """
+            Compute the log-likelihood of the observations under the mixture of a code
+            :param code: Feature code
+            :type code: str
+            :param x: Observations
+            :type x: np.ndarray
+            :return: Log-likelihood of each observation
+            :rtype: np.ndarray
+        """
+        x = np.asarray(x, dtype=float).reshape(-1)
+        return self.score_rows(np.full(x.shape[0], self._index[code]), x)
+
+    def update_mixture(self, code, x):
+        """
+            Incremental EM step. The sufficient statistics of the mixture are recovered from its parameters and
+            the number of observations used to fit it, and the responsibilities of the new observations are
+            added to them.
+            :param code: Feature code
+            :type code: str
+            :param x: New observations
+            :type x: np.ndarray
+        """
+        x = np.asarray(x, dtype=float).reshape(-1)
+        row = self._index[code]
+        resp = self.get_responsibilities(np.full(x.shape[0], row), x)
+
+        n_k = self.weights[row] * float(self.counts[row])
+        means = self.means[row]
+        variances = self.variances[row] - REG_COVAR
+
+        s_0 = n_k + resp.sum(axis=0)
+        s_1 = n_k * means + resp.T.dot(x)
+        s_2 = n_k * (variances + means ** 2) + resp.T.dot(x ** 2)
+
+        # Components without any responsibility keep their parameters
+        empty = s_0 < 10 * np.finfo(float).eps
+        s_0_safe = np.where(empty, 1., s_0)
+        new_means = s_1 / s_0_safe
+        new_variances = np.maximum(s_2 / s_0_safe - new_means ** 2, 0)
+
+        self.weights[row] = s_0 / s_0.sum()
+        self.means[row] = np.where(empty, means, new_means)
+        self.variances[row] = np.where(empty, variances, new_variances) + REG_COVAR
+        self.counts[row] += x.shape[0]
+        self._log_norm = None
+
+    def to_bytes(self, native=False):
+        """
+            Get the binary representation of the bank
+            :param native: If True, parameters are stored as float64 arrays aligned to their size, so they can be
+                           used directly from the buffer
+            :type native: bool
+            :return: Binary representation
+            :rtype: bytes
+        """
+        encoded_codes = [code.encode('utf-8') for code in self.codes]
+        code_lengths = np.array([len(code) for code in encoded_codes], dtype='<u2')
+        flags = FLAG_NATIVE if native else 0
+        param_dtype = '<f8' if native else '<f4'
+
+        with BytesIO() as tmp_bytes:
+            tmp_bytes.write(MODEL_HEADER.pack(MODEL_MAGIC, MODEL_VERSION, self.n_components, flags, len(self.codes)))
+            tmp_bytes.write(code_lengths.tobytes())
+            tmp_bytes.write(b''.join(encoded_codes))
+            for values, dtype in ((self.counts, '<u4'), (self.weights, param_dtype), (self.means, param_dtype),
+                                  (self.variances, param_dtype)):
+                values = np.ascontiguousarray(values, dtype=dtype)
+                if native:
+                    tmp_bytes.write(b'\0' * (-tmp_bytes.tell() % values.itemsize))
+                tmp_bytes.write(values.tobytes())
+            return tmp_bytes.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+            Create a bank from its binary representation. Banks in the native layout use the arrays in the buffer
+            without copying them, and are read only if the buffer is read only.
+            :param data: Binary representation
+            :type data: bytes | mmap.mmap
+            :return: Mixture bank
+            :rtype: MixtureBank
+        """
+        magic, version, n_components, flags, n_codes = MODEL_HEADER.unpack_from(data, 0)
+        if magic != MODEL_MAGIC:
+            raise ValueError('Invalid model format')
+        if version > MODEL_VERSION or flags & ~FLAG_NATIVE:
+            raise ValueError(f'Unsupported model format version {version} with flags {flags}')
+        native = flags & FLAG_NATIVE
+
+        offset = MODEL_HEADER.size
+        code_lengths = np.frombuffer(data, dtype='<u2', count=n_codes, offset=offset)
+        offset += code_lengths.nbytes
+        codes = []
+        for length in code_lengths.tolist():
+            codes.append(bytes(data[offset:offset + length]).decode('utf-8'))
+            offset += length
+
+        arrays = []
+        for dtype, count in (('<u4', n_codes), ('<f8' if native else '<f4', n_codes * n_components),
+                             ('<f8' if native else '<f4', n_codes * n_components),
+                             ('<f8' if native else '<f4', n_codes * n_components)):
+            if native:
+                offset += -offset % np.dtype(dtype).itemsize
+            values = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += values.nbytes
+            arrays.append(values)
+
+        bank = cls(n_components=n_components)
+        bank.codes = codes
+        bank._index = {code: row for row, code in enumerate(codes)}
+        if native:
+            bank.counts = arrays[0]
+            bank.weights, bank.means, bank.variances = [values.reshape(n_codes, n_components)
+                                                        for values in arrays[1:]]
+        else:
+            bank.counts = arrays[0].astype(np.uint32)
+            bank.weights, bank.means, bank.variances = [values.astype(float).reshape(n_codes, n_components)
+                                                        for values in arrays[1:]]
+        return bank
+
+    @classmethod
+    def from_mixtures(cls, mixtures, n_components=3):
+        """
+            Create a bank from a dictionary of fitted sklearn mixtures
+            :param mixtures: Dictionary with a sklearn.mixture.GaussianMixture for each code
+            :type mixtures: dict
+            :param n_components: Number of components of each mixture
+            :type n_components: int
+            :return: Mixture bank
+            :rtype: MixtureBank
+        """
+        bank = cls(n_components=n_components)
+        codes = list(mixtures.keys())
+        bank.set_mixtures(codes,
+                          [mixtures[code].weights_ for code in codes],
+                          [mixtures[code].means_[:, 0] for code in codes],
+                          [mixtures[code].covariances_[:, 0, 0] for code in codes],
+                          [getattr(mixtures[code], 'n_samples_seen_', 0) for code in codes])
+        return bank
+
+
+def encode_mixture_bank(bank):
+    """
+        Encode a mixture bank to be stored in the model
+        :param bank: Mixture bank
+        :type bank: MixtureBank
+        :return: Base64 representation of the binary format
+        :rtype: str
+    """
+    return base64.b64encode(bank.to_bytes()).decode('utf-8')
+
+
+def decode_mixture_bank(data, n_components=3):
+    """
+        Decode a mixture bank stored in the model. Models stored as joblib dumps of sklearn mixtures
+        are converted to the binary format.
+        :param data: Base64 representation of the model data
+        :type data: str
+        :param n_components: Number of components of each mixture, used for models in the joblib format
+        :type n_components: int
+        :return: Mixture bank
+        :rtype: MixtureBank
+    """
+    data_model = base64.b64decode(data.encode('utf-8'))
+    if data_model[:len(MODEL_MAGIC)] == MODEL_MAGIC:
+        return MixtureBank.from_bytes(data_model)
+
+    # Models created before the binary format are joblib dumps of a dictionary of sklearn mixtures
+    from joblib import load
+    with BytesIO(data_model) as tmp_bytes:
+        return MixtureBank.from_mixtures(load(tmp_bytes), n_components=n_components)
@@ -0,0 +1,146 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke batched mixture EM module'''
+import numpy as np
+from .mixture_bank import REG_COVAR
+
+#: Convergence threshold of the lower bound, the same used by sklearn.mixture.GaussianMixture
+TOL = 1e-3
+
+#: Maximum number of EM iterations, the same used by sklearn.mixture.GaussianMixture
+MAX_ITER = 100
+
+#: Maximum number of k-means iterations of the initialization
+KMEANS_MAX_ITER = 300
+
+
+def _get_segments(observations):
+    """
+    Concatenate the observations of all the codes, sorted within each code
+    :param observations: List with the observations of each code
+    :return: Concatenated observations, code of each observation, number of observations and offset of each code
+    """
+    counts = np.array([len(x) for x in observations], dtype=np.intp)
+    offsets = np.zeros(len(observations) + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    segment_ids = np.repeat(np.arange(len(observations)), counts)
+    x = np.concatenate([np.asarray(x, dtype=float).reshape(-1) for x in observations])
+    x = x[np.lexsort((x, segment_ids))]
+
+    return x, segment_ids, counts, offsets
+
+
+def _init_kmeans(x, segment_ids, counts, offsets, n_components):
+    """
+    Initial responsibilities of the observations from a one dimensional k-means of each code. The centres
+    start spread over the range of each code, at its minimum, maximum and evenly spaced quantiles between them.
+    :return: Responsibilities with one row per observation and one column per component
+    """
+    quantiles = np.linspace(0, 1, n_components)
+    centres = x[offsets[:-1, None] + ((counts[:, None] - 1) * quantiles).astype(np.intp)]
+
+    labels = None
+    for _ in range(KMEANS_MAX_ITER):
+        new_labels = np.abs(x[:, None] - centres[segment_ids]).argmin(axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+
+        one_hot = np.zeros((x.shape[0], n_components))
+        one_hot[np.arange(x.shape[0]), labels] = 1
+        cluster_counts = np.add.reduceat(one_hot, offsets[:-1], axis=0)
+        cluster_sums = np.add.reduceat(one_hot * x[:, None], offsets[:-1], axis=0)
+
+        # empty clusters keep their centre
+        non_empty = cluster_counts > 0
+        centres[non_empty] = cluster_sums[non_empty] / cluster_counts[non_empty]
+
+    resp = np.zeros((x.shape[0], n_components))
+    resp[np.arange(x.shape[0]), labels] = 1
+    return resp
+
+
+def _m_step(x, resp, counts, offsets, reg_covar):
+    """
+    Parameters of the mixtures of all the codes from the responsibilities of their observations
+    :return: Weights, means and variances, with one row per code
+    """
+    nk = np.add.reduceat(resp, offsets[:-1], axis=0) + 10 * np.finfo(resp.dtype).eps
+    means = np.add.reduceat(resp * x[:, None], offsets[:-1], axis=0) / nk
+    segment_ids = np.repeat(np.arange(counts.shape[0]), counts)
+    diff = x[:, None] - means[segment_ids]
+    variances = np.add.reduceat(resp * diff ** 2, offsets[:-1], axis=0) / nk + reg_covar
+    weights = nk / counts[:, None]
+
+    return weights, means, variances
+
+
+def _e_step(x, segment_ids, counts, offsets, weights, means, variances):
+    """
+    Log responsibilities of the observations and the mean log-likelihood of each code
+    :return: Log responsibilities and lower bound of each code
+    """
+    log_prob = np.log(weights) - .5 * (np.log(2 * np.pi) + np.log(variances))
+    log_prob = log_prob[segment_ids] - .5 * (x[:, None] - means[segment_ids]) ** 2 / variances[segment_ids]
+    max_log_prob = log_prob.max(axis=1, keepdims=True)
+    log_prob_norm = max_log_prob[:, 0] + np.log(np.exp(log_prob - max_log_prob).sum(axis=1))
+
+    return log_prob - log_prob_norm[:, None], np.add.reduceat(log_prob_norm, offsets[:-1]) / counts
+
+
+def fit_mixtures(observations, n_components, tol=TOL, reg_covar=REG_COVAR, max_iter=MAX_ITER):
+    """
+    Fit a one dimensional gaussian mixture to the observations of each code, running EM for all of them at once.
+    Follows sklearn.mixture.GaussianMixture: k-means initialization, convergence when the change of the mean
+    log-likelihood of a code is below tol, and reg_covar added to the variances.
+    :param observations: List with the observations of each code, each with at least n_components observations
+    :type observations: list
+    :param n_components: Number of components of each mixture
+    :type n_components: int
+    :param tol: Convergence threshold
+    :type tol: float
+    :param reg_covar: Regularization added to the variances
+    :type reg_covar: float
+    :param max_iter: Maximum number of EM iterations
+    :type max_iter: int
+    :return: Weights, means and variances, with one row per code
+    :rtype: tuple
+    """
+    if len(observations) == 0:
+        empty = np.zeros((0, n_components))
+        return empty, empty.copy(), empty.copy()
+
+    x, segment_ids, counts, offsets = _get_segments(observations)
+    weights, means, variances = _m_step(x, _init_kmeans(x, segment_ids, counts, offsets, n_components),
+                                        counts, offsets, reg_covar)
+
+    lower_bound = np.full(counts.shape[0], -np.inf)
+    converged = np.zeros(counts.shape[0], dtype=bool)
+    for _ in range(max_iter):
+        log_resp, new_lower_bound = _e_step(x, segment_ids, counts, offsets, weights, means, variances)
+        new_weights, new_means, new_variances = _m_step(x, np.exp(log_resp), counts, offsets, reg_covar)
+
+        # converged codes keep their parameters
+        active = ~converged
+        weights[active] = new_weights[active]
+        means[active] = new_means[active]
+        variances[active] = new_variances[active]
+
+        converged |= np.abs(new_lower_bound - lower_bound) < tol
+        lower_bound = new_lower_bound
+        if converged.all():
+            break
+
+    return weights, means, variances
@@ -0,0 +1,85 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke model registry module """
+import importlib
+from importlib import metadata
+
+#: Entry point group for models provided by other packages
+ENTRY_POINT_GROUP = 'tks.models'
+
+#: Models of the provider, as "module:class" paths. Modules are imported on first use.
+MODELS = {
+    'GaussianModel': 'tks.provider.models.guassian_model:GaussianModel',
+    'GaussianMixturesModel': 'tks.provider.models.guassian_mixtures_model:GaussianMixturesModel',
+    'UBMAdaptedModel': 'tks.provider.models.ubm_model:UBMAdaptedModel',
+}
+
+#: Registered models, as "module:class" paths or loaded classes
+_registry = dict(MODELS)
+
+#: Whether the entry points are already added to the registry
+_entry_points_loaded = False
+
+
+def register_model(name, model_class):
+    """
+        Register a model
+        :param name: Model name, as used in the model provider option
+        :type name: str
+        :param model_class: Model class, or its "module:class" path to import it on first use
+        :type model_class: type | str
+    """
+    _registry[name] = model_class
+
+
+def _load_entry_points():
+    """
+        Add the models of the entry points to the registry. Models registered by name are not replaced.
+    """
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        entry_points = entry_points.select(group=ENTRY_POINT_GROUP)
+    else:
+        entry_points = entry_points.get(ENTRY_POINT_GROUP, [])
+
+    for entry_point in entry_points:
+        _registry.setdefault(entry_point.name, entry_point.value)
+
+
+def get_model_class(name):
+    """
+        Get the class of a model, importing it if it is not loaded yet
+        :param name: Model name
+        :type name: str
+        :return: Model class
+        :rtype: type
+    """
+    if name not in _registry:
+        _load_entry_points()
+    if name not in _registry:
+        raise ValueError('Model is not available')
+
+    model_class = _registry[name]
+    if isinstance(model_class, str):
+        module_name, class_name = model_class.split(':')
+        model_class = getattr(importlib.import_module(module_name), class_name)
+        _registry[name] = model_class
+
+    return model_class
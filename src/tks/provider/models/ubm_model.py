@@ -0,0 +1,225 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+''' TeSLA CE Keystroke UBMAdaptedModel module'''
+import struct
+import numpy as np
+from ..metrics import NULL_TIMER
+from .background import RELEVANCE_FACTOR, get_background_digest, get_background_rows, load_background_bank, \
+    map_adapt
+from .guassian_mixtures_model import GaussianMixturesModel, _get_train_array
+from .mixture_bank import MixtureBank
+
+#: Minimum log-likelihood ratio between the mixture of a code and its background mixture to accept a feature
+LLR_THRESHOLD = .03
+
+#: Header of the shared binary representation: digest of the background bank of the model, zero if not adapted
+SHARED_HEADER = struct.Struct('<16s')
+
+
+class UBMAdaptedModel(GaussianMixturesModel):
+    """
+        Gaussian mixtures model whose mixtures are adapted from a universal background model. The mixture of each
+        code is the background mixture of the code, or of its feature type, adapted to the observations of the
+        learner. Codes without a background mixture are fitted as in
+        GaussianMixturesModel. Features are accepted when they are more likely under the mixture of their code
+        than under its background mixture. Models adapted from a background bank are only used with the same
+        bank.
+    """
+    def __init__(self, model_object=None):
+        super().__init__(model_object=model_object)
+
+        #: Background mixtures of the codes and feature types
+        self._background = None
+
+        #: Digest of the background mixtures
+        self._background_digest = None
+
+        #: Digest of the background mixtures the model is adapted from, None if no mixture is adapted
+        self._ubm_digest = None
+        if model_object is not None:
+            self._ubm_digest = model_object.get('ubm')
+
+        #: Relevance factor of the adaptation
+        self._relevance_factor = RELEVANCE_FACTOR
+
+        #: Minimum log-likelihood ratio to accept a feature
+        self._llr_threshold = LLR_THRESHOLD
+
+        #: Row of the background mixture of each mixture of the model, computed on demand
+        self._background_rows = None
+
+    def set_options(self, options):
+        """
+            Set the model options from the provider options
+            :param options: Provider options
+            :type options: dict
+        """
+        super().set_options(options)
+        self.set_background(options['ubm_path'])
+        self.set_relevance_factor(options['ubm_relevance_factor'])
+        self.set_llr_threshold(options['ubm_llr_threshold'])
+
+    def set_background(self, path):
+        """
+            Set the file of the background mixtures, loaded once per process
+            :param path: File path, or None to fit all the mixtures from the learner observations
+            :type path: str
+        """
+        self._background = None
+        self._background_digest = None
+        self._background_rows = None
+        if path is not None:
+            self._background = load_background_bank(path)
+            self._background_digest = get_background_digest(path)
+
+    def _check_background(self):
+        """
+            Check the background mixtures are the ones the model is adapted from
+            :raises ValueError: If the model is adapted from other background mixtures or they are not set
+        """
+        if self._ubm_digest is None or self._ubm_digest == self._background_digest:
+            return
+        if self._background is None:
+            raise ValueError('The model is adapted from background mixtures, but no ubm_path is set')
+        raise ValueError('The model is adapted from other background mixtures than the ones in ubm_path')
+
+    def to_json(self):
+        """
+            Get a JSON representation of the object
+            :return: JSON representation
+            :rtype: dict
+        """
+        model = super().to_json()
+        if self._ubm_digest is not None:
+            model['ubm'] = self._ubm_digest
+        return model
+
+    def get_shared_data(self):
+        """
+            Get the binary representation used to share the model between processes
+            :return: Digest of the background mixtures of the model and binary representation of the mixtures
+            :rtype: bytes
+        """
+        data = super().get_shared_data()
+        if data is None:
+            return None
+        digest = bytes.fromhex(self._ubm_digest) if self._ubm_digest is not None else b''
+        return SHARED_HEADER.pack(digest) + data
+
+    @classmethod
+    def from_shared_data(cls, buffer):
+        """
+            Create a model for verification from its shared binary representation, without copying it
+            :param buffer: Digest of the background mixtures of the model and binary representation of the mixtures
+            :type buffer: mmap.mmap
+            :return: Model
+            :rtype: UBMAdaptedModel
+        """
+        tks_model = cls()
+        digest, = SHARED_HEADER.unpack_from(buffer)
+        if digest != bytes(SHARED_HEADER.size):
+            tks_model._ubm_digest = digest.hex()
+        tks_model._data = MixtureBank.from_bytes(memoryview(buffer)[SHARED_HEADER.size:])
+        return tks_model
+
+    def set_relevance_factor(self, relevance_factor):
+        """
+            Set the relevance factor of the adaptation
+            :param relevance_factor: Number of observations of a component that weight as much as its background
+                                     parameters
+            :type relevance_factor: float
+        """
+        self._relevance_factor = relevance_factor
+
+    def set_llr_threshold(self, llr_threshold):
+        """
+            Set the minimum log-likelihood ratio between the mixture of a code and its background mixture to
+            accept a feature
+            :param llr_threshold: Minimum log-likelihood ratio
+            :type llr_threshold: float
+        """
+        self._llr_threshold = llr_threshold
+
+    def _fit_online(self, new_codes):
+        """
+        The adaptation of all the stored observations of a code is a single pass, so the online mode adapts the
+        mixtures as the full fit does
+        :param new_codes: New observations not added to the model samples
+        """
+        self._fit_full(new_codes)
+
+    def _fit_codes(self, codes):
+        """
+        Adapt the background mixtures of a set of codes to their observations. Codes without a background
+        mixture are fitted from their observations.
+        :param codes: Dictionary with the list of observations of each code
+        :type codes: dict
+        """
+        codes = {code: x_train for code, x_train in codes.items() if len(x_train) > 0}
+        if self._background is None or len(codes) == 0:
+            super()._fit_codes(codes)
+            return
+
+        code_names = list(codes.keys())
+        rows = get_background_rows(self._background, code_names)
+        adapted = rows >= 0
+        adapted_codes = [code for code, is_adapted in zip(code_names, adapted.tolist()) if is_adapted]
+        if len(adapted_codes) > 0:
+            self._check_background()
+            self._ubm_digest = self._background_digest
+            weights, means, variances, counts = map_adapt(self._background, rows[adapted],
+                                                          [_get_train_array(codes[code]) for code in adapted_codes],
+                                                          self._relevance_factor)
+            self._data.set_mixtures(adapted_codes, weights, means, variances, counts)
+            self._deferred_codes.difference_update(adapted_codes)
+
+        super()._fit_codes({code: codes[code] for code, is_adapted in zip(code_names, adapted.tolist())
+                            if not is_adapted})
+
+    def verify_batch(self, features_list, config, timer=NULL_TIMER):
+        """
+        Verify if the features of several requests are from this model, scoring all of them at once
+        :param features_list: Features of each request
+        :param config:
+        :param timer: Timer of the verification phases
+        :return: Verification of each request, as returned by verify
+        :raises ValueError: If the model is adapted from other background mixtures than the ones set
+        """
+        self._check_background()
+        return super().verify_batch(features_list, config, timer)
+
+    def _accept_rows(self, rows, y_test):
+        """
+        Decide which features are accepted, comparing the likelihood of the mixture of their code with the
+        likelihood of its background mixture. Features of codes without a background mixture are decided as in
+        GaussianMixturesModel.
+        :param rows: Mixture row of each feature
+        :param y_test: Observation of each feature
+        :return: Whether each feature is accepted
+        """
+        if self._background is None or self._ubm_digest is None:
+            return super()._accept_rows(rows, y_test)
+
+        # codes are only added to the mixtures, so the rows of the known codes are kept
+        if self._background_rows is None or self._background_rows.shape[0] != len(self._data):
+            self._background_rows = get_background_rows(self._background, self._data.codes)
+
+        log_likelihood = self._data.score_rows(rows, y_test)
+        accepted = log_likelihood > np.log(0.7)
+        background_rows = self._background_rows[rows]
+        adapted = background_rows >= 0
+        accepted[adapted] = log_likelihood[adapted] - self._background.score_rows(
+            background_rows[adapted], np.asarray(y_test).reshape(-1)[adapted]) > self._llr_threshold
+        return accepted
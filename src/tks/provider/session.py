@@ -0,0 +1,254 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke session verification state module """
+from collections import OrderedDict
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+
+#: Last features of a session kept to find the overlap with the next request
+SESSION_TAIL_FEATURES = 16
+
+
+def get_session_tail(features):
+    """
+        Get the last features of a request, to find them in the next request of the session
+        :param features: Keystroke features
+        :type features: tks.provider.features.KeystrokeFeatures
+        :return: List of [type, code, time] of the last features
+        :rtype: list
+    """
+    start = max(len(features) - SESSION_TAIL_FEATURES, 0)
+    return [[feature_type, features.code_table[code_id][1], feature_time]
+            for feature_type, code_id, feature_time in zip(features.types[start:].tolist(),
+                                                            features.code_ids[start:].tolist(),
+                                                            features.times[start:].tolist())]
+
+
+def get_new_features_start(features, tail):
+    """
+        Find the first feature of a request not processed yet in its session. The request is expected to start
+        with features of the previous requests, and its new features are the ones after the last occurrence of
+        the tail of the previous request. Requests without the tail are new.
+        :param features: Keystroke features of the request
+        :type features: tks.provider.features.KeystrokeFeatures
+        :param tail: List of [type, code, time] of the last features of the previous request
+        :type tail: list
+        :return: Position of the first new feature
+        :rtype: int
+    """
+    n_tail = len(tail)
+    if n_tail == 0 or len(features) < n_tail:
+        return 0
+
+    codes = [code for _, code in features.code_table]
+    types = features.types.tolist()
+    code_ids = features.code_ids.tolist()
+    times = features.times.tolist()
+    last_type, last_code, last_time = tail[-1]
+    for end in range(len(features), n_tail - 1, -1):
+        idx = end - 1
+        if times[idx] != last_time or types[idx] != last_type or codes[code_ids[idx]] != last_code:
+            continue
+        if all(types[end - n_tail + pos] == tail_type and codes[code_ids[end - n_tail + pos]] == tail_code and
+               times[end - n_tail + pos] == tail_time for pos, (tail_type, tail_code, tail_time) in enumerate(tail)):
+            return end
+
+    return 0
+
+
+class SessionStore:
+    """
+        Store of the verification state of each session. Subclasses keep the states in a shared backend.
+    """
+    def get(self, key):
+        """
+            Get the state of a session
+            :param key: Session key
+            :type key: str
+            :return: Session state or None if the session is unknown or expired
+            :rtype: dict
+        """
+        raise NotImplementedError('Method not implemented on session store')
+
+    def put(self, key, state):
+        """
+            Save the state of a session
+            :param key: Session key
+            :type key: str
+            :param state: Session state
+            :type state: dict
+        """
+        raise NotImplementedError('Method not implemented on session store')
+
+    def delete(self, key):
+        """
+            Remove the state of a session
+            :param key: Session key
+            :type key: str
+        """
+        raise NotImplementedError('Method not implemented on session store')
+
+    def update(self, key, update_state):
+        """
+            Update the state of a session from its current state. Stores shared by several processes update it
+            atomically, so concurrent requests of a session do not lose each other's update, and update_state may
+            be called again with the state saved by another request.
+            :param key: Session key
+            :type key: str
+            :param update_state: Function given the current state, or None for unknown sessions, and returning the
+                                 new state, or None to keep the current state
+            :type update_state: callable
+            :return: Session state after the update
+            :rtype: dict
+        """
+        raise NotImplementedError('Method not implemented on session store')
+
+
+class InMemorySessionStore(SessionStore):
+    """
+        Session store in the memory of the process, limited by number of sessions and age. Sessions are not shared
+        between processes: with several worker processes, such as a Celery prefork worker, each process only
+        knows the requests of a session it verified, so the results depend on which process receives each
+        request. SQLiteSessionStore shares the sessions between the processes of a node.
+    """
+    def __init__(self, ttl, max_sessions=10000):
+        """
+            Create an in memory session store
+            :param ttl: Seconds a session is kept after its last request
+            :type ttl: float
+            :param max_sessions: Maximum number of sessions, the least recently used are removed first
+            :type max_sessions: int
+        """
+        #: Seconds a session is kept after its last request
+        self.ttl = ttl
+
+        #: Maximum number of sessions
+        self.max_sessions = max_sessions
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, key):
+        entry = self._sessions.get(key)
+        if entry is None:
+            return None
+        if entry[1] + self.ttl < time.time():
+            del self._sessions[key]
+            return None
+        return entry[0]
+
+    def put(self, key, state):
+        self._sessions.pop(key, None)
+        self._sessions[key] = (state, time.time())
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def delete(self, key):
+        self._sessions.pop(key, None)
+
+    def update(self, key, update_state):
+        with self._lock:
+            state = self.get(key)
+            new_state = update_state(copy.deepcopy(state))
+            if new_state is None:
+                return state
+            self.put(key, new_state)
+            return new_state
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+        Session store in a local SQLite database, shared by all the worker processes of a node. Each state has a
+        version, and updates are only saved over the version they were computed from.
+    """
+    def __init__(self, path, ttl):
+        """
+            Create a SQLite session store
+            :param path: Database file
+            :type path: str
+            :param ttl: Seconds a session is kept after its last request
+            :type ttl: float
+        """
+        #: Database file
+        self.path = path
+
+        #: Seconds a session is kept after its last request
+        self.ttl = ttl
+
+        self._connection = None
+        self._pid = None
+
+    def _get_connection(self):
+        """
+            Get the database connection of the current process, creating the sessions table if needed
+            :return: Database connection
+            :rtype: sqlite3.Connection
+        """
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS tks_sessions (key TEXT PRIMARY KEY, '
+                                     'state TEXT NOT NULL, updated REAL NOT NULL, version INTEGER NOT NULL)')
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        row = self._get_connection().execute('SELECT state FROM tks_sessions WHERE key = ? AND updated >= ?',
+                                             (key, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, state):
+        now = time.time()
+        connection = self._get_connection()
+        connection.execute('INSERT INTO tks_sessions (key, state, updated, version) VALUES (?, ?, ?, 0) '
+                           'ON CONFLICT (key) DO UPDATE SET state = excluded.state, updated = excluded.updated, '
+                           'version = version + 1', (key, json.dumps(state), now))
+        connection.execute('DELETE FROM tks_sessions WHERE updated < ?', (now - self.ttl, ))
+
+    def delete(self, key):
+        self._get_connection().execute('DELETE FROM tks_sessions WHERE key = ?', (key, ))
+
+    def update(self, key, update_state):
+        connection = self._get_connection()
+        while True:
+            row = connection.execute('SELECT state, updated, version FROM tks_sessions WHERE key = ?',
+                                     (key, )).fetchone()
+            state = None
+            if row is not None and row[1] >= time.time() - self.ttl:
+                state = json.loads(row[0])
+            new_state = update_state(state)
+            if new_state is None:
+                return state
+
+            # the state is only saved if no other request saved the session since it was read
+            now = time.time()
+            if row is None:
+                cursor = connection.execute('INSERT OR IGNORE INTO tks_sessions (key, state, updated, version) '
+                                            'VALUES (?, ?, ?, 0)', (key, json.dumps(new_state), now))
+            else:
+                cursor = connection.execute('UPDATE tks_sessions SET state = ?, updated = ?, version = version + 1 '
+                                            'WHERE key = ? AND updated = ? AND version = ?',
+                                            (json.dumps(new_state), now, key, row[1], row[2]))
+            if cursor.rowcount == 1:
+                connection.execute('DELETE FROM tks_sessions WHERE updated < ?', (now - self.ttl, ))
+                return new_state
@@ -0,0 +1,148 @@
+#  Copyright (c) 2021 Roger Muñoz
+#
+#      This program is free software: you can redistribute it and/or modify
+#      it under the terms of the GNU Affero General Public License as
+#      published by the Free Software Foundation, either version 3 of the
+#      License, or (at your option) any later version.
+#
+#      This program is distributed in the hope that it will be useful,
+#      but WITHOUT ANY WARRANTY; without even the implied warranty of
+#      MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#      GNU Affero General Public License for more details.
+#
+#      You should have received a copy of the GNU Affero General Public License
+#      along with this program.  If not, see <https://www.gnu.org/licenses/>.
+""" TeSLA CE Keystroke shared model store module """
+import mmap
+import os
+import tempfile
+
+
+class SharedModelStore:
+    """
+        Store of loaded models in memory mapped files of a local directory. All the worker processes of a node
+        map the same files read only, so each model is loaded once per node and shares its memory pages. Pinned
+        models are kept until they are deleted, out of the size limit and the eviction.
+    """
+    def __init__(self, path, max_bytes):
+        """
+            Create a shared model store
+            :param path: Local directory for the model files
+            :type path: str
+            :param max_bytes: Maximum size in bytes of the model files
+            :type max_bytes: int
+        """
+        #: Local directory for the model files
+        self.path = path
+
+        #: Maximum size in bytes of the model files
+        self.max_bytes = max_bytes
+
+        os.makedirs(path, exist_ok=True)
+
+    def _get_filename(self, key, pinned=False):
+        """
+            Get the model file of a key
+            :param key: Model class name and model fingerprint
+            :type key: tuple
+            :param pinned: Whether the model is pinned
+            :type pinned: bool
+            :return: Path of the model file
+            :rtype: str
+        """
+        return os.path.join(self.path, '{}-{}.{}'.format(*key, 'pin' if pinned else 'bin'))
+
+    def get(self, key, pinned=False):
+        """
+            Map a stored model
+            :param key: Model class name and model fingerprint
+            :type key: tuple
+            :param pinned: Whether the model is pinned
+            :type pinned: bool
+            :return: Read only memory map of the model data, or None if the model is not stored
+            :rtype: mmap.mmap
+        """
+        filename = self._get_filename(key, pinned)
+        try:
+            with open(filename, 'rb') as model_file:
+                buffer = mmap.mmap(model_file.fileno(), 0, access=mmap.ACCESS_READ)
+            # Modification time keeps the last use of the model for eviction
+            os.utime(filename)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        return buffer
+
+    def put(self, key, data, pinned=False):
+        """
+            Store a model and map it
+            :param key: Model class name and model fingerprint
+            :type key: tuple
+            :param data: Model data
+            :type data: bytes
+            :param pinned: Whether the model is kept until it is deleted
+            :type pinned: bool
+            :return: Read only memory map of the model data, or None if the model does not fit in the store
+            :rtype: mmap.mmap
+        """
+        if len(data) == 0 or (not pinned and len(data) > self.max_bytes):
+            return None
+
+        if not pinned:
+            self._evict(len(data))
+
+        # Write to a temporary file and rename it, so other processes never map a partial file
+        tmp_fd, tmp_filename = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(tmp_fd, 'wb') as model_file:
+                model_file.write(data)
+            os.replace(tmp_filename, self._get_filename(key, pinned))
+        except OSError:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            return None
+
+        return self.get(key, pinned)
+
+    def delete(self, key, pinned=False):
+        """
+            Remove a stored model. Processes that already mapped it keep their mapping.
+            :param key: Model class name and model fingerprint
+            :type key: tuple
+            :param pinned: Whether the model is pinned
+            :type pinned: bool
+        """
+        try:
+            os.remove(self._get_filename(key, pinned))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, size):
+        """
+            Remove the least recently used model files until there is space for a new one. Processes that
+            already mapped a removed file keep their mapping.
+            :param size: Size in bytes of the new model
+            :type size: int
+        """
+        entries = []
+        total_bytes = 0
+        with os.scandir(self.path) as dir_entries:
+            for entry in dir_entries:
+                if not entry.name.endswith('.bin'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_bytes += stat.st_size
+
+        entries.sort()
+        for _, file_size, filename in entries:
+            if total_bytes + size <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            total_bytes -= file_size
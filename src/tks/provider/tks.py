@@ -15,11 +15,21 @@
 
 
 """ TeSLA CE Face Recognition module """
-import simplejson
+import hashlib
+import json
+import numpy as np
 from tesla_ce_provider import BaseProvider, result
-from tesla_ce_provider.provider.audit import KeystrokeAudit
 from . import utils
-from .models import GaussianModel, GaussianMixturesModel
+from .audit import TKSAudit
+from .cache import ModelCache, get_model_digest, get_model_fingerprint
+from .decision import DecisionEngine
+from .metrics import NULL_TIMER, InMemoryMetricsSink, PhaseTimer
+from .session import InMemorySessionStore, SQLiteSessionStore, get_new_features_start, get_session_tail
+from .store import SharedModelStore
+from .models import get_model_class
+
+#: Key prefix of the notifications refitting the model of a learner
+REFIT_NOTIFICATION = 'tks_refit'
 
 
 class TKSProvider(BaseProvider):
@@ -44,16 +54,307 @@ class TKSProvider(BaseProvider):
             'result_invalid_delta_tri': 0.03,
             'result_invalid_delta_four': 0.02,
             'failed_missing_data': False,
-            'missing_data_threshold': 0.5
+            'missing_data_threshold': 0.5,
+            'online_enrolment': False,
+            'model_cache_bytes': 64 * 1024 * 1024,
+            'model_store_path': None,
+            'model_store_bytes': 512 * 1024 * 1024,
+            'fit_workers': 1,
+            'fit_parallel_min_codes': 64,
+            'fit_backend': 'sklearn',
+            'max_code_observations': None,
+            'fit_time_budget': None,
+            'metrics_enabled': False,
+            'metrics_audit': False,
+            'early_decision': False,
+            'session_verification': False,
+            'session_store_path': None,
+            'session_ttl': 86400,
+            'background_refit': False,
+            'background_refit_countdown': 60,
+            'ubm_path': None,
+            'ubm_relevance_factor': 16.,
+            'ubm_llr_threshold': .03
         }
 
+        #: Cache of the models loaded for verification
+        self._model_cache = ModelCache(self.config['model_cache_bytes'])
+
+        #: Store of the models shared by all the worker processes
+        self._model_store = None
+
+        #: Receiver of the timings and counts of the provider operations
+        self._metrics_sink = None
+
+        #: Store of the verification state of each session
+        self._session_store = None
+
+    def _get_model_type(self):
+        return get_model_class(self.config['model'])
+
     def _get_model_class(self, model):
-        if self.config['model'] == 'GaussianModel':
-            return GaussianModel(model)
-        elif self.config['model'] == 'GaussianMixturesModel':
-            return GaussianMixturesModel(model)
+        tks_model = self._get_model_type()(model)
+        if hasattr(tks_model, 'set_options'):
+            tks_model.set_options(self.config)
+        return tks_model
+
+    def _get_model_key(self, model):
+        """
+            Get the key of a model in the model cache and the shared model store. Models with deferred codes are
+            keyed by their whole content, since the data of models not fitted yet can be the same for several
+            learners, while their refitted data is not.
+            :param model: Provider model
+            :type model: dict
+            :return: Model class name and model fingerprint, and the size in bytes of the model data
+            :rtype: tuple
+        """
+        fingerprint, size = get_model_fingerprint(model)
+        if len(model.get('deferred_codes', [])) > 0:
+            fingerprint = get_model_digest(model)
+        return (self.config['model'], fingerprint), size
+
+    def _load_model(self, model):
+        """
+            Load a model for verification. Loaded models are kept in the model cache, so a model with the same
+            content is not decoded again, and in the shared model store when it is enabled. Models with deferred
+            codes are only kept once they are refitted.
+            :param model: Provider model
+            :type model: dict
+            :return: Loaded model
+        """
+        if model is None or 'data' not in model or \
+                (self._model_cache.max_bytes <= 0 and self._model_store is None):
+            return self._get_model_class(model)
 
-        raise ValueError('Model is not available')
+        key, size = self._get_model_key(model)
+        tks_model = self._model_cache.get(key)
+        if tks_model is not None:
+            return tks_model
+
+        if len(model.get('deferred_codes', [])) > 0:
+            buffer = None if self._model_store is None else self._model_store.get(key)
+            if buffer is None:
+                return self._get_model_class(model)
+            tks_model = self._from_shared_data(buffer)
+        else:
+            tks_model = self._load_shared_model(key, model)
+        self._model_cache.put(key, tks_model, size)
+
+        return tks_model
+
+    def _load_shared_model(self, key, model):
+        """
+            Load a model from the shared model store. Models not in the store are loaded and added to it.
+            :param key: Model class name and model fingerprint
+            :type key: tuple
+            :param model: Provider model
+            :type model: dict
+            :return: Loaded model
+        """
+        if self._model_store is None:
+            return self._get_model_class(model)
+
+        buffer = self._model_store.get(key)
+        if buffer is None:
+            tks_model = self._get_model_class(model)
+            data = tks_model.get_shared_data()
+            if data is None:
+                return tks_model
+            buffer = self._model_store.put(key, data)
+            if buffer is None:
+                return tks_model
+
+        return self._from_shared_data(buffer)
+
+    def _from_shared_data(self, buffer):
+        """
+            Load a model from its data in the shared model store
+            :param buffer: Model data
+            :return: Loaded model
+        """
+        tks_model = self._get_model_type().from_shared_data(buffer)
+        if hasattr(tks_model, 'set_options'):
+            tks_model.set_options(self.config)
+        return tks_model
+
+    def _get_refitted_model(self, model):
+        """
+            Get the model refitted in background for an enrolled model, from the shared model store
+            :param model: Provider model
+            :type model: dict
+            :return: Refitted model, or the given model if it has not been refitted
+            :rtype: dict
+        """
+        if self._model_store is None or model is None or len(model.get('deferred_codes', [])) == 0:
+            return model
+
+        buffer = self._model_store.get(('refit', get_model_digest(model)))
+        if buffer is None:
+            return model
+        with buffer:
+            return json.loads(buffer[:])
+
+    def _get_enrolled_key(self, learner_id):
+        """
+            Get the key of the last enrolled model of a learner in the shared model store
+            :param learner_id: Learner identification
+            :type learner_id: str
+            :return: Key of the enrolled model
+            :rtype: tuple
+        """
+        return 'enrolled', hashlib.blake2b('{}:{}'.format(self.config['model'], learner_id).encode('utf-8'),
+                                          digest_size=16).hexdigest()
+
+    def _get_enrolled_model(self, learner_id, digest):
+        """
+            Get the last enrolled model of a learner from the shared model store
+            :param learner_id: Learner identification
+            :type learner_id: str
+            :param digest: Fingerprint of the whole enrolled model
+            :type digest: str
+            :return: Enrolled model, or None if it is not stored or a newer enrolment replaced it
+            :rtype: dict
+        """
+        if self._model_store is None:
+            return None
+        buffer = self._model_store.get(self._get_enrolled_key(learner_id), pinned=True)
+        if buffer is None:
+            return None
+        with buffer:
+            model = json.loads(buffer[:])
+        if get_model_digest(model) != digest:
+            return None
+        return model
+
+    def _schedule_refit(self, samples, model_json):
+        """
+            Schedule the notification refitting the model of a learner in background. The enrolled model is
+            pinned in the shared model store until it is refitted, and the notification only refers to it. A
+            pending notification of the learner is replaced, so the learner model is refitted once after the last
+            enrolment.
+            :param samples: Enrolment samples
+            :type samples: list
+            :param model_json: Enrolled model with the deferred codes
+            :type model_json: dict
+        """
+        if len(samples) == 0:
+            return
+        learner_id = str(samples[0].learner_id)
+        if self._model_store.put(self._get_enrolled_key(learner_id), json.dumps(model_json).encode('utf-8'),
+                                 pinned=True) is None:
+            return
+        self.update_or_create_notification(result.NotificationTask(
+            '{}:{}:{}'.format(REFIT_NOTIFICATION, self.config['model'], learner_id),
+            countdown=self.config['background_refit_countdown'],
+            info={'learner_id': learner_id, 'model': get_model_digest(model_json),
+                  'sample_id': samples[-1].sample_id}))
+
+    def _refit_enrolled_model(self, info):
+        """
+            Refit the enrolled model of a refit notification, and send the refitted model as a delayed enrolment
+            result, so it replaces the enrolled model of the learner
+            :param info: Learner identification, fingerprint of the enrolled model and last enrolled sample
+            :type info: dict
+        """
+        model = self._get_enrolled_model(info['learner_id'], info['model'])
+        if model is None:
+            self.log_trace(f"TKS: Enrolled model of learner {info['learner_id']} not stored or replaced, "
+                           "refit skipped")
+            return
+
+        enrolment = self.refit_model(model)
+
+        # a newer enrolment of the learner schedules its own refit, and its model is not replaced by this one
+        if self._get_enrolled_model(info['learner_id'], info['model']) is None:
+            return
+        self._model_store.delete(self._get_enrolled_key(info['learner_id']), pinned=True)
+        self.update_delayed_result(result.EnrolmentDelayedResult(info['learner_id'], info['sample_id'], enrolment,
+                                                                 None, {'learner_id': info['learner_id']}))
+
+    def refit_model(self, model):
+        """
+            Refit all the codes of an enrolled model, compact its enrolment history and encode it again. The
+            refitted model is kept in the shared model store, where the next enrolment of the learner takes it
+            as its base, and it is used to verify the requests of the enrolled model.
+            :param model: Provider model
+            :type model: dict
+            :return: Enrolment result with the refitted model
+            :rtype: tesla_ce_provider.result.EnrolmentResult
+        """
+        timer = self._start_timer('refit')
+        tks_model = self._get_model_class(model)
+        timer.phase('model_load')
+        tks_model.compact()
+        timer.phase('compact')
+        tks_model.refit()
+        timer.phase('fit')
+        model_json = tks_model.to_json()
+        timer.phase('to_json')
+
+        if model.get('data') is not None:
+            # the refitted data is only used for this model, never for other models with the same data
+            digest = get_model_digest(model)
+            key = (self.config['model'], digest)
+            size = get_model_fingerprint(model)[1]
+            if self._model_store is not None:
+                self._model_store.put(('refit', digest), json.dumps(model_json).encode('utf-8'))
+                data = tks_model.get_shared_data()
+                if data is not None:
+                    self._model_store.put(key, data)
+            self._model_cache.put(key, tks_model, size)
+        timer.phase('store')
+        self._finish_timer(timer)
+
+        return result.EnrolmentResult(model_json, tks_model.get_percentage(), tks_model.can_analyse(),
+                                      used_samples=tks_model.get_used_samples())
+
+    def set_metrics_sink(self, sink):
+        """
+            Set the receiver of the timings and counts of the provider operations, enabling the metrics
+            :param sink: Metrics sink, or None to disable the metrics
+            :type sink: tks.provider.metrics.MetricsSink
+        """
+        self._metrics_sink = sink
+        self.config['metrics_enabled'] = sink is not None
+
+    def get_metrics_sink(self):
+        """
+            Get the receiver of the timings and counts of the provider operations
+            :return: Metrics sink, or None if the metrics are disabled
+            :rtype: tks.provider.metrics.MetricsSink
+        """
+        return self._metrics_sink
+
+    def set_session_store(self, store):
+        """
+            Set the store of the verification state of each session, enabling the session verification
+            :param store: Session store, or None to disable the session verification
+            :type store: tks.provider.session.SessionStore
+        """
+        self._session_store = store
+        self.config['session_verification'] = store is not None
+
+    def _start_timer(self, operation):
+        """
+            Start timing an operation. Operations are only timed when the metrics are enabled or attached to
+            the audit.
+            :param operation: Operation name
+            :type operation: str
+            :return: Phase timer
+            :rtype: tks.provider.metrics.PhaseTimer
+        """
+        if self._metrics_sink is None and not self.config['metrics_audit']:
+            return NULL_TIMER
+        return PhaseTimer(operation, self.config['model'])
+
+    def _finish_timer(self, timer):
+        """
+            Send the timings and counts of an operation to the metrics sink
+            :param timer: Phase timer
+            :type timer: tks.provider.metrics.PhaseTimer
+        """
+        if self._metrics_sink is not None:
+            timer.send(self._metrics_sink)
 
     def set_options(self, options):
         """
@@ -68,6 +369,33 @@ class TKSProvider(BaseProvider):
                 if permitted_option in options:
                     self.config[permitted_option] = options[permitted_option]
 
+            self._model_cache.set_max_bytes(self.config['model_cache_bytes'])
+
+            if not self.config['session_verification']:
+                self._session_store = None
+            elif self.config['session_store_path'] is None:
+                if not isinstance(self._session_store, InMemorySessionStore):
+                    self._session_store = InMemorySessionStore(self.config['session_ttl'])
+                self._session_store.ttl = self.config['session_ttl']
+            elif not isinstance(self._session_store, SQLiteSessionStore) or \
+                    self._session_store.path != self.config['session_store_path']:
+                self._session_store = SQLiteSessionStore(self.config['session_store_path'], self.config['session_ttl'])
+            else:
+                self._session_store.ttl = self.config['session_ttl']
+
+            if not self.config['metrics_enabled']:
+                self._metrics_sink = None
+            elif self._metrics_sink is None:
+                self._metrics_sink = InMemoryMetricsSink()
+
+            if self.config['model_store_path'] is None:
+                self._model_store = None
+            elif self._model_store is None or self._model_store.path != self.config['model_store_path']:
+                self._model_store = SharedModelStore(self.config['model_store_path'],
+                                                     self.config['model_store_bytes'])
+            else:
+                self._model_store.max_bytes = self.config['model_store_bytes']
+
     def enrol(self, samples, model=None):
         """
             Update the model with a new enrolment sample
@@ -80,26 +408,61 @@ class TKSProvider(BaseProvider):
         """
         # Load model
         self.log_trace('TKS: Start enrolment process.')
-        tks_model = self._get_model_class(model)
+        timer = self._start_timer('enrol')
+        tks_model = self._get_model_class(self._get_refitted_model(model))
         tks_model.set_required_samples(self.config['target_enrol_samples'])
         tks_model.set_min_required_samples(self.config['min_enrol_samples'])
+        timer.phase('model_load')
 
         self.log_trace('TKS: Start processing enrolment samples')
         for sample in samples:
             self.log_trace('TKS: Sample process START')
             # Get the image
-            ks_array = utils.get_sample_ks(sample)
+            ks_array = utils.get_sample_envelope(sample).decode(timer)
 
             if ks_array is None:
+                timer.count('discarded_samples', 1)
+                import simplejson
                 json_sample = simplejson.dumps(sample, indent=4, skipkeys=True)
                 trace = f"TKS: KS data is None. Skip enrolment for current sample: {json_sample}"
                 self.log_trace(trace)
+                timer.skip()
                 continue
 
-            features = tks_model.enrol(features=ks_array)
+            timer.count('samples', 1)
+            timer.count('features', len(ks_array))
+            features = tks_model.enrol(features=ks_array, fit=False)
             tks_model.add_sample(sample, features)
+            timer.phase('enrol')
+
+        # the refitted model is taken from the shared model store, so without it the model is fitted now
+        background_refit = self.config['background_refit'] and hasattr(tks_model, 'defer_fit') and \
+            self._model_store is not None
+        if background_refit:
+            # Only record the observations, the model is fitted by a notification task
+            tks_model.defer_fit()
+        else:
+            # Fit the model once with the features of all the samples
+            self.log_trace('TKS: Fit model')
+            tks_model.fit()
+        timer.phase('fit')
+        deferred_codes = 0
+        if hasattr(tks_model, 'get_deferred_codes'):
+            deferred_codes = len(tks_model.get_deferred_codes())
+            if deferred_codes > 0 and not background_refit:
+                self.log_trace(f'TKS: Fit time budget exhausted, {deferred_codes} codes deferred')
+            timer.count('deferred_codes', deferred_codes)
 
-        return result.EnrolmentResult(tks_model.to_json(), tks_model.get_percentage(), tks_model.can_analyse(),
+        model_json = tks_model.to_json()
+        timer.phase('to_json')
+        # codes deferred in background or by the fit time budget are fitted by a notification task. Without a
+        # shared model store they are fitted by the next enrolment, and the model can not analyse until then.
+        if deferred_codes > 0 and self._model_store is not None:
+            self._schedule_refit(samples, model_json)
+            timer.phase('schedule_refit')
+        self._finish_timer(timer)
+
+        return result.EnrolmentResult(model_json, tks_model.get_percentage(), tks_model.can_analyse(),
                                       used_samples=tks_model.get_used_samples())
 
     def validate_sample(self, sample, validation_id):
@@ -113,11 +476,16 @@ class TKSProvider(BaseProvider):
             :rtype: tesla_ce_provider.ValidationResult
         """
         # Check provided input
-        sample_check = utils.check_sample_ks(sample, self.accepted_mimetypes)
+        timer = self._start_timer('validate_sample')
+        sample_check = utils.check_sample_ks(sample, self.accepted_mimetypes, timer)
         if not sample_check['valid']:
+            timer.count('discarded_samples', 1)
+            self._finish_timer(timer)
             return result.ValidationResult(False, sample_check['msg'],
                                            message_code_id=sample_check['code'])
 
+        timer.count('samples', 1)
+        self._finish_timer(timer)
         return result.ValidationResult(True,
                                        contribution=1.0 / float(self.config['target_enrol_samples']))
 
@@ -132,17 +500,191 @@ class TKSProvider(BaseProvider):
             :rtype: tesla_ce_provider.VerificationResult
         """
         # Load model
-        tks_model = self._get_model_class(model)
+        timer = self._start_timer('verify')
+        tks_model = self._load_model(model)
+        timer.phase('model_load')
 
         # Check provided input
-        sample_check = utils.check_sample_ks(request, self.accepted_mimetypes)
+        sample_check = utils.check_sample_ks(request, self.accepted_mimetypes, timer)
         if not sample_check['valid']:
+            timer.count('invalid_requests', 1)
+            self._finish_timer(timer)
             return result.VerificationResult(True, error_message=sample_check['msg'],
                                              message_code=sample_check['code'])
 
         ks_data = sample_check['ks_data']
 
-        [score, samples_discarded, number_features] = tks_model.verify(ks_data, self.config)
+        session = None
+        if self._session_store is not None and request.session_id is not None:
+            verification, session = self._verify_session(request, tks_model, ks_data, timer)
+        else:
+            verification = tks_model.verify(ks_data, self.config, timer)
+        self._count_verification(timer, verification)
+
+        metrics = timer.json() if self.config['metrics_audit'] else None
+        verification_result = self._get_verification_result(verification, metrics, session)
+        timer.phase('result')
+        self._finish_timer(timer)
+
+        return verification_result
+
+    def _verify_session(self, request, tks_model, ks_data, timer):
+        """
+            Verify the features of a request not processed yet in its session, continuing the walk of the
+            decision threshold of the session
+            :param request: Verification request
+            :type request: tesla_ce_provider.models.base.Request
+            :param tks_model: Loaded model
+            :param ks_data: Keystroke features of the request
+            :type ks_data: tks.provider.features.KeystrokeFeatures
+            :param timer: Phase timer
+            :type timer: tks.provider.metrics.PhaseTimer
+            :return: Verification of the session, as given by the model, and the session features
+            :rtype: tuple
+        """
+        key = '{}:{}:{}'.format(self.config['model'], request.learner_id, request.session_id)
+        session = {'new_features': 0}
+
+        def verify_new_features(state):
+            """
+                Verify the new features of the request from the current state of the session
+                :param state: Session state, or None for a new session
+                :return: New session state, or None if the request has no new features
+            """
+            if state is None:
+                state = self._get_new_session_state()
+            start = get_new_features_start(ks_data, state['tail'])
+            session['new_features'] = len(ks_data) - start
+            timer.phase('session_load')
+            if session['new_features'] == 0:
+                return None
+
+            config = dict(self.config, start_decision_threshold=state['threshold'])
+            verification = tks_model.verify(ks_data.slice(start), config, timer)
+            state['threshold'] = verification[0]
+            state['discarded'] += verification[1]
+            state['num_features'] += verification[2]
+            state['evaluated'] += verification[4] if len(verification) > 4 else verification[2] - verification[1]
+            for name, counts in verification[3].items():
+                state['decisions'][name]['accepted'] += counts['accepted']
+                state['decisions'][name]['rejected'] += counts['rejected']
+            state['offset'] += session['new_features']
+            state['tail'] = get_session_tail(ks_data)
+            return state
+
+        # the session is updated atomically, so concurrent requests of a session do not lose each other's update
+        state = self._session_store.update(key, verify_new_features)
+        if state is None:
+            state = self._get_new_session_state()
+        if session['new_features'] > 0:
+            timer.phase('session_save')
+
+        verification = [state['threshold'], state['discarded'], state['num_features'], state['decisions'],
+                        state['evaluated']]
+        return verification, {'offset': state['offset'], 'new_features': session['new_features']}
+
+    def _get_new_session_state(self):
+        """
+            Get the verification state of a session without requests
+            :return: Session state
+            :rtype: dict
+        """
+        return {
+            'threshold': self.config['start_decision_threshold'],
+            'offset': 0,
+            'tail': [],
+            'num_features': 0,
+            'discarded': 0,
+            'evaluated': 0,
+            'decisions': DecisionEngine.get_counts(np.zeros(0, dtype=np.int8), np.zeros(0, dtype=bool)),
+        }
+
+    def verify_batch(self, requests):
+        """
+            Verify a batch of learner requests. Requests with the same model load it once, and the features of
+            all of them are scored together. The timings of the batch are sent to the metrics sink, but they
+            are not attached to the audit of each request.
+            :param requests: List of (request, model) pairs
+            :type requests: list
+            :return: Verification result of each request, in the same order
+            :rtype: list
+        """
+        verification_results = [None] * len(requests)
+        timer = self._start_timer('verify_batch')
+
+        # group the requests by model content. Requests of a session are verified in order, one by one.
+        groups = {}
+        for idx, (request, model) in enumerate(requests):
+            if self._session_store is not None and request.session_id is not None:
+                verification_results[idx] = self.verify(request, model)
+                continue
+            if model is None or 'data' not in model:
+                key = ('request', idx)
+            else:
+                key = ('model',) + self._get_model_key(model)[0]
+            groups.setdefault(key, []).append(idx)
+
+        for indexes in groups.values():
+            tks_model = self._load_model(requests[indexes[0]][1])
+            timer.phase('model_load')
+
+            # Check provided input
+            valid_indexes = []
+            ks_data_list = []
+            for idx in indexes:
+                sample_check = utils.check_sample_ks(requests[idx][0], self.accepted_mimetypes, timer)
+                if not sample_check['valid']:
+                    timer.count('invalid_requests', 1)
+                    verification_results[idx] = result.VerificationResult(True, error_message=sample_check['msg'],
+                                                                          message_code=sample_check['code'])
+                    continue
+                valid_indexes.append(idx)
+                ks_data_list.append(sample_check['ks_data'])
+
+            if len(valid_indexes) == 0:
+                continue
+
+            for idx, verification in zip(valid_indexes, tks_model.verify_batch(ks_data_list, self.config, timer)):
+                self._count_verification(timer, verification)
+                verification_results[idx] = self._get_verification_result(verification)
+            timer.phase('result')
+
+        self._finish_timer(timer)
+
+        return verification_results
+
+    @staticmethod
+    def _count_verification(timer, verification):
+        """
+            Count the features of a verification
+            :param timer: Phase timer
+            :type timer: tks.provider.metrics.PhaseTimer
+            :param verification: Verification given by the model
+            :type verification: list
+        """
+        timer.count('requests', 1)
+        timer.count('features', verification[2])
+        timer.count('discarded_features', verification[1])
+        if len(verification) > 4:
+            timer.count('evaluated_features', verification[4])
+
+    def _get_verification_result(self, verification, metrics=None, session=None):
+        """
+            Build the verification result of a request
+            :param verification: Score, discarded features, number of features, decisions and optionally the
+                                 number of scored features given by the model
+            :type verification: list
+            :param metrics: Timings and counts of the verification, attached to the audit
+            :type metrics: dict
+            :param session: Features processed in the session and new features of the request
+            :type session: dict
+            :return: Verification result
+            :rtype: tesla_ce_provider.VerificationResult
+        """
+        [score, samples_discarded, number_features, decisions] = verification[:4]
+        evaluated_features = None
+        if self.config['early_decision'] and len(verification) > 4:
+            evaluated_features = verification[4]
 
         code = result.VerificationResult.AlertCode.OK
 
@@ -152,7 +694,8 @@ class TKSProvider(BaseProvider):
             if self.config['failed_missing_data'] is True:
                 score = 0
 
-        audit = KeystrokeAudit(num_samples_discarded=samples_discarded, num_features=number_features)
+        audit = TKSAudit(num_samples_discarded=samples_discarded, num_features=number_features, decisions=decisions,
+                         metrics=metrics, evaluated_features=evaluated_features, session=session)
         return result.VerificationResult(True, result=score, code=code, audit=audit)
 
     def on_notification(self, key, info):
@@ -162,7 +705,10 @@ class TKSProvider(BaseProvider):
             :type key: str
             :param info: Information stored in the notification
             :type info: dict
-
-            self.update_or_create_notification(result.NotificationTask('key', countdown=30, info={'my_field': 3}))
         """
+        if key.startswith(REFIT_NOTIFICATION + ':'):
+            self.log_trace(f"TKS: Refit model of learner {info['learner_id']}")
+            self._refit_enrolled_model(info)
+            return
+
         raise NotImplementedError('Method not implemented on provider')
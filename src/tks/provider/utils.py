@@ -13,13 +13,132 @@
 #      You should have received a copy of the GNU Affero General Public License
 #      along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """ TeSLA CE Keystroke utility module """
-import base64
-from base64 import binascii
+import binascii
 import json
 from json.decoder import JSONDecodeError
 from tesla_ce_provider import message
+from .features import KeystrokeFeatures
+from .metrics import NULL_TIMER
 
 
+class SampleEnvelope:
+    """
+        Data URL of a sample, parsed once. The payload is decoded on first access and kept for later uses.
+    """
+    def __init__(self, data):
+        """
+            Parse the header of a data URL
+            :param data: Sample data, in the form data:<mimetype>;base64,<payload>
+            :type data: str
+        """
+        #: Sample data
+        self.data = data
+
+        #: Mimetype in the data URL
+        self.mimetype = None
+
+        #: Start and end of the base64 payload in the sample data
+        self.payload_start = 0
+        self.payload_end = 0
+
+        self._decoded = False
+        self._features = None
+
+        if data is None:
+            return
+
+        header_end = data.find(',')
+        if header_end < 0:
+            header_end = len(data)
+            self.payload_end = len(data)
+        else:
+            self.payload_start = header_end + 1
+            self.payload_end = data.find(',', self.payload_start)
+            if self.payload_end < 0:
+                self.payload_end = len(data)
+
+        # mimetype is the value between ':' and the first ';' of the header
+        mimetype_end = data.find(';', 0, header_end)
+        if mimetype_end < 0:
+            mimetype_end = header_end
+        mimetype_start = data.find(':', 0, mimetype_end)
+        if mimetype_start >= 0:
+            colon = data.find(':', mimetype_start + 1, mimetype_end)
+            mimetype = data[mimetype_start + 1:colon if colon >= 0 else mimetype_end]
+            if len(mimetype.strip()) > 0:
+                self.mimetype = mimetype
+
+    @property
+    def features(self):
+        """
+            Keystroke features in the payload
+            :return: Keystroke features or None if the payload is not valid
+            :rtype: tks.provider.features.KeystrokeFeatures
+        """
+        return self.decode()
+
+    def decode(self, timer=NULL_TIMER):
+        """
+            Get the keystroke features in the payload, decoding it if it is not decoded yet
+            :param timer: Timer of the payload decoding phases
+            :type timer: tks.provider.metrics.PhaseTimer
+            :return: Keystroke features or None if the payload is not valid
+            :rtype: tks.provider.features.KeystrokeFeatures
+        """
+        if not self._decoded:
+            self._features = self._decode(timer)
+            self._decoded = True
+        return self._features
+
+    def _decode(self, timer):
+        """
+            Decode the base64 payload and parse the keystroke features
+            :param timer: Timer of the payload decoding phases
+            :return: Keystroke features or None if the payload is not valid
+            :rtype: tks.provider.features.KeystrokeFeatures
+        """
+        if self.data is None:
+            return None
+
+        # the payload is decoded from its slice of the data, without encoding the whole data URL
+        try:
+            datab64 = binascii.a2b_base64(self.data[self.payload_start:self.payload_end])
+        except (binascii.Error, ValueError):
+            return None
+        timer.phase('payload_decode')
+
+        try:
+            ks_array = json.loads(datab64)
+        except (TypeError, UnicodeDecodeError, JSONDecodeError):
+            return None
+        timer.phase('json_loads')
+
+        try:
+            features = KeystrokeFeatures.from_json(ks_array)
+        except (AttributeError, KeyError, OverflowError, TypeError, ValueError):
+            return None
+        timer.phase('feature_parse')
+
+        return features
+
+
+def get_sample_envelope(sample):
+    """
+        Get the parsed data URL of a sample. It is cached in the sample, so the data is only decoded once.
+
+        :param sample: Sample structure
+        :type sample: tesla_ce_provider.models.base.Sample | tesla_provider.models.base.Request
+        :return: Parsed data URL
+        :rtype: SampleEnvelope
+    """
+    data = sample.data
+    envelope = getattr(sample, '_tks_envelope', None)
+    if envelope is None or envelope.data is not data:
+        envelope = SampleEnvelope(data)
+        sample._tks_envelope = envelope
+
+    return envelope
+
 
 def get_sample_ks(sample):
     """
@@ -27,51 +146,28 @@ def get_sample_ks(sample):
 
         :param sample: Sample structure
         :type sample: tesla_ce_provider.models.base.Sample | tesla_provider.models.base.Request
-        :return: Image
-        :rtype: np.Array
+        :return: Keystroke features
+        :rtype: tks.provider.features.KeystrokeFeatures
     """
-    try:
-        data = sample.data.split(',')[1]
-    except AttributeError:
-        return None
-    except IndexError:
-        data = sample.data
-
-    try:
-        datab64 = base64.b64decode(data)
-    except binascii.Error:
-        return None
-
-    try:
-        ks_array = json.loads(datab64)
-    except (TypeError, JSONDecodeError):
-        return None
-
-    for ks_line in ks_array:
-        if 'features' not in ks_line.keys():
-            return None
-
-    return ks_array
+    return get_sample_envelope(sample).features
 
 
-def check_sample_ks(sample, accepted_mimetypes=None):
+def check_sample_ks(sample, accepted_mimetypes=None, timer=NULL_TIMER):
     """
         Check sample information
         :param sample: Sample structure
         :type sample: tesla_ce_provider.models.base.Sample | tesla_provider.models.base.Request
         :param accepted_mimetypes: Accepted mimetype values
         :type accepted_mimetypes: list
+        :param timer: Timer of the payload decoding phases
+        :type timer: tks.provider.metrics.PhaseTimer
         :return: An object with the image and mimetype or the found errors
         :rtype: dict
     """
     # Check mimetype
     mimetype = None
-    try:
-        sample_mimetype = sample.data.split(',')[0].split(';')[0].split(':')[1]
-        if len(sample_mimetype.strip()) == 0:
-            sample_mimetype = None
-    except IndexError:
-        sample_mimetype = None
+    envelope = get_sample_envelope(sample)
+    sample_mimetype = envelope.mimetype
     if sample.mime_type is not None:
         mimetype = sample.mime_type
     if sample_mimetype is not None and mimetype is not None and sample_mimetype != mimetype:
@@ -98,7 +194,7 @@ def check_sample_ks(sample, accepted_mimetypes=None):
             'image': None
         }
 
-    ks_data = get_sample_ks(sample)
+    ks_data = envelope.decode(timer)
     if ks_data is None:
         return {
             'valid': False,